@@ -0,0 +1,113 @@
+"""Times DiffSolver.solve() for profiles with a growing number of links
+to show that solving the differences scales linearly with the links.
+Run it from the root of the repository:
+python3 -m benchmarks.differencesolver [COUNT ...]"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import argparse
+import time
+from types import SimpleNamespace
+from typing import List
+from typing import Tuple
+from dotmanager import differencesolver
+from dotmanager.types import InstalledLog
+from dotmanager.types import LinkDescriptor
+from dotmanager.types import ProfileResult
+
+
+def new_link(name: str, target: str) -> LinkDescriptor:
+    """Returns a link like it is generated by a profile"""
+    return {"name": "/home/user/" + name, "target": "/dotfiles/" + target,
+            "uid": 1000, "gid": 1000, "permission": 644}
+
+
+def create_case(count: int) -> Tuple[InstalledLog, ProfileResult]:
+    """Returns an installed profile with count links and a new version of
+    it. Every 20 links one link is removed, one gets a new target and one
+    gets a new name. As many links as were removed are added"""
+    installed_links = [new_link("link" + str(i), "file" + str(i))
+                       for i in range(count)]
+    new_links = []
+    for i, link in enumerate(installed_links):
+        link = dict(link)
+        if i % 20 == 1:
+            link["target"] += ".new"
+        elif i % 20 == 2:
+            link["name"] += ".new"
+        elif i % 20 == 3:
+            continue
+        new_links.append(link)
+    new_links += [new_link("added" + str(i), "added" + str(i))
+                  for i in range(count // 20)]
+    installed = {"Profile": {"name": "Profile", "links": installed_links}}
+    result = {"name": "Profile", "parent": None, "links": new_links,
+              "profiles": []}
+    return installed, result
+
+
+def time_solve(count: int) -> Tuple[float, int]:
+    """Returns how long it took to solve a case and how many operations
+    the DiffLog contains"""
+    installed, result = create_case(count)
+    # Only the comparison is timed, so the profile is not generated
+    differencesolver.generate_roots = lambda profilenames, **kwargs: [result]
+    args = SimpleNamespace(profiles=["Profile"], opt_dict=None,
+                           directory=None, parent=None)
+    solver = differencesolver.DiffSolver(installed, args)
+    start = time.perf_counter()
+    difflog = solver.solve(True)
+    return time.perf_counter() - start, len(difflog.data)
+
+
+def main(counts: List[int]) -> None:
+    """Prints the time per case and per link"""
+    print("%8s %10s %12s %10s" % ("links", "seconds", "us per link", "ops"))
+    for count in counts:
+        seconds, operations = time_solve(count)
+        print("%8d %10.3f %12.2f %10d" % (count, seconds,
+                                          seconds / count * 10**6,
+                                          operations))
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description=__doc__)
+    PARSER.add_argument("counts", type=int, nargs="*",
+                        default=[1000, 10000, 100000],
+                        help="the numbers of links to solve")
+    main(PARSER.parse_args().counts)
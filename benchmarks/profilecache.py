@@ -0,0 +1,196 @@
+"""Times the generation of root profiles with and without the profile
+cache. Every run is a new process, like every execution of Dotmanager.
+Run it from the root of the repository:
+python3 -m benchmarks.profilecache [WORKLOAD ...]"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+from typing import List
+from dotmanager import constants
+from dotmanager.dynamicfile import save_caches
+from dotmanager.profile import resolve_dynamic_files
+from dotmanager.profilecache import find_dynamic_files
+from dotmanager.profilecache import get_profile_cache
+from dotmanager.profilecache import record_dynamic_files
+from dotmanager.profilepool import generate_roots
+
+
+# The profiles of every workload. They only depend on their dotfiles,
+# so they set cacheable = True
+WORKLOADS = {
+    # Many links, but nothing else. Validating the cached result repeats
+    # the same dotfile lookups, so the cache barely helps
+    "links": """
+from dotmanager.profile import Profile
+
+class Bench(Profile):
+    cacheable = True
+
+    def generate(self):
+        for i in range(3000):
+            link("file%d" % i, directory="links/dir%d" % (i % 30))
+""",
+    # A profile module that imports libraries to compute its links.
+    # A cached result doesn't import the module at all
+    "imports": """
+import asyncio
+import email.mime.multipart
+import http.server
+import unittest
+import xml.dom.minidom
+from dotmanager.profile import Profile
+
+class Bench(Profile):
+    cacheable = True
+
+    def generate(self):
+        for i in range(30):
+            link("file%d" % i, directory="imports")
+""",
+    # A profile whose generate() does expensive work that only depends
+    # on its options, e.g. rendering names from a large table
+    "compute": """
+import hashlib
+from dotmanager.profile import Profile
+
+class Bench(Profile):
+    cacheable = True
+
+    def generate(self):
+        for i in range(30):
+            digest = b"file%d" % i
+            for _ in range(20000):
+                digest = hashlib.sha256(digest).digest()
+            link("file%d" % i, directory="compute", name=digest.hex()[:8])
+"""
+}
+
+
+def create_dotfiles(directory: str, workload: str) -> None:
+    """Creates the dotfiles and the profile of a workload"""
+    os.makedirs(os.path.join(directory, "files"))
+    os.makedirs(os.path.join(directory, "profiles"))
+    os.makedirs(os.path.join(directory, "cache"))
+    for i in range(3000):
+        with open(os.path.join(directory, "files", "file" + str(i)),
+                  "w") as file:
+            file.write(str(i))
+    with open(os.path.join(directory, "profiles", "bench.py"), "w") as file:
+        file.write(WORKLOADS[workload])
+    # Files that were modified too recently are never trusted
+    past = time.time() - 60
+    for root, dirs, files in os.walk(directory):
+        for name in dirs + files:
+            os.utime(os.path.join(root, name), (past, past))
+
+
+def generate(directory: str, cache: bool) -> float:
+    """Generates the profile like the DiffSolver does and returns how long
+    it took. The profile module is imported within the timed part"""
+    constants.loadconfig(None)
+    constants.PROFILE_FILES = os.path.join(directory, "profiles")
+    constants.TARGET_FILES = os.path.join(directory, "files")
+    constants.CACHE_DIRECTORY = os.path.join(directory, "cache")
+    constants.PROFILE_CACHE = cache
+    sys.path.append(constants.PROFILE_FILES)
+    start = time.perf_counter()
+    results = generate_roots(["Bench"])
+    dynamic_files = [dynamic_file for result in results
+                     for dynamic_file in find_dynamic_files(result)]
+    for result in results:
+        resolve_dynamic_files(result)
+    record_dynamic_files(dynamic_files)
+    save_caches()
+    if cache:
+        get_profile_cache().save()
+    return time.perf_counter() - start
+
+
+def time_runs(directory: str, cache: bool, runs: int) -> List[float]:
+    """Returns the times of runs in new processes. The first run fills
+    the caches and is not counted"""
+    times = []
+    for _ in range(runs + 1):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.profilecache", "--run",
+             directory] + (["--cache"] if cache else []),
+            stdout=subprocess.PIPE, check=True
+        ).stdout
+        times.append(float(output))
+    return times[1:]
+
+
+def main(workloads: List[str], runs: int) -> None:
+    """Prints the median time of every workload with and without cache"""
+    print("%10s %12s %12s" % ("workload", "uncached ms", "cached ms"))
+    for workload in workloads:
+        medians: Dict[bool, float] = {}
+        with tempfile.TemporaryDirectory() as directory:
+            create_dotfiles(directory, workload)
+            for cache in (False, True):
+                times = time_runs(directory, cache, runs)
+                medians[cache] = statistics.median(times) * 1000
+        print("%10s %12.1f %12.1f" % (workload, medians[False],
+                                      medians[True]))
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description=__doc__)
+    PARSER.add_argument("workloads", nargs="*", default=list(WORKLOADS),
+                        help="the workloads to run: " + ", ".join(WORKLOADS))
+    PARSER.add_argument("--runs", type=int, default=7,
+                        help="the number of runs per workload and setting")
+    PARSER.add_argument("--run", help=argparse.SUPPRESS)
+    PARSER.add_argument("--cache", action="store_true",
+                        help=argparse.SUPPRESS)
+    ARGS = PARSER.parse_args()
+    for WORKLOAD in ARGS.workloads:
+        if WORKLOAD not in WORKLOADS:
+            PARSER.error("unknown workload '" + WORKLOAD + "'")
+    if ARGS.run:
+        print(generate(ARGS.run, ARGS.cache))
+    else:
+        main(ARGS.workloads, ARGS.runs)
@@ -0,0 +1,227 @@
+"""Provides the blacklist of paths that must not be modified without
+--superforce. All entries are compiled once into a single matcher"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import re
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Pattern
+from typing import Tuple
+from dotmanager import constants
+from dotmanager import utils
+from dotmanager.errors import PreconditionError
+from dotmanager.types import Path
+
+
+# Characters that have a special meaning in a regular expression
+REGEX_META = ".^$*+?{}[]\\|()"
+# Characters that repeat the preceding character
+REGEX_QUANTIFIERS = "*+?{"
+
+# A node of the prefix trie: the next nodes by character and the tails
+# of all entries whose literal prefix ends here (None if the prefix
+# already is the whole entry)
+TrieNode = Tuple[Dict[str, "TrieNode"], List[Optional[Pattern]]]
+
+
+class Blacklist:
+    """Matches paths against the entries of all black.list files. Every
+    entry is a regular expression that is searched in the path. Most entries
+    start with a literal path like "/etc/" or "/boot/", so those literal
+    prefixes are stored in a trie and only the rest of those entries needs
+    to be matched. All other entries are compiled into a single regular
+    expression, so every path is matched only once"""
+    def __init__(self, entries: List[str]) -> None:
+        self.entries = entries
+        self.__trie = ({}, [])
+        self.__anchored_trie = ({}, [])
+        regexes = []
+        for entry in entries:
+            try:
+                re.compile(entry)
+            except re.error as err:
+                raise PreconditionError("The entry '" + entry + "' of " +
+                                        "your black.list is not a valid " +
+                                        "regular expression: " + str(err))
+            if entry.startswith("^"):
+                trie = self.__anchored_trie
+                prefix, tail = split_literal_prefix(entry[1:])
+            else:
+                trie = self.__trie
+                entry = strip_wildcard(entry)
+                prefix, tail = split_literal_prefix(entry)
+            if prefix:
+                node = trie
+                for char in prefix:
+                    node = node[0].setdefault(char, ({}, []))
+                node[1].append(re.compile(tail) if tail else None)
+            else:
+                regexes.append(entry)
+        self.__regexes = [re.compile(regex) for regex in regexes]
+        self.__regex = None
+        if regexes:
+            try:
+                self.__regex = re.compile("|".join("(?:" + regex + ")"
+                                                   for regex in regexes))
+            except re.error:
+                # Some regexes (eg with global flags) can't be combined
+                pass
+
+    def matches(self, path: Path) -> bool:
+        """Returns if the path matches any entry of the blacklist"""
+        if self.__match_trie(self.__anchored_trie, path, 0):
+            return True
+        starts = self.__trie[0]
+        if starts:
+            for start, char in enumerate(path):
+                if char in starts and self.__match_trie(self.__trie,
+                                                        path, start):
+                    return True
+        if self.__regex is not None:
+            return self.__regex.search(path) is not None
+        return any(regex.search(path) for regex in self.__regexes)
+
+    @staticmethod
+    def __match_trie(node: TrieNode, path: Path, start: int) -> bool:
+        """Returns if any entry of the trie matches the path at start"""
+        pos = start
+        while True:
+            for tail in node[1]:
+                if tail is None or tail.match(path, pos):
+                    return True
+            if pos == len(path) or path[pos] not in node[0]:
+                return False
+            node = node[0][path[pos]]
+            pos += 1
+
+
+def strip_wildcard(regex: str) -> str:
+    """Removes a leading ".*" from a regular expression. It makes no
+    difference if the expression is found somewhere in a string, but
+    it can make searching much slower"""
+    while (regex.startswith(".*") and
+           regex[2:3] not in ("+", "{") and not regex.startswith(".*?+")):
+        regex = regex[3:] if regex.startswith(".*?") else regex[2:]
+    return regex
+
+
+def split_literal_prefix(regex: str) -> Tuple[str, str]:
+    """Splits a regular expression into the literal string that every match
+    starts with and the regular expression that matches the rest"""
+    if has_alternation(regex):
+        return "", regex
+    prefix = ""
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == "\\":
+            # Only escaped punctuation is literal, eg "\." or "\/"
+            if i + 1 == len(regex) or regex[i + 1].isalnum():
+                break
+            literal = regex[i + 1]
+            length = 2
+        elif char in REGEX_META:
+            break
+        else:
+            literal = char
+            length = 1
+        # A quantified character is not part of every match
+        following = regex[i + length:i + length + 1]
+        if following and following in REGEX_QUANTIFIERS:
+            break
+        prefix += literal
+        i += length
+    return prefix, regex[i:]
+
+
+def has_alternation(regex: str) -> bool:
+    """Returns if a regular expression contains a "|" that
+    is not enclosed by a group"""
+    depth = 0
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == "\\":
+            i += 1
+        elif char == "[":
+            # Skip the whole character class. A "]" directly after
+            # "[" or "[^" is part of the class
+            i += 1
+            if regex[i:i + 1] == "^":
+                i += 1
+            if regex[i:i + 1] == "]":
+                i += 1
+            while i < len(regex) and regex[i] != "]":
+                if regex[i] == "\\":
+                    i += 1
+                i += 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+# The blacklist is loaded once per run and shared by all interpreters
+###############################################################################
+
+_blacklist = None
+_search_paths = None
+
+
+def get_blacklist() -> Blacklist:
+    """Returns the blacklist of all black.list files in the
+    config search paths. They will be loaded on the first call"""
+    global _blacklist, _search_paths
+    search_paths = list(constants.CONFIG_SEARCH_PATHS)
+    if _blacklist is None or _search_paths != search_paths:
+        entries = []
+        for bl in utils.find_files("black.list", search_paths):
+            with open(bl, "r") as file:
+                for line in file.readlines():
+                    entry = line.strip()
+                    if entry:
+                        entries.append(entry)
+        _blacklist = Blacklist(entries)
+        _search_paths = search_paths
+    return _blacklist
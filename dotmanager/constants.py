@@ -48,23 +48,26 @@ from dotmanager.utils import find_files
 from dotmanager.utils import get_user_env_var
 from dotmanager.utils import normpath
 
-# Search paths for config files
+# Search paths for config files. The config directory of the user is
+# added by loadconfig(), because the environment of the user can't be
+# looked up before the arguments were parsed
 CONFIG_SEARCH_PATHS = [
     os.path.join(
         os.path.dirname(os.path.dirname(sys.modules[__name__].__file__)),
         "data"
     ),
-    "/etc/dotmanager",
-    os.path.join(
-        get_user_env_var('XDG_CONFIG_HOME', normpath('~/.config')),
-        "dotmanager"
-    )
+    "/etc/dotmanager"
 ]
+# The config files that were actually found and loaded
+CONFIG_FILES = []
 
 # Version numbers, seperated by underscore. First part is the version of
 # the manager. The second part (after the underscore) is the version of
 # the installed-file schema.
-VERSION = "1.6.8_3"
+VERSION = "1.23.0_4"
+# Older schemas that only lack keys of the current one. Installed-files
+# with these schemas are upgraded when they are read
+COMPATIBLE_SCHEMAS = [3]
 
 
 # Setting defaults/fallback values for all constants
@@ -79,6 +82,13 @@ MAKEDIRS = False
 # Settings
 COLOR = True
 DECRYPT_PWD = None
+DECRYPT_JOBS = 4
+JOURNAL = False
+INSTALLED_BACKEND = "json"
+PRIVILEGE_SEPARATION = False
+PROFILE_CACHE = False
+PROFILE_JOBS = 1
+SKIP_UNCHANGED = False
 BACKUP_EXTENSION = "bak"
 PROFILE_FILES = "profiles"
 TARGET_FILES = "files"
@@ -86,6 +96,7 @@ TARGET_FILES = "files"
 # Internal values
 INSTALLED_FILE = "data/installed/%s.json"
 INSTALLED_FILE_BACKUP = INSTALLED_FILE + "." + BACKUP_EXTENSION
+CACHE_DIRECTORY = "data/cache"
 DIR_DEFAULT = ""
 FALLBACK = {
     "directory": "$HOME",
@@ -116,15 +127,24 @@ def loadconfig(config_file: Path, installed_filename: str = "default") -> None:
     """Loads a config file from a given path.
     Falls back to default if no path was provided"""
     global OKGREEN, WARNING, FAIL, ENDC, BOLD, UNDERLINE, NOBOLD
-    global DUISTRATEGY, FORCE, VERBOSE, MAKEDIRS, DECRYPT_PWD
+    global DUISTRATEGY, FORCE, VERBOSE, MAKEDIRS, DECRYPT_PWD, DECRYPT_JOBS
+    global JOURNAL, INSTALLED_BACKEND, PRIVILEGE_SEPARATION, PROFILE_CACHE
     global BACKUP_EXTENSION, PROFILE_FILES, TARGET_FILES, INSTALLED_FILE_BACKUP
     global COLOR, INSTALLED_FILE, DEFAULTS, DIR_DEFAULT, FALLBACK
+    global CACHE_DIRECTORY, CONFIG_FILES, PROFILE_JOBS, SKIP_UNCHANGED
 
     # Init config file
+    user_config = os.path.join(
+        get_user_env_var('XDG_CONFIG_HOME', normpath('~/.config')),
+        "dotmanager"
+    )
+    if user_config not in CONFIG_SEARCH_PATHS:
+        CONFIG_SEARCH_PATHS.append(user_config)
     cfg_files = find_files("dotmanager.ini", CONFIG_SEARCH_PATHS)
 
     if config_file:
         cfg_files.append(config_file)
+    CONFIG_FILES = cfg_files
 
     config = configparser.ConfigParser()
 
@@ -143,6 +163,23 @@ def loadconfig(config_file: Path, installed_filename: str = "default") -> None:
 
     # Settings
     DECRYPT_PWD = config.get("Settings", "decryptPwd", fallback=DECRYPT_PWD)
+    DECRYPT_JOBS = config.getint("Settings", "decryptJobs",
+                                 fallback=DECRYPT_JOBS)
+    JOURNAL = config.getboolean("Settings", "journal", fallback=JOURNAL)
+    INSTALLED_BACKEND = config.get("Settings", "installedBackend",
+                                   fallback=INSTALLED_BACKEND)
+    if INSTALLED_BACKEND not in ("json", "sqlite"):
+        raise PreconditionError("The installedBackend needs to be either " +
+                                "'json' or 'sqlite'.")
+    PRIVILEGE_SEPARATION = config.getboolean("Settings",
+                                             "privilegeSeparation",
+                                             fallback=PRIVILEGE_SEPARATION)
+    PROFILE_CACHE = config.getboolean("Settings", "profileCache",
+                                      fallback=PROFILE_CACHE)
+    PROFILE_JOBS = config.getint("Settings", "profileJobs",
+                                 fallback=PROFILE_JOBS)
+    SKIP_UNCHANGED = config.getboolean("Settings", "skipUnchanged",
+                                       fallback=SKIP_UNCHANGED)
     BACKUP_EXTENSION = config.get("Settings", "backupExtension",
                                   fallback=BACKUP_EXTENSION)
     PROFILE_FILES = config.get("Settings", "profileFiles",
@@ -151,6 +188,8 @@ def loadconfig(config_file: Path, installed_filename: str = "default") -> None:
     COLOR = config.getboolean("Settings", "color", fallback=COLOR)
 
     # Internal values
+    INSTALLED_FILE = os.path.splitext(INSTALLED_FILE)[0] + "." + \
+        INSTALLED_BACKEND
     INSTALLED_FILE_BACKUP = INSTALLED_FILE + "." + BACKUP_EXTENSION
     if not COLOR:
         OKGREEN = WARNING = FAIL = ENDC = BOLD = UNDERLINE = NOBOLD = ''
@@ -200,5 +239,6 @@ def loadconfig(config_file: Path, installed_filename: str = "default") -> None:
     DIR_DEFAULT = normpath(DIR_DEFAULT)
     INSTALLED_FILE = normpath(INSTALLED_FILE)
     INSTALLED_FILE_BACKUP = normpath(INSTALLED_FILE_BACKUP)
+    CACHE_DIRECTORY = normpath(CACHE_DIRECTORY)
     TARGET_FILES = normpath(TARGET_FILES)
     PROFILE_FILES = normpath(PROFILE_FILES)
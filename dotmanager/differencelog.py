@@ -37,15 +37,22 @@
 ###############################################################################
 
 
+import logging
+import time
 from typing import Optional
 from typing import List
 from dotmanager.interpreters import Interpreter
+from dotmanager.interpreters import Operation
 from dotmanager.types import LinkDescriptor
 from dotmanager.types import DiffLogData
+from dotmanager.types import DiffOperation
 from dotmanager.types import Path
 from dotmanager.utils import get_date_time_now
 
 
+logger = logging.getLogger("root")
+
+
 class DiffLog():
     """This class holds the DiffLogData and provides helpers to
     create and insert DiffLogOperations. Furthermore it provides
@@ -103,17 +110,57 @@ class DiffLog():
 
     def run_interpreter(self, *interpreters: List[Interpreter]) -> None:
         """Run a list of interpreters for all DiffOperations in DiffLogData"""
+        self.run_pipeline(interpreters)
+
+    def run_pipeline(self, *passes: List[Interpreter]) -> None:
+        """Run several passes of interpreters for all DiffOperations in
+        DiffLogData. All interpreters of a pass are run in a single
+        iteration over the DiffLogData, but a pass doesn't start until
+        the previous pass processed all operations"""
+        for interpreters in passes:
+            if not interpreters:
+                continue
+            start = time.perf_counter()
+            self.__run_pass(interpreters)
+            names = [type(interpreter).__name__
+                     for interpreter in interpreters]
+            logger.debug("Pass of " + ", ".join(names) + " took %.3fs",
+                         time.perf_counter() - start)
+
+    def __run_pass(self, interpreters: List[Interpreter]) -> None:
+        """Run a pass of interpreters for all DiffOperations in DiffLogData"""
         # Initialize interpreters
         for interpreter in interpreters:
             interpreter.set_difflog_data(self.data)
+        # The operations of all interpreters are looked up only once
+        # for every kind of DiffOperation
+        dispatch = {}
+
+        def call(dop: DiffOperation) -> None:
+            try:
+                operations = dispatch[dop["operation"]]
+            except KeyError:
+                operations = get_operations(interpreters, dop["operation"])
+                dispatch[dop["operation"]] = operations
+            for operation in operations:
+                operation(dop)
         # Send a "start" operation to indicate that operations will follow
         # so interpreters can implement _op_start
-        for interpreter in interpreters:
-            interpreter.call_operation({"operation": "start"})
+        call({"operation": "start"})
         # Run interpreters for every operation
-        for operation in self.data:
-            for interpreter in interpreters:
-                interpreter.call_operation(operation)
+        for dop in self.data:
+            call(dop)
         # And send a "fin" operation when we are finished
-        for interpreter in interpreters:
-            interpreter.call_operation({"operation": "fin"})
+        call({"operation": "fin"})
+
+
+def get_operations(interpreters: List[Interpreter],
+                   operation: str) -> List[Operation]:
+    """Returns the implemented behavior of all interpreters
+    for a kind of DiffOperation"""
+    operations = []
+    for interpreter in interpreters:
+        implemented = interpreter.get_operation(operation)
+        if implemented is not None:
+            operations.append(implemented)
+    return operations
@@ -37,14 +37,29 @@
 ###############################################################################
 
 
-import copy
+from collections import deque
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterable
 from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 from dotmanager import constants
 from dotmanager.differencelog import DiffLog
+from dotmanager.dynamicfile import save_caches
 from dotmanager.errors import FatalError
+from dotmanager.profile import resolve_dynamic_files
+from dotmanager.profilecache import find_dynamic_files
+from dotmanager.profilecache import get_profile_cache
+from dotmanager.profilecache import record_dynamic_files
+from dotmanager.profilepool import generate_roots
+from dotmanager.profilepool import parallel_generation
 from dotmanager.types import InstalledLog
+from dotmanager.types import LinkDescriptor
 from dotmanager.types import ProfileResult
-from dotmanager.utils import import_profile_class
 from dotmanager.utils import log_warning
 
 
@@ -58,6 +73,9 @@ class DiffSolver():
         self.installed = installed
         self.difflog = None
         self.defs = {}
+        self.subprofiles = None
+        # The names of all generated profiles in the order they were solved
+        self.solved = []
         self.default_options = args.opt_dict
         self.default_dir = args.directory
         self.parent_arg = args.parent
@@ -65,6 +83,8 @@ class DiffSolver():
     def solve(self, link: bool) -> DiffLog:
         """This will create an DiffLog from the set profiles"""
         self.defs = {}
+        self.subprofiles = None
+        self.solved = []
         self.difflog = DiffLog()
         if link:
             self.__generate_links()
@@ -86,26 +106,30 @@ class DiffSolver():
         """Append to difflog that we want to remove a profile,
         all it's subprofiles and all their links"""
         # Recursive call for all subprofiles
-        subprofiles = []
-        for installed_name, installed_dict in self.installed.items():
-            if ("parent" in installed_dict and
-                    installed_dict["parent"] == profile_name):
-                subprofiles.append(installed_name)
-        self.__generate_unlinks(subprofiles)
+        self.__generate_unlinks(self.__installed_subprofiles(profile_name))
         # We are removing all symlinks of this profile before we
         # remove the profile from the installed file
-        installed_links = copy.deepcopy(self.installed[profile_name]["links"])
-        for installed_link in installed_links:
+        for installed_link in self.installed[profile_name]["links"]:
             self.difflog.remove_link(installed_link["name"], profile_name)
         self.difflog.remove_profile(profile_name)
 
+    def __installed_subprofiles(self, profile_name: str) -> List[str]:
+        """Returns the names of all installed subprofiles of a profile"""
+        if self.subprofiles is None:
+            self.subprofiles = {}
+            for installed_name, installed_dict in self.installed.items():
+                if installed_name[0] != "@" and "parent" in installed_dict:
+                    self.subprofiles.setdefault(installed_dict["parent"],
+                                                []).append(installed_name)
+        return self.subprofiles.get(profile_name, [])
+
     def __generate_links(self) -> None:
         """Fill the difflog with all operations needed to link all profiles"""
-        allpnames = []
+        allpnames = set()
 
         def add_profilenames(profile):
             """Recursively add all subprofiles to allpnames"""
-            allpnames.append(profile["name"])
+            allpnames.add(profile["name"])
             for prof in profile["profiles"]:
                 add_profilenames(prof)
 
@@ -117,50 +141,48 @@ class DiffSolver():
         if self.default_dir:
             pargs["directory"] = self.default_dir
 
-        plist = []
-        for profilename in self.profilenames:
-            # Profiles are generated
-            plist.append(import_profile_class(profilename)(**pargs).get())
+        # Profiles are generated or taken from the cache
+        with parallel_generation():
+            plist = generate_roots(self.profilenames, **pargs)
+        dynamic_files = [dynamic_file for profileresult in plist
+                         for dynamic_file in find_dynamic_files(profileresult)]
         for profileresult in plist:
+            # Wait until all dynamic files are generated
+            resolve_dynamic_files(profileresult)
             add_profilenames(profileresult)
+        record_dynamic_files(dynamic_files)
+        # Remember the decrypted files and generated profiles for the next run
+        save_caches()
+        if constants.PROFILE_CACHE:
+            get_profile_cache().save()
         for profileresult in plist:
             # Generate difflog from diff between links and installed
             self.__generate_profile_link(profileresult, allpnames,
                                          self.parent_arg)
 
     def __generate_profile_link(self, profile_dict: ProfileResult,
-                                all_profilenames: List[str],
+                                all_profilenames: Set[str],
                                 parent_name: str = None) -> None:
         """Resolves the differences between a single profile and the installed
         ones and appends the difflog for those. If parent_name is None the
         profile is treated as a root profile"""
-        def symlinks_similar(symlink1, symlink2):
-            return symlink1["name"] == symlink2["name"] or \
-                   symlink1["target"] == symlink2["target"]
-
-        def symlinks_equal(symlink1, symlink2):
-            return symlink1["name"] == symlink2["name"] and \
-                   symlink1["target"] == symlink2["target"] and \
-                   symlink1["uid"] == symlink2["uid"] and \
-                   symlink1["gid"] == symlink2["gid"] and \
-                   symlink1["permission"] == symlink2["permission"]
-
         profile_new = False
         profile_changed = False
 
         # Load the links from the InstalledLog
         profile_name = profile_dict["name"]
+        self.solved.append(profile_name)
         installed_profile = None
         if profile_name in self.installed:
             installed_profile = self.installed[profile_name]
-            installed_links = copy.deepcopy(installed_profile["links"])
+            installed_links = installed_profile["links"]
         else:
             installed_links = []
             # The profile wasn't installed
             self.difflog.add_profile(profile_name, parent_name)
             profile_new = True
         # And from the new profile
-        new_links = copy.deepcopy(profile_dict["links"])
+        new_links = profile_dict["links"]
 
         # Now we can compare installed_dict and profile_dict and write
         # the difflog that resolves these differences
@@ -170,75 +192,74 @@ class DiffSolver():
         #   - are removed (occure only in installed_links)
         #   - are updated (two links that differ, but only in one property)
         #   - are added (occure only in new_links)
-        # Whenever we find a link to be unchanged/removed/etc. we will remove
-        # it from new_links and installed_links, so in the end both lists
-        # need to be empty.
+        # Whenever we find a link to be unchanged/removed/etc. we will mark
+        # it as resolved in installed_left and new_left, so in the end
+        # both need to be empty. Links are looked up in dictionaries and
+        # whenever multiple links match, the first one in order is used.
+        installed_left = dict(enumerate(installed_links))
+        new_left = dict(enumerate(new_links))
 
         # Check unchanged
+        new_by_key = index_links(enumerate(new_links), link_key)
         count = 0
-        for installed_link in installed_links[:]:
-            for new_link in new_links[:]:
-                if symlinks_equal(installed_link, new_link):
-                    # Link in new profile is the same as a installed one,
-                    # so ignore it
-                    installed_links.remove(installed_link)
-                    new_links.remove(new_link)
-                    count += 1
-                    break
-        if count > 0:
-            msg = str(count)
-            msg += " links will be left untouched, no changes here..."
-            self.difflog.add_info(profile_name, msg)
+        for i, installed_link in enumerate(installed_links):
+            j = pop_first(new_by_key.get(link_key(installed_link)), new_left)
+            if j is not None:
+                # Link in new profile is the same as a installed one,
+                # so ignore it
+                del installed_left[i]
+                del new_left[j]
+                count += 1
+        add_untouched_info(self.difflog, profile_name, count)
 
         # Check removed
-        for installed_link in installed_links[:]:
-            remove = True
-            for new_link in new_links[:]:
-                if symlinks_similar(installed_link, new_link):
-                    remove = False
-                    break
-            if remove:
+        new_names = {link["name"] for link in new_left.values()}
+        new_targets = {link["target"] for link in new_left.values()}
+        for i, installed_link in list(installed_left.items()):
+            if (installed_link["name"] not in new_names and
+                    installed_link["target"] not in new_targets):
                 # Installed link is not similiar to any new link, so remove it
                 profile_changed = True
                 self.difflog.remove_link(installed_link["name"], profile_name)
-                installed_links.remove(installed_link)
+                del installed_left[i]
 
         # Check changed and added links
-        for new_link in new_links[:]:
-            add = True
-            for installed_link in installed_links[:]:
-                if symlinks_similar(installed_link, new_link):
-                    # Update links that changed in only one or two properties
-                    profile_changed = True
-                    self.difflog.update_link(installed_link, new_link,
-                                             profile_name)
-                    installed_links.remove(installed_link)
-                    new_links.remove(new_link)
-                    add = False
-                    break
-            if add:
+        installed_by_name = index_links(installed_left.items(),
+                                        lambda link: link["name"])
+        installed_by_target = index_links(installed_left.items(),
+                                          lambda link: link["target"])
+        for j, new_link in list(new_left.items()):
+            # Use the first installed link that is similar to the new one
+            by_name = installed_by_name.get(new_link["name"])
+            by_target = installed_by_target.get(new_link["target"])
+            first_by_name = peek_first(by_name, installed_left)
+            first_by_target = peek_first(by_target, installed_left)
+            candidates = [i for i in (first_by_name, first_by_target)
+                          if i is not None]
+            profile_changed = True
+            if candidates:
+                # Update links that changed in only one or two properties
+                i = min(candidates)
+                self.difflog.update_link(dict(installed_left.pop(i)),
+                                         dict(new_link), profile_name)
+            else:
                 # There was no similar installed link, so we need to add it
-                profile_changed = True
-                self.difflog.add_link(new_link, profile_name)
-                new_links.remove(new_link)
+                self.difflog.add_link(dict(new_link), profile_name)
+            del new_left[j]
 
-        # We removed every symlinks from new_links and installed_links when
+        # We removed every symlinks from new_left and installed_left when
         # we found the correct action for them. If they aren't empty now,
         # something obiously went wrong. We are checking for this
         # invariant to spot possible logical errors.
-        if new_links or installed_links:
+        if new_left or installed_left:
             raise FatalError("Couldn't resolve differences between the " +
                              "installed and the new version of profile " +
                              profile_name)
 
         # Remove all installed subprofiles that doesnt occur in profile anymore
         if installed_profile is not None:
-            installed_subprofiles = set()
+            installed_subprofiles = self.__installed_subprofiles(profile_name)
             profiles_subprofiles = set()
-            for installed_name, installed_dict in self.installed.items():
-                if ("parent" in installed_dict and
-                        installed_dict["parent"] == profile_name):
-                    installed_subprofiles.add(installed_name)
             if "profiles" in profile_dict:
                 for subprofile in profile_dict["profiles"]:
                     profiles_subprofiles.add(subprofile["name"])
@@ -265,3 +286,49 @@ class DiffSolver():
                 self.__generate_profile_link(subprofile,
                                              all_profilenames,
                                              profile_name)
+
+
+def link_key(link: LinkDescriptor) -> Tuple[Any, ...]:
+    """Returns the properties of a link that need to be equal
+    for two links to be equal"""
+    return (link["name"], link["target"], link["uid"], link["gid"],
+            link["permission"])
+
+
+def index_links(links: Iterable[Tuple[int, LinkDescriptor]],
+                key: Callable[[LinkDescriptor], Any]
+                ) -> Dict[Any, Deque[int]]:
+    """Maps the key of every link to the positions of all links
+    with this key in ascending order"""
+    index = {}
+    for i, link in links:
+        index.setdefault(key(link), deque()).append(i)
+    return index
+
+
+def peek_first(positions: Optional[Deque[int]],
+               left: Dict[int, LinkDescriptor]) -> Optional[int]:
+    """Returns the first position that wasn't resolved yet. Resolved
+    positions are dropped on the way"""
+    if positions is None:
+        return None
+    while positions and positions[0] not in left:
+        positions.popleft()
+    return positions[0] if positions else None
+
+
+def pop_first(positions: Optional[Deque[int]],
+              left: Dict[int, LinkDescriptor]) -> Optional[int]:
+    """Removes and returns the first position that wasn't resolved yet"""
+    first = peek_first(positions, left)
+    if first is not None:
+        positions.popleft()
+    return first
+
+
+def add_untouched_info(difflog: DiffLog, profile_name: str,
+                       count: int) -> None:
+    """Tells the user how many links of a profile are left untouched"""
+    if count > 0:
+        msg = str(count) + " links will be left untouched, no changes here..."
+        difflog.add_info(profile_name, msg)
@@ -0,0 +1,157 @@
+"""This module provides file descriptors of directories, so that syscalls
+can be issued relative to them, and executes the filesystem part of link
+operations with them"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import os
+from collections import OrderedDict
+from typing import List
+from typing import Tuple
+from dotmanager.types import DiffOperation
+from dotmanager.types import LinkDescriptor
+from dotmanager.types import Path
+
+
+class Directories:
+    """Keeps the file descriptors of recently used directories open. All
+    syscalls for an entry of a directory are issued relative to it, so the
+    path of the directory is only resolved once by the kernel and it can't
+    be replaced by another directory while its entries are modified"""
+    def __init__(self, size: int = 64) -> None:
+        self.size = size
+        # path -> file descriptor, the least recently used one first
+        self.fds = OrderedDict()
+
+    def open(self, path: Path) -> int:
+        """Returns the file descriptor of a directory"""
+        fd = self.fds.pop(path, None)
+        if fd is None:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+            if len(self.fds) >= self.size:
+                os.close(self.fds.popitem(last=False)[1])
+        self.fds[path] = fd
+        return fd
+
+    def split(self, name: Path) -> Tuple[int, str]:
+        """Returns the file descriptor of the directory of a path and the
+        name of the entry in that directory"""
+        dirname, basename = os.path.split(name)
+        return self.open(dirname), basename
+
+    def lexists(self, name: Path) -> bool:
+        """Returns if a path exists without following symlinks"""
+        try:
+            fd, basename = self.split(name)
+            os.stat(basename, dir_fd=fd, follow_symlinks=False)
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+        return True
+
+    def makedirs(self, dirname: Path) -> List[Path]:
+        """Creates a directory and all of its missing parents. The created
+        directories get the owner of the deepest directory that exists.
+        Returns all created directories"""
+        missing = []
+        parent = dirname
+        while True:
+            try:
+                fd = self.open(parent)
+                break
+            except FileNotFoundError:
+                parent, basename = os.path.split(parent)
+                missing.append(basename)
+        stat = os.fstat(fd)
+        created = []
+        for basename in reversed(missing):
+            os.mkdir(basename, dir_fd=fd)
+            os.chown(basename, stat.st_uid, stat.st_gid, dir_fd=fd,
+                     follow_symlinks=False)
+            parent = os.path.join(parent, basename)
+            fd = self.open(parent)
+            created.append(parent)
+        return created
+
+    def close(self) -> None:
+        """Closes all file descriptors"""
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds.clear()
+
+
+def create_symlink(symlink: LinkDescriptor, directories: Directories,
+                   force: bool) -> List[Path]:
+    """Creates a symlink with its owner and permission. Missing directories
+    are created as well. Returns all created directories"""
+    name = symlink["name"]
+    created = []
+    try:
+        fd, basename = directories.split(name)
+    except FileNotFoundError:
+        created = directories.makedirs(os.path.dirname(name))
+        fd, basename = directories.split(name)
+    # Remove existing symlink
+    if force and directories.lexists(name):
+        os.unlink(basename, dir_fd=fd)
+    # Create new symlink
+    os.symlink(symlink["target"], basename, dir_fd=fd)
+    # Set owner and permission
+    os.chown(basename, symlink["uid"], symlink["gid"], dir_fd=fd,
+             follow_symlinks=False)
+    if symlink["permission"] != 644:
+        os.chmod(basename, int(str(symlink["permission"]), 8), dir_fd=fd)
+    return created
+
+
+def remove_symlink(name: Path, directories: Directories) -> None:
+    """Removes a symlink"""
+    fd, basename = directories.split(name)
+    os.unlink(basename, dir_fd=fd)
+
+
+def execute_operation(dop: DiffOperation, directories: Directories,
+                      force: bool) -> List[Path]:
+    """Executes the filesystem part of a link operation. Returns all
+    directories that were created"""
+    if dop["operation"] == "add_l":
+        return create_symlink(dop["symlink"], directories, force)
+    if dop["operation"] == "remove_l":
+        remove_symlink(dop["symlink_name"], directories)
+        return []
+    remove_symlink(dop["symlink1"]["name"], directories)
+    return create_symlink(dop["symlink2"], directories, force)
@@ -0,0 +1,353 @@
+"""Provides an index of all dotfiles in the target directory, so targets
+can be looked up without walking the whole directory tree every time"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import os
+import re
+import time
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+from dotmanager import constants
+from dotmanager import utils
+from dotmanager.errors import PreconditionError
+from dotmanager.types import Path
+
+
+# Regexes that assert something about the end of a path can't be used
+# to prune directories
+UNPRUNABLE_REGEX = re.compile(r"\$|\\Z|\\B|\(\?!")
+
+# The cached listing of a directory: its mtime in nanoseconds, the names of
+# all files and the names of all subdirectories
+DirEntry = List[Union[int, List[str]]]
+# Listings of directories modified less than this many nanoseconds before
+# the walk are not cached, because the mtime could be too coarse
+RACY_NS = 2 * 10**9
+
+# Maps the tag of a dotfile (None for untagged files) to all paths that
+# share the same base name and tag, in the order they were found
+TagMap = Dict[Optional[str], List[Path]]
+
+
+class DotfileIndex:
+    """Indexes all dotfiles of a directory by their base name (the filename
+    without tag) and their tag. Built once, it turns every target lookup
+    into a dictionary lookup instead of a walk of the whole directory.
+    The listings of all directories are cached on disk, so the next run
+    only needs to stat every directory and lists only those that changed"""
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        # All dotfiles as tuple of directory and filename in walk order
+        self.files = []
+        # base name -> tag -> paths
+        self.targets = {}
+        # directory -> listing, that is cached for the next run
+        self.dirs = {}
+        self.__build()
+
+    def __build(self) -> None:
+        """Walks through the directory and indexes every dotfile
+        that is not on the ignore list"""
+        # load ignore list
+        ignorelist_path = os.path.join(self.directory, ".dotignore")
+        if os.path.exists(ignorelist_path):
+            with open(ignorelist_path, "r") as file:
+                self.ignore = DotIgnore(self.directory, file.readlines())
+        else:
+            self.ignore = DotIgnore(self.directory, [])
+        # load the listings of the last run
+        cache = utils.load_cache("dotfiles")
+        if cache is None or cache["directory"] != self.directory:
+            cached_dirs = {}
+        else:
+            cached_dirs = cache["dirs"]
+        # walk through dotfile directory
+        for root, files in self.__walk(cached_dirs):
+            for name in files:
+                # check if file should be ignored
+                if not self.ignore.ignores_file(os.path.join(root, name)):
+                    self.add(root, name)
+        if self.dirs != cached_dirs:
+            utils.save_cache("dotfiles", {"directory": self.directory,
+                                          "dirs": self.dirs})
+
+    def __walk(self, cached_dirs: Dict[Path, DirEntry]
+               ) -> Iterator[Tuple[Path, List[str]]]:
+        """Walks top-down through the directory like os.walk(), but only
+        lists directories again whose mtime changed since the last run
+        and doesn't descend into ignored directories"""
+        # A directory that was modified just now could be modified again
+        # without changing its mtime, so its listing is not trusted later
+        racy = time.time_ns() - RACY_NS
+        stack = [self.directory]
+        while stack:
+            root = stack.pop()
+            try:
+                mtime = os.stat(root).st_mtime_ns
+            except OSError:
+                continue
+            entry = cached_dirs.get(root)
+            if entry is None or entry[0] != mtime:
+                entry = [mtime, *self.__listdir(root)]
+            if mtime < racy:
+                self.dirs[root] = entry
+            yield root, entry[1]
+            # Reversed, so subdirectories are walked in order of the listing.
+            # Ignored subdirectories are pruned and never walked at all
+            for name in reversed(entry[2]):
+                path = os.path.join(root, name)
+                if not self.ignore.ignores_dir(path):
+                    stack.append(path)
+
+    @staticmethod
+    def __listdir(root: Path) -> Tuple[List[str], List[str]]:
+        """Returns the names of all files and of all subdirectories that
+        need to be walked. Symlinks to directories are not followed"""
+        files = []
+        dirs = []
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        files.append(entry.name)
+                    elif not entry.is_symlink():
+                        dirs.append(entry.name)
+        except OSError:
+            pass
+        return files, dirs
+
+    def add(self, root: Path, name: str) -> None:
+        """Adds a single dotfile to the index"""
+        tag, base = split_tag(name)
+        self.files.append((root, name))
+        tagmap = self.targets.setdefault(base, {})
+        tagmap.setdefault(tag, []).append(os.path.join(root, name))
+
+    def find_target(self, target: str, tags: List[str]) -> Optional[Path]:
+        """Find the correct target version in the repository to link to"""
+        tagmap = self.targets.get(target, {})
+        # Use the file that matches the earliest defined tag
+        for tag in tags:
+            if tag in tagmap:
+                return tagmap[tag][0]
+        # Seems like nothing was found, but we searched only files
+        # with tags so far. Trying without tags as fallback
+        return self.find_exact_target(target)
+
+    def find_exact_target(self, target: str) -> Optional[Path]:
+        """Find the exact target in the repository to link to"""
+        tag, base = split_tag(target)
+        targets = self.targets.get(base, {}).get(tag, [])
+        # Whithout tags there shall be only one file that matches the target
+        if len(targets) > 1:
+            msg = "There are multiple targets that match: '" + target + "'"
+            for tmp_target in targets:
+                msg += "\n  " + tmp_target
+            raise ValueError(msg)
+        elif not targets:
+            # Ooh, nothing found
+            return None
+        # Return found target
+        return targets[0]
+
+    def find_pattern(self, pattern: str) -> Dict[str, TagMap]:
+        """Returns the tags and paths of all dotfiles whose
+        base name matches the pattern"""
+        regex = re.compile(pattern)
+        return {base: tagmap for base, tagmap in self.targets.items()
+                if regex.fullmatch(base) is not None}
+
+
+class DotIgnore:
+    """Matches paths against the entries of a .dotignore file. Every entry
+    is a regular expression that is searched in the absolute path of a
+    dotfile. After a line "syntax: gitignore" the following entries are
+    gitignore-like patterns relative to the dotfile directory instead,
+    until "syntax: regex" switches back. All entries of the same kind are
+    compiled into a single regular expression, so every path is matched
+    only once"""
+    def __init__(self, directory: Path, lines: List[str]) -> None:
+        self.directory = directory
+        regexes = []
+        prunable_regexes = []
+        file_patterns = []
+        dir_patterns = []
+        syntax = "regex"
+        for line in lines:
+            entry = line.strip()
+            if not entry:
+                continue
+            if entry.startswith("syntax:"):
+                syntax = entry[7:].strip()
+                if syntax not in ("regex", "gitignore"):
+                    raise PreconditionError("Unknown syntax '" + syntax +
+                                            "' in your .dotignore")
+            elif syntax == "regex":
+                regexes.append(entry)
+                # A regex that matches the path of a directory matches
+                # every path below it, as long as it doesn't assert
+                # anything about the end of the path
+                if not UNPRUNABLE_REGEX.search(entry):
+                    prunable_regexes.append(entry)
+            elif entry.startswith("!"):
+                utils.log_warning("Negated patterns are not supported in " +
+                                  "your .dotignore. Skipping '" + entry + "'")
+            elif not entry.startswith("#"):
+                if entry.endswith("/"):
+                    dir_patterns.append(gitignore_to_regex(entry[:-1]))
+                else:
+                    file_patterns.append(gitignore_to_regex(entry))
+        self.__file_regex = compile_any(regexes)
+        self.__dir_regex = compile_any(prunable_regexes)
+        self.__file_pattern = compile_any(file_patterns)
+        self.__dir_pattern = compile_any(file_patterns + dir_patterns)
+
+    def ignores_file(self, path: Path) -> bool:
+        """Returns if a dotfile is on the ignore list"""
+        if self.__file_regex and self.__file_regex(path):
+            return True
+        return bool(self.__file_pattern and
+                    self.__file_pattern(self.__relpath(path)))
+
+    def ignores_dir(self, path: Path) -> bool:
+        """Returns if all dotfiles inside of a directory are on the
+        ignore list, so it doesn't need to be walked"""
+        if self.__dir_regex and self.__dir_regex(path + "/"):
+            return True
+        return bool(self.__dir_pattern and
+                    self.__dir_pattern(self.__relpath(path)))
+
+    def __relpath(self, path: Path) -> str:
+        """Returns the path relative to the dotfile directory"""
+        return path[len(self.directory):].lstrip("/")
+
+
+def compile_any(regexes: List[str]) -> Optional[Callable[[str], bool]]:
+    """Compiles a list of regular expressions into a single function that
+    returns if any of them is found in a string"""
+    if not regexes:
+        return None
+    compiled = []
+    for regex in regexes:
+        try:
+            compiled.append(re.compile(regex))
+        except re.error as err:
+            raise PreconditionError("The entry '" + regex + "' of your " +
+                                    ".dotignore is not a valid regular " +
+                                    "expression: " + str(err))
+    try:
+        combined = re.compile("|".join("(?:" + regex + ")"
+                                       for regex in regexes))
+    except re.error:
+        # Some regexes (eg with global flags) can't be combined
+        return lambda string: any(regex.search(string) for regex in compiled)
+    return lambda string: combined.search(string) is not None
+
+
+def gitignore_to_regex(pattern: str) -> str:
+    """Translates a gitignore pattern into a regular expression that
+    matches a path relative to the dotfile directory"""
+    # Patterns with a slash are relative to the dotfile directory,
+    # otherwise they match a file or directory in any depth
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        elif char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            content = pattern[i + 1:end]
+            if content[0] == "!":
+                content = "^" + content[1:]
+            regex += "[" + content + "]"
+            i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+    if anchored:
+        return "^" + regex + "$"
+    return "^(?:.*/)?" + regex + "$"
+
+
+def split_tag(name: str) -> Tuple[Optional[str], str]:
+    """Splits the filename of a dotfile into its tag and base name"""
+    if "%" in name:
+        tag, base = name.split("%", 1)
+        return tag, base
+    return None, name
+
+
+# The index is built once per run and shared by all lookups
+###############################################################################
+
+_index = None
+
+
+def get_dotfile_index() -> DotfileIndex:
+    """Returns the index of the dotfile directory. It will be
+    built on the first call"""
+    global _index
+    if _index is None or _index.directory != constants.TARGET_FILES:
+        _index = DotfileIndex(constants.TARGET_FILES)
+    return _index
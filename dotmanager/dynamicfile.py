@@ -45,12 +45,26 @@ be linked instead and makes sure that user-made changes are preserved.
 import hashlib
 import logging
 import os
+import tempfile
+import threading
+import time
+import warnings
 from abc import abstractmethod
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from shutil import copyfile
 from subprocess import PIPE
 from subprocess import Popen
+from typing import BinaryIO
+from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 from dotmanager import constants
+from dotmanager import utils
+from dotmanager.dotfileindex import RACY_NS
 from dotmanager.errors import FatalError
 from dotmanager.types import Path
 from dotmanager.utils import normpath
@@ -59,14 +73,39 @@ from dotmanager.utils import find_target
 
 logger = logging.getLogger("root")
 
+# Dynamic files are generated and copied in chunks of this size
+CHUNK_SIZE = 1024 * 1024
+KERNEL_CHUNK_SIZE = 64 * 1024 * 1024
+# The permission of generated files. mkstemp() only allows the owner to
+# read them, but they should be created like any other file
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
 
 class DynamicFile:
     """This abstract class is the base for any dynamic generated
     file. It provides the write functionality and its path"""
     def __init__(self, name: str) -> None:
         self.name = name
-        self.md5sum = None
+        self.checksum = None
         self.sources = []
+        # The job that generates the file in the background (if any)
+        self.job = None
+
+    @property
+    def md5sum(self) -> Optional[str]:
+        """Deprecated alias of checksum. Generated files aren't named by
+        their md5 sum anymore"""
+        warnings.warn("DynamicFile.md5sum is deprecated, use checksum",
+                      DeprecationWarning, stacklevel=2)
+        return self.checksum
+
+    @md5sum.setter
+    def md5sum(self, value: Optional[str]) -> None:
+        warnings.warn("DynamicFile.md5sum is deprecated, use checksum",
+                      DeprecationWarning, stacklevel=2)
+        self.checksum = value
 
     @property
     @abstractmethod
@@ -74,11 +113,17 @@ class DynamicFile:
         """This constant needs to be implemented by subclasses"""
         raise NotImplementedError
 
-    @abstractmethod
-    def _generate_file(self) -> bytearray:
+    def _generate_chunks(self) -> Iterator[bytes]:
         """This method is used to generate the contents of the
-        dynamic file from sources by returning it as bytearray"""
-        pass
+        dynamic file from sources by yielding it in chunks. Subclasses
+        that only implement _generate_file() are generated in one chunk"""
+        yield bytes(self._generate_file())
+
+    def _generate_file(self) -> bytearray:
+        """This method was used to generate the contents of the dynamic
+        file as bytearray before they were generated in chunks. Implement
+        _generate_chunks() instead"""
+        raise NotImplementedError
 
     def add_source(self, target) -> List[Path]:
         """This method is used to automatically find the sources to use."""
@@ -87,53 +132,287 @@ class DynamicFile:
     def update(self) -> None:
         """Gets the newest version of the file and writes it
         if it is not in its subdir yet"""
-        # Generate file and calc checksum
-        file_bytes = self._generate_file()
-        self.md5sum = hashlib.md5(file_bytes).hexdigest()
-        # If this version of the file (with same checksum) doesn't exist,
-        # write it to the correct location
-        if not os.path.isfile(self.getpath()):
-            file = open(self.getpath(), "wb")
-            file.write(file_bytes)
-            file.flush()
-            # Also create a backup that can be used to restore the original
-            copyfile(self.getpath(),
-                     self.getpath() + "." + constants.BACKUP_EXTENSION)
+        # Some files know their checksum before they are generated
+        self.checksum = self._calc_checksum()
+        if self.checksum is not None and os.path.isfile(self.__path()):
+            return
+        # Generate the file into a temporary file
+        fd, tmp = tempfile.mkstemp(dir=self.getdir(), prefix=self.name + ".")
+        try:
+            with open(fd, "wb") as file:
+                self.checksum = self._write_file(file)
+            # If this version of the file (with same checksum) doesn't exist,
+            # move it to the correct location
+            path = self.__path()
+            if not os.path.isfile(path):
+                os.chmod(tmp, FILE_MODE)
+                # Also create a backup that can be used to restore the original
+                copyfile(tmp, path + "." + constants.BACKUP_EXTENSION)
+                os.replace(tmp, path)
+                get_file_stats().record(path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _calc_checksum(self) -> Optional[str]:
+        """Returns the checksum of the file if it can be calculated
+        without generating the file"""
+        return None
+
+    def _write_file(self, file: BinaryIO) -> str:
+        """Generates the file in chunks and writes them to a file.
+        Returns the checksum of the generated file"""
+        hasher = new_hasher()
+        for chunk in self._generate_chunks():
+            hasher.update(chunk)
+            file.write(chunk)
+        return hasher.hexdigest()
+
+    def __getstate__(self) -> Dict:
+        """Dynamic files are sent from the processes that generate
+        profiles after they were generated"""
+        state = dict(self.__dict__)
+        if self.job is not None:
+            state["job"] = FinishedJob(self.job)
+        return state
 
     def getpath(self) -> Path:
-        """Returns the path of the generated file"""
-        # Dynamicfiles are stored with its md5sum in the name to detect chages
-        return os.path.join(self.getdir(), self.name + "#" + self.md5sum)
+        """Returns the path of the generated file. Waits until the file
+        is generated, if this is done in the background"""
+        if self.job is not None:
+            # Raises the exception of the job if it failed
+            self.job.result()
+        return self.__path()
+
+    def __path(self) -> Path:
+        """Returns the path of the generated file without waiting"""
+        # Dynamicfiles are stored with their checksum in the name to detect
+        # changes
+        return os.path.join(self.getdir(), self.name + "#" + self.checksum)
 
-    def getdir(self) -> Path:
+    @classmethod
+    def getdir(cls) -> Path:
         """Returns the path of the directory that hold the generated file"""
-        return normpath(os.path.join("data", self.SUBDIR))
+        return normpath(os.path.join("data", cls.SUBDIR))
+
+
+class FinishedJob:
+    """The outcome of a job that generated a dynamic file in another
+    process. Raises the exception of the job like a future"""
+    def __init__(self, job: Future) -> None:
+        self.error = job.exception()
+
+    def result(self) -> None:
+        """Raises the exception of the job if it failed"""
+        if self.error is not None:
+            raise self.error
 
 
 class EncryptedFile(DynamicFile):
     """This is an implementation of a dynamic files that allows
     to decrypt encrypted files and link them on the fly"""
     SUBDIR = "decrypted"
+    # Set after the first decryption. Until then gpg might still
+    # ask for a password, so only one file is decrypted at a time
+    unlocked = False
 
-    def _generate_file(self) -> bytearray:
+    def update(self) -> None:
+        """Decrypts the file in the background. All files are decrypted
+        in parallel by a pool of DECRYPT_JOBS workers. Files that didn't
+        change since they were decrypted the last time are not decrypted
+        again"""
+        manifest = get_manifest()
+        self.checksum, record = manifest.lookup(self.sources[0])
+        if self.checksum is not None and os.path.isfile(self.getpath()):
+            return
+        if not constants.DECRYPT_PWD and not EncryptedFile.unlocked:
+            self.__decrypt(record)
+            EncryptedFile.unlocked = True
+        else:
+            self.job = get_executor().submit(self.__decrypt, record)
+
+    def __decrypt(self, record: Dict) -> None:
+        """Decrypts the file and remembers the checksum of its plaintext"""
+        super().update()
+        get_manifest().record(self.sources[0], record, self.checksum)
+
+    def _generate_chunks(self) -> Iterator[bytes]:
         # Use OpenPGP to decrypt the file
         # We never provided sources, so the file will be found by find_target
         encryped_file = self.sources[0]
-        tmp = os.path.join(self.getdir(), self.name)
-        args = ["gpg", "-q", "-d", "--yes", "-o", tmp, encryped_file]
-        process = Popen(args, stdin=PIPE)
-        # Type in password
-        if constants.DECRYPT_PWD:
-            process.communicate(bytearray(constants.DECRYPT_PWD, "utf-8"))
-        else:
-            logger.info("Tipp: You can set a password in the dotmanagers " +
-                        "config that will be used for all encrypted files")
-            process.communicate()
-        # Remove the decrypted file. It will be written by the update function
-        # of the super class to its correct location.
-        result = open(tmp, "rb").read()
-        os.remove(tmp)
-        return result
+        # The decrypted file is read from the output of gpg and will be
+        # written by the update function of the super class
+        args = ["gpg", "-q", "-d", encryped_file]
+        process = Popen(args, stdin=PIPE, stdout=PIPE)
+        try:
+            # Type in password
+            if constants.DECRYPT_PWD:
+                process.stdin.write(bytearray(constants.DECRYPT_PWD, "utf-8"))
+            else:
+                logger.info("Tipp: You can set a password in the " +
+                            "dotmanagers config that will be used for " +
+                            "all encrypted files")
+            process.stdin.close()
+        except BrokenPipeError:
+            # gpg already exited, so we will get its exit code
+            pass
+        try:
+            yield from iter(lambda: process.stdout.read(CHUNK_SIZE), b"")
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode != 0:
+            raise RuntimeError("gpg failed to decrypt '" + encryped_file +
+                               "' (exit code " + str(process.returncode) + ")")
+
+
+class DecryptionManifest:
+    """Remembers the checksum of the plaintext of every encrypted file,
+    so files don't need to be decrypted to find out if they changed.
+    Files are identified by their stat (mtime, size and inode) and if it
+    changed, by the hash of their ciphertext"""
+    def __init__(self) -> None:
+        cache = utils.load_cache("decrypted")
+        # file -> {"stat": [mtime, size, inode], "hash": sha1,
+        #          "checksum": checksum of the plaintext}
+        self.files = {} if cache is None else cache["files"]
+        self.__changed = False
+        # Files are recorded by the workers
+        self.__lock = threading.Lock()
+
+    def lookup(self, file: Path) -> Tuple[Optional[str], Dict]:
+        """Returns the checksum of the plaintext of an encrypted file, if
+        the file didn't change since its checksum was recorded. Also returns
+        the stat and hash of the file, to record its new checksum"""
+        stat = get_stat(file)
+        entry = self.files.get(file)
+        if entry is not None and stat is not None and entry["stat"] == stat:
+            return entry["checksum"], entry
+        with open(file, "rb") as encrypted_file:
+            sha1 = hashlib.sha1(encrypted_file.read()).hexdigest()
+        record = {"stat": stat, "hash": sha1}
+        if entry is not None and entry["hash"] == sha1:
+            # The file was only touched
+            self.record(file, record, entry["checksum"])
+            return entry["checksum"], record
+        return None, record
+
+    def record(self, file: Path, record: Dict, checksum: str) -> None:
+        """Records the checksum of the plaintext of an encrypted file"""
+        with self.__lock:
+            self.files[file] = {"stat": record["stat"],
+                                "hash": record["hash"],
+                                "checksum": checksum}
+            self.__changed = True
+
+    def merge(self, files: Dict[Path, Dict]) -> None:
+        """Adds the checksums that another process recorded"""
+        if files:
+            with self.__lock:
+                self.files.update(files)
+                self.__changed = True
+
+    def prune(self) -> None:
+        """Forgets all files whose decrypted version doesn't exist anymore"""
+        checksums = set()
+        for name in os.listdir(EncryptedFile.getdir()):
+            if "#" in name:
+                checksums.add(name.rsplit("#", 1)[1])
+        with self.__lock:
+            for file, entry in list(self.files.items()):
+                if entry["checksum"] not in checksums:
+                    del self.files[file]
+                    self.__changed = True
+
+    def save(self) -> None:
+        """Writes the manifest to the cache"""
+        with self.__lock:
+            if self.__changed:
+                utils.save_cache("decrypted", {"files": self.files})
+                self.__changed = False
+
+
+def get_stat(file: Path) -> Optional[List[int]]:
+    """Returns the mtime, size and inode of a file. Returns None if the
+    file was modified so recently that its mtime can't be trusted"""
+    stat = os.stat(file)
+    if stat.st_mtime_ns > time.time_ns() - RACY_NS:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+
+class DynamicFileStats:
+    """Remembers the stat (mtime, size and inode) of every generated file,
+    so changes that the user made to it can be detected without hashing
+    the whole file"""
+    def __init__(self) -> None:
+        cache = utils.load_cache("dynamicfiles")
+        # file -> [mtime, size, inode]
+        self.files = {} if cache is None else cache["files"]
+        self.__changed = False
+        # Files are recorded by the workers
+        self.__lock = threading.Lock()
+
+    def record(self, file: Path) -> None:
+        """Records the stat of an unmodified generated file. Files that
+        were modified too recently are not recorded, because a change in
+        the same tick wouldn't change their stat"""
+        stat = get_stat(file)
+        with self.__lock:
+            if stat is not None:
+                self.files[file] = stat
+            elif self.files.pop(file, None) is None:
+                return
+            self.__changed = True
+
+    def is_unchanged(self, file: Path) -> bool:
+        """Returns if a generated file still has its recorded stat"""
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            return False
+        return (self.files.get(file) ==
+                [stat.st_mtime_ns, stat.st_size, stat.st_ino])
+
+    def merge(self, files: Dict[Path, List[int]]) -> None:
+        """Adds the stats that another process recorded"""
+        if files:
+            with self.__lock:
+                self.files.update(files)
+                self.__changed = True
+
+    def prune(self) -> None:
+        """Forgets all files that don't exist anymore"""
+        with self.__lock:
+            for file in list(self.files):
+                if not os.path.isfile(file):
+                    del self.files[file]
+                    self.__changed = True
+
+    def save(self) -> None:
+        """Writes the stats to the cache"""
+        with self.__lock:
+            if self.__changed:
+                utils.save_cache("dynamicfiles", {"files": self.files})
+                self.__changed = False
+
+
+def new_hasher() -> "hashlib.blake2b":
+    """Returns the hash that is used for the names of new dynamic files.
+    Its hexdigest has the same length as an md5 sum"""
+    return hashlib.blake2b(digest_size=16)
+
+
+def has_checksum(file: Path, checksum: str) -> bool:
+    """Returns if the content of a file has a checksum. Dynamic files that
+    were generated by older versions use md5 sums instead"""
+    hasher = new_hasher()
+    md5 = hashlib.md5()
+    with open(file, "rb") as dynamic_file:
+        for chunk in iter(lambda: dynamic_file.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            md5.update(chunk)
+    return checksum in (hasher.hexdigest(), md5.hexdigest())
 
 
 class SplittedFile(DynamicFile):
@@ -141,8 +420,131 @@ class SplittedFile(DynamicFile):
     to join multiple dotfiles together to one dotfile"""
     SUBDIR = "merged"
 
-    def _generate_file(self) -> bytearray:
-        result = bytearray()
+    def _generate_chunks(self) -> Iterator[bytes]:
+        for file in self.sources:
+            with open(file, "rb") as source:
+                yield from iter(lambda: source.read(CHUNK_SIZE), b"")
+
+    def _calc_checksum(self) -> Optional[str]:
+        # The checksum is calculated from the sources, so they only
+        # need to be copied if this version of the file doesn't exist yet
+        hasher = new_hasher()
+        self.__stats = []
         for file in self.sources:
-            result.extend(open(file, "rb").read())
-        return result
+            with open(file, "rb") as source:
+                self.__stats.append(get_version(source.fileno()))
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _write_file(self, file: BinaryIO) -> str:
+        # Let the kernel copy the sources
+        for path, stat in zip(self.sources, self.__stats):
+            with open(path, "rb") as source:
+                if get_version(source.fileno()) != stat:
+                    break
+                append_file(source.fileno(), file.fileno())
+                if get_version(source.fileno()) != stat:
+                    break
+        else:
+            return self.checksum
+        # A source changed since the checksum was calculated
+        file.seek(0)
+        file.truncate()
+        return super()._write_file(file)
+
+
+def find_garbage(used_files: Set[Path]) -> List[Path]:
+    """Returns all generated dynamic files that are not in used_files.
+    The backup of a dynamic file is only returned with the file itself"""
+    garbage = []
+    backup_extension = "." + constants.BACKUP_EXTENSION
+    for directory in (EncryptedFile.getdir(), SplittedFile.getdir()):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            # Only generated files have a checksum in their name
+            if "#" not in entry.name or not entry.is_file(
+                    follow_symlinks=False):
+                continue
+            file = entry.path
+            if file.endswith(backup_extension):
+                file = file[:-len(backup_extension)]
+            if file not in used_files:
+                garbage.append(entry.path)
+    return garbage
+
+
+def get_version(fd: int) -> Tuple[int, int, int]:
+    """Returns the mtime, size and inode of an opened file"""
+    stat = os.fstat(fd)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def append_file(source_fd: int, target_fd: int) -> None:
+    """Appends the content of a file to another one. The data is copied
+    by the kernel without passing it through userspace if possible"""
+    copied = 0
+    for copy in (getattr(os, "copy_file_range", None),
+                 lambda src, dst, count: os.sendfile(dst, src, None, count)):
+        if copy is None:
+            continue
+        try:
+            while True:
+                count = copy(source_fd, target_fd, KERNEL_CHUNK_SIZE)
+                if count == 0:
+                    return
+                copied += count
+        except OSError:
+            # Not supported for these files, try the next way to copy them
+            if copied:
+                raise
+    while True:
+        chunk = os.read(source_fd, CHUNK_SIZE)
+        if not chunk:
+            return
+        while chunk:
+            chunk = chunk[os.write(target_fd, chunk):]
+
+
+# The workers and the caches are shared by all dynamic files
+###############################################################################
+
+_executor = None
+_manifest = None
+_file_stats = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Returns the pool of workers that decrypt files in the background.
+    It will be created on the first call"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max(1, constants.DECRYPT_JOBS))
+    return _executor
+
+
+def get_manifest() -> DecryptionManifest:
+    """Returns the manifest of all decrypted files. It will be
+    loaded on the first call"""
+    global _manifest
+    if _manifest is None:
+        _manifest = DecryptionManifest()
+    return _manifest
+
+
+def get_file_stats() -> DynamicFileStats:
+    """Returns the stats of all generated files. They will be
+    loaded on the first call"""
+    global _file_stats
+    if _file_stats is None:
+        _file_stats = DynamicFileStats()
+    return _file_stats
+
+
+def save_caches() -> None:
+    """Writes the manifest and the stats of all generated files"""
+    get_manifest().save()
+    get_file_stats().save()
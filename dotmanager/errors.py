@@ -52,6 +52,18 @@ class CustomError(Exception):
         return constants.FAIL + self._message + constants.ENDC
     message = property(getmessage)
 
+    def __reduce__(self):
+        """Errors are sent from the processes that generate profiles
+        without calling __init__() again"""
+        return restore_error, (type(self), self.__dict__)
+
+
+def restore_error(error_class: type, state: dict) -> CustomError:
+    """Recreates a CustomError that was sent by another process"""
+    error = Exception.__new__(error_class)
+    error.__dict__.update(state)
+    return error
+
 
 class FatalError(CustomError):
     """A custom exception for all errors that violate expected invariants"""
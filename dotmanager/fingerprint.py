@@ -0,0 +1,160 @@
+"""This module fingerprints the inputs of an installation, so that runs in
+which nothing changed can be detected without generating any profile"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import hashlib
+import json
+import os
+import stat
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from dotmanager import constants
+from dotmanager.differencelog import DiffLog
+from dotmanager.differencesolver import add_untouched_info
+from dotmanager.dotfileindex import get_dotfile_index
+from dotmanager.profilecache import Recording
+from dotmanager.profilecache import is_trusted
+from dotmanager.profilecache import is_valid
+from dotmanager.profileindex import get_profile_index
+from dotmanager.types import InstalledLog
+from dotmanager.utils import get_uid
+
+
+# Arguments that only change what is printed
+OUTPUT_ARGS = ("jobs", "log", "quiet", "silent", "verbose")
+# Lookups that are already covered by the hashes of the profile and the
+# dotfile directory, so they don't need to be checked one by one
+COVERED_LOOKUPS = ("dotmanager.profile.find_pattern",
+                   "dotmanager.profilecache.module_hash",
+                   "dotmanager.profilecache.profile_module",
+                   "dotmanager.utils.find_target")
+
+
+def hash_inputs(args: Any) -> str:
+    """Returns a hash of the version, the arguments, the config files and
+    the state of the profile and dotfile directory"""
+    index = get_dotfile_index()
+    inputs = {
+        "version": constants.VERSION,
+        "uid": get_uid(),
+        "args": {key: value for key, value in vars(args).items()
+                 if key not in OUTPUT_ARGS},
+        "config": [read_file(file) for file in constants.CONFIG_FILES],
+        "profiles": get_profile_index().stats,
+        "dotfiles": [index.directory, index.dirs,
+                     read_file(os.path.join(index.directory, ".dotignore"))]
+    }
+    inputs = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(inputs.encode()).hexdigest()
+
+
+def hash_installed(installed: InstalledLog) -> str:
+    """Returns a hash of all installed profiles"""
+    profiles = {key: value for key, value in installed.items()
+                if key[0] != "@"}
+    profiles = json.dumps(profiles, sort_keys=True)
+    return hashlib.sha256(profiles.encode()).hexdigest()
+
+
+def read_file(file: str) -> Optional[str]:
+    """Returns the content of a file or None if it doesn't exist"""
+    try:
+        with open(file) as content:
+            return content.read()
+    except OSError:
+        return None
+
+
+def create_fingerprint(inputs: str, installed: InstalledLog,
+                       recording: Recording,
+                       profiles: List[str]) -> Optional[Dict]:
+    """Creates the fingerprint of an installation that was just executed.
+    Returns None if the profiles depend on something that wasn't recorded"""
+    lookups = [lookup for lookup in recording.lookups.values()
+               if lookup[0] not in COVERED_LOOKUPS]
+    if not recording.cacheable or not is_trusted(lookups):
+        return None
+    return {
+        "inputs": inputs,
+        "installed": hash_installed(installed),
+        "lookups": lookups,
+        "warnings": recording.warnings,
+        "profiles": profiles
+    }
+
+
+def is_unchanged(fingerprint: Optional[Dict], inputs: str,
+                 installed: InstalledLog) -> bool:
+    """Checks if an installation would change nothing, because all inputs
+    are the same as for the fingerprint and all links are still intact"""
+    return (fingerprint is not None and
+            fingerprint["inputs"] == inputs and
+            fingerprint["installed"] == hash_installed(installed) and
+            is_valid(fingerprint["lookups"]) and
+            links_intact(installed, fingerprint["profiles"]))
+
+
+def links_intact(installed: InstalledLog, profiles: List[str]) -> bool:
+    """Checks with a single lstat() per link if all links of the profiles
+    still exist with the same target and owner"""
+    for profilename in profiles:
+        if profilename not in installed:
+            return False
+        for link in installed[profilename]["links"]:
+            try:
+                link_stat = os.lstat(link["name"])
+                if (not stat.S_ISLNK(link_stat.st_mode) or
+                        link_stat.st_uid != link["uid"] or
+                        link_stat.st_gid != link["gid"] or
+                        os.readlink(link["name"]) != link["target"]):
+                    return False
+            except OSError:
+                return False
+    return True
+
+
+def untouched_difflog(fingerprint: Dict, installed: InstalledLog) -> DiffLog:
+    """Returns the DiffLog of an installation that changes nothing"""
+    difflog = DiffLog()
+    for profilename in fingerprint["profiles"]:
+        add_untouched_info(difflog, profilename,
+                           len(installed[profilename]["links"]))
+    return difflog
@@ -1,5 +1,6 @@
 """This module provides simple functions for users to
-retrieve system information."""
+retrieve system information. All calls are recorded, so cached
+ProfileResults are not reused if the information changed."""
 
 ###############################################################################
 #
@@ -42,9 +43,11 @@ import os
 import re
 import shutil
 import platform
+from dotmanager.profilecache import recorded
 from dotmanager.utils import get_current_username
 
 
+@recorded
 def distribution() -> str:
     """Returns the current running distribution"""
     for entry in os.listdir("/etc"):
@@ -55,26 +58,31 @@ def distribution() -> str:
     return None
 
 
+@recorded
 def hostname() -> str:
     """Returns the host name of the device"""
     return platform.node()
 
 
+@recorded
 def is_64bit() -> bool:
     """Returns if the device is running a 64bit os"""
     return True if platform.architecture()[0] == "64bit" else False
 
 
+@recorded
 def kernel() -> str:
     """Returns the current kernel release of the device"""
     return platform.release()
 
 
+@recorded
 def pkg_installed(pkg_name: str) -> bool:
     """Returns if the given package is installed on the device"""
     return bool(shutil.which(pkg_name))
 
 
+@recorded
 def username() -> str:
     """Returns the username that executed dotmanager"""
     return get_current_username()
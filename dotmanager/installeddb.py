@@ -0,0 +1,217 @@
+"""This module implements the SQLite backend of the installed-file"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import json
+import os
+import sqlite3
+from typing import Dict
+from typing import List
+from typing import Optional
+from dotmanager import constants
+from dotmanager.types import DiffOperation
+from dotmanager.types import InstalledLog
+from dotmanager.types import LinkDescriptor
+from dotmanager.types import Path
+from dotmanager.utils import get_gid
+from dotmanager.utils import get_uid
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    name TEXT PRIMARY KEY,
+    parent TEXT,
+    installed TEXT NOT NULL,
+    updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    id INTEGER PRIMARY KEY,
+    profile TEXT NOT NULL REFERENCES profiles(name) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    target TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    gid INTEGER NOT NULL,
+    permission INTEGER NOT NULL,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_name ON links(name);
+CREATE INDEX IF NOT EXISTS links_target ON links(target);
+CREATE INDEX IF NOT EXISTS links_profile ON links(profile, name);
+CREATE INDEX IF NOT EXISTS profiles_parent ON profiles(parent);
+"""
+
+LINK_COLUMNS = ("name", "target", "uid", "gid", "permission", "date")
+
+
+class InstalledDatabase:
+    """An installed-file that is stored in a SQLite database. Instead of
+    rewriting the whole file, every executed operation is applied to the
+    database. All operations of an execution are a single transaction,
+    that is committed when the database is closed"""
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        created = not os.path.isfile(path)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        if created:
+            os.chown(path, get_uid(), get_gid())
+
+    def read(self, profilenames: Optional[List[str]] = None
+             ) -> InstalledLog:
+        """Reads the database into an InstalledLog. If profilenames are
+        given, only these profiles are read"""
+        installed = {"@version": constants.VERSION}
+        for key, value in self.connection.execute("SELECT * FROM meta"):
+            installed[key] = json.loads(value) if key == "@fingerprint" \
+                else value
+        profile_filter = link_filter = ""
+        if profilenames is not None:
+            placeholders = ", ".join("?" * len(profilenames))
+            profile_filter = " WHERE name IN (" + placeholders + ")"
+            link_filter = " WHERE profile IN (" + placeholders + ")"
+        else:
+            profilenames = []
+        query = "SELECT name, parent, installed, updated FROM profiles" + \
+                profile_filter + " ORDER BY rowid"
+        for name, parent, installed_date, updated in \
+                self.connection.execute(query, profilenames):
+            profile = {"name": name, "links": [],
+                       "installed": installed_date, "updated": updated}
+            if parent is not None:
+                profile["parent"] = parent
+            installed[name] = profile
+        query = "SELECT profile, " + ", ".join(LINK_COLUMNS) + \
+                " FROM links" + link_filter + " ORDER BY id"
+        for row in self.connection.execute(query, profilenames):
+            installed[row[0]]["links"].append(dict(zip(LINK_COLUMNS,
+                                                       row[1:])))
+        return installed
+
+    def write(self, installed: InstalledLog) -> None:
+        """Replaces the content of the database with an InstalledLog"""
+        with self.connection:
+            self.connection.execute("DELETE FROM links")
+            self.connection.execute("DELETE FROM profiles")
+            self.connection.execute("DELETE FROM meta")
+            self.connection.execute("INSERT INTO meta VALUES (?, ?)",
+                                    ("@version", installed["@version"]))
+            self.__set_fingerprint(installed.get("@fingerprint"))
+            for key, profile in installed.items():
+                if key[0] != "@":
+                    self.connection.execute(
+                        "INSERT INTO profiles VALUES (?, ?, ?, ?)",
+                        (profile["name"], profile.get("parent"),
+                         profile["installed"], profile["updated"])
+                    )
+                    for link in profile["links"]:
+                        self.__insert_link(profile["name"], link)
+
+    def __insert_link(self, profile: str, link: LinkDescriptor) -> None:
+        """Inserts a link of a profile"""
+        self.connection.execute(
+            "INSERT INTO links (profile, " + ", ".join(LINK_COLUMNS) +
+            ") VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (profile,) + tuple(link[column] for column in LINK_COLUMNS)
+        )
+
+    def open(self) -> None:
+        """Updates the version number before operations are applied"""
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                ("@version", constants.VERSION))
+
+    def append(self, date: str, dop: DiffOperation) -> None:
+        """Applies an executed operation to the database"""
+        if dop["operation"] == "add_p":
+            self.connection.execute(
+                "INSERT INTO profiles VALUES (?, ?, ?, ?)",
+                (dop["profile"], dop["parent"], date, date)
+            )
+        elif dop["operation"] == "remove_p":
+            self.connection.execute("DELETE FROM profiles WHERE name = ?",
+                                    (dop["profile"],))
+        elif dop["operation"] == "update_p":
+            if "parent" in dop:
+                self.connection.execute(
+                    "UPDATE profiles SET parent = ?, updated = ? " +
+                    "WHERE name = ?",
+                    (dop["parent"], date, dop["profile"])
+                )
+            else:
+                self.connection.execute(
+                    "UPDATE profiles SET updated = ? WHERE name = ?",
+                    (date, dop["profile"])
+                )
+        elif dop["operation"] == "add_l":
+            self.__insert_link(dop["profile"], dop["symlink"])
+        elif dop["operation"] == "remove_l":
+            self.connection.execute(
+                "DELETE FROM links WHERE profile = ? AND name = ?",
+                (dop["profile"], dop["symlink_name"])
+            )
+        elif dop["operation"] == "update_l":
+            # Updated links are moved to the end like in the JSON file
+            self.connection.execute(
+                "UPDATE links SET id = (SELECT MAX(id) + 1 FROM links), " +
+                ", ".join(column + " = ?" for column in LINK_COLUMNS) +
+                " WHERE profile = ? AND name = ?",
+                tuple(dop["symlink2"][column] for column in LINK_COLUMNS) +
+                (dop["profile"], dop["symlink1"]["name"])
+            )
+        elif dop["operation"] == "fingerprint":
+            self.__set_fingerprint(dop["fingerprint"])
+
+    def __set_fingerprint(self, fingerprint: Optional[Dict]) -> None:
+        """Stores the fingerprint of the last installation"""
+        if fingerprint is None:
+            self.connection.execute("DELETE FROM meta WHERE key = ?",
+                                    ("@fingerprint",))
+        else:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                ("@fingerprint", json.dumps(fingerprint))
+            )
+
+    def close(self) -> None:
+        """Commits all applied operations and closes the database"""
+        self.connection.commit()
+        self.connection.close()
@@ -46,39 +46,62 @@ This could be:
 
 
 import grp
-import hashlib
 import logging
 import os
 import pwd
-import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from shutil import copyfile
 from subprocess import PIPE
 from subprocess import Popen
+from typing import Callable
+from typing import List
 from typing import Optional
 from typing import Tuple
+from typing import Union
 from dotmanager import constants
+from dotmanager.blacklist import get_blacklist
+from dotmanager.dirfd import Directories
+from dotmanager.dirfd import execute_operation
+from dotmanager.dynamicfile import get_file_stats
+from dotmanager.dynamicfile import has_checksum
 from dotmanager.errors import IntegrityError
 from dotmanager.errors import PreconditionError
 from dotmanager.errors import UnkownError
 from dotmanager.errors import UserError
 from dotmanager.errors import UserAbortion
 from dotmanager.errors import FatalError
+from dotmanager.installeddb import InstalledDatabase
+from dotmanager.journal import Journal
+from dotmanager.roothelper import RootHelper
+from dotmanager.statcache import get_stat_cache
 from dotmanager.types import InstalledLog
 from dotmanager.types import DiffLogData
 from dotmanager.types import DiffOperation
 from dotmanager.types import Path
-from dotmanager.utils import find_files
 from dotmanager.utils import get_date_time_now
 from dotmanager.utils import get_dir_owner
 from dotmanager.utils import get_gid
 from dotmanager.utils import get_uid
 from dotmanager.utils import is_dynamic_file
 from dotmanager.utils import log_warning
+from dotmanager.utils import save_plan
+from dotmanager.utils import save_user_env_snapshot
+from dotmanager.utils import PLAN
+from dotmanager.utils import USER_ENV_SNAPSHOT
 
 
 logger = logging.getLogger("root")
 
+# The implemented behavior of an interpreter for a kind of DiffOperation
+Operation = Callable[[DiffOperation], None]
+# What is done to a link by a kind of DiffOperation
+OPERATION_VERBS = {
+    "add_l": "create",
+    "remove_l": "remove",
+    "update_l": "update"
+}
+
 
 class Interpreter():
     """Base-class for an interpreter"""
@@ -91,12 +114,20 @@ class Interpreter():
         Needed by Interpreters that alter the DiffLog"""
         self.data = data
 
+    def get_operation(self, operation: str) -> Optional[Operation]:
+        """Returns the implemented behavior for a kind of DiffOperation.
+        This is the function named like 'operation' with prefix '_op_'
+        or None if this interpreter hasn't implemented the operation"""
+        attribute = getattr(self, "_op_" + operation, None)
+        if callable(attribute):
+            return attribute
+        return None
+
     def call_operation(self, dop: DiffOperation) -> None:
-        """Call the implemented behavior for this DiffOperation.
-        This calls the function named like 'operation' with prefix '_op_'"""
+        """Call the implemented behavior for this DiffOperation"""
         # Check if this interpreter has implemented the operation, then call
-        attribute = getattr(self, "_op_" + dop["operation"], None)
-        if callable(attribute):
+        attribute = self.get_operation(dop["operation"])
+        if attribute is not None:
             attribute(dop)
 
 
@@ -238,15 +269,26 @@ class CheckDynamicFilesI(Interpreter):
 
     def inspect_file(self, target: Path) -> None:
         """Checks if file is dynamic and has changed. """
-        # Calculate new hash and get old has of file
-        md5_calc = hashlib.md5(open(target, "rb").read()).hexdigest()
-        md5_old = os.path.basename(target)[-32:]
+        if not is_dynamic_file(target):
+            return
+        # The file only needs to be hashed if its stat changed
+        file_stats = get_file_stats()
+        if file_stats.is_unchanged(target):
+            return
+        # A removed file has no changes that could be lost
+        if not os.path.isfile(target):
+            return
         # Check for changes
-        if is_dynamic_file(target) and md5_calc != md5_old:
+        if not has_checksum(target, os.path.basename(target)[-32:]):
             log_warning(f"You made changes to '{target}'. Those changes " +
                         "will be lost, if you don't write them back to " +
                         "the original file.")
             self.user_interaction(target)
+        else:
+            file_stats.record(target)
+
+    def _op_fin(self, dop: DiffOperation) -> None:
+        get_file_stats().save()
 
     def user_interaction(self, target: Path) -> None:
         """Gives the user the ability to interact with a changed file"""
@@ -297,78 +339,73 @@ class CheckLinksI(Interpreter):
     def __init__(self, installed: InstalledLog):
         super().__init__()
         # Setup linklist to store/lookup which links are modified
-        # Stores for any link: (linkname, profile, is_installed)
-        self.linklist = []
+        # Maps any link name to a list of: (profile, is_installed)
+        self.linklist = {}
         for key, profile in installed.items():
             if key[0] != "@":
                 for link in profile["links"]:
-                    self.linklist.append((link["name"], profile["name"], True))
+                    self.__add(link["name"], profile["name"], True)
+
+    def __add(self, name: str, profile: str, is_installed: bool) -> None:
+        if name in self.linklist:
+            self.linklist[name].append((profile, is_installed))
+        else:
+            self.linklist[name] = [(profile, is_installed)]
 
     def _op_add_l(self, dop: DiffOperation) -> None:
         # Check if the link already occurs in linklist
         # In other words it was or will be already installed
         name = dop["symlink"]["name"]
-        for item in self.linklist:
-            if item[0] == name:
-                if item[2]:
-                    msg = " installed "
-                else:
-                    msg = " defined "
-                msg = "The link '" + name + "' is already" + msg + "by '"
-                msg += item[1] + "' and would be overwritten by '"
-                msg += dop["profile"] + "'."
-                raise IntegrityError(msg)
-        self.linklist.append((name, dop["profile"], False))
+        if name in self.linklist:
+            item = self.linklist[name][0]
+            if item[1]:
+                msg = " installed "
+            else:
+                msg = " defined "
+            msg = "The link '" + name + "' is already" + msg + "by '"
+            msg += item[0] + "' and would be overwritten by '"
+            msg += dop["profile"] + "'."
+            raise IntegrityError(msg)
+        self.__add(name, dop["profile"], False)
 
     def _op_remove_l(self, dop: DiffOperation) -> None:
         # Remove link from linklist because links could be removed and
         # added in one run. In that case it would look like the link is
         # added even though it is already installed if we don't remove it here.
-        count = 0
-        for item in self.linklist:
-            if item[0] == dop["symlink_name"]:
-                break
-            count += 1
-        if count == len(self.linklist):
+        name = dop["symlink_name"]
+        if name not in self.linklist:
             raise FatalError("Can't remove link that isn't installed")
-        self.linklist.pop(count)
+        self.linklist[name].pop(0)
+        if not self.linklist[name]:
+            del self.linklist[name]
 
 
 class CheckLinkBlacklistI(Interpreter):
     """Checks if links are on blacklist"""
     def __init__(self, superforce: bool) -> None:
         super().__init__()
-        # Load blacklist
         self.superforce = superforce
-
-        self.blacklist = []
-
-        for bl in find_files("black.list", constants.CONFIG_SEARCH_PATHS):
-            with open(bl, "r") as file:
-                for line in file.readlines():
-                    self.blacklist.append(line)
-
-        self.blacklist = [entry.strip() for entry in self.blacklist]
+        # Load blacklist
+        self.blacklist = get_blacklist()
 
     def check_blacklist(self, symlink_name: Path, action: str) -> None:
         """Checks if the symlink matches on a pattern in the blacklist"""
-        for entry in self.blacklist:
-            if re.search(entry, symlink_name):
-                log_warning(f"You are trying to {action} '" + symlink_name +
-                            "' which is blacklisted. It is considered " +
-                            f"dangerous to {action} those files!")
-                if self.superforce:
-                    log_warning(f"Are you sure that you want to {action} " +
-                                "a blacklisted file?")
-                    confirmation = input("Type \"YES\" to confirm or " +
-                                         "anything else to cancel: ")
-                    if confirmation != "YES":
-                        raise UserError("Canceled by user")
-                else:
-                    log_warning("If you really want to modify this file" +
-                                " you can use the --superforce flag to" +
-                                " ignore the blacklist.")
-                    raise IntegrityError(f"Won't {action} blacklisted file!")
+        if self.blacklist.matches(symlink_name):
+            log_warning(f"You are trying to {action} '" + symlink_name +
+                        "' which is blacklisted. It is considered " +
+                        f"dangerous to {action} those files!")
+            if self.superforce:
+                log_warning(f"Are you sure that you want to {action} " +
+                            "a blacklisted file?")
+                confirmation = input("Type \"YES\" to confirm or " +
+                                     "anything else to cancel: ")
+                if confirmation != "YES":
+                    raise UserError("Canceled by user")
+            else:
+                log_warning("If you really want to modify this file" +
+                            " you can use the --superforce flag to" +
+                            " ignore the blacklist.")
+                raise IntegrityError(f"Won't {action} blacklisted file!")
 
     def _op_update_l(self, dop: DiffOperation) -> None:
         if dop["symlink1"]["name"] == dop["symlink2"]["name"]:
@@ -399,7 +436,7 @@ class CheckLinkDirsI(Interpreter):
     def check_dirname(self, dirname: str) -> None:
         """Checks if the if the directory is already created"""
         if not self.makedirs:
-            if not os.path.isdir(dirname):
+            if not get_stat_cache().isdir(dirname):
                 msg = "The directory '" + dirname + "/' needs to be created "
                 msg += "in order to perform this action, but "
                 msg += "--makedirs is not set"
@@ -411,38 +448,40 @@ class CheckLinkExistsI(Interpreter):
     def __init__(self, force: bool) -> None:
         super().__init__()
         self.force = force
-        self.removed_links = []
+        self.removed_links = set()
 
     def _op_remove_l(self, dop: DiffOperation) -> None:
-        if not os.path.lexists(dop["symlink_name"]):
+        if not get_stat_cache().lexists(dop["symlink_name"]):
             msg = "'" + dop["symlink_name"] + "' can not be removed because"
             msg += " removed because it does not exist on your filesystem."
             msg += " Check your installed file!"
             raise PreconditionError(msg)
-        self.removed_links.append(dop["symlink_name"])
+        self.removed_links.add(dop["symlink_name"])
 
     @staticmethod
     def _op_update_l(dop: DiffOperation) -> None:
-        if not os.path.lexists(dop["symlink1"]["name"]):
+        stat_cache = get_stat_cache()
+        if not stat_cache.lexists(dop["symlink1"]["name"]):
             msg = "'" + dop["symlink1"]["name"] + "' can not be updated"
             msg += " because it does not exist on your filesystem."
             msg += " Check your installed file!"
             raise PreconditionError(msg)
         if (dop["symlink1"]["name"] != dop["symlink2"]["name"]
-                and os.path.lexists(dop["symlink2"]["name"])):
+                and stat_cache.lexists(dop["symlink2"]["name"])):
             msg = "'" + dop["symlink1"]["name"] + "' can not be moved to '"
             msg += dop["symlink2"]["name"] + "' because it already exist on"
             msg += " your filesystem and would be overwritten."
             raise PreconditionError(msg)
 
     def _op_add_l(self, dop: DiffOperation) -> None:
+        stat_cache = get_stat_cache()
         if (not dop["symlink"]["name"] in self.removed_links and
-                not self.force and os.path.lexists(dop["symlink"]["name"])):
+                not self.force and stat_cache.lexists(dop["symlink"]["name"])):
             msg = "'" + dop["symlink"]["name"] + "' already exists and"
             msg += " would be overwritten. You can force to overwrite the"
             msg += " original file by setting the --force flag."
             raise PreconditionError(msg)
-        if not os.path.exists(dop["symlink"]["target"]):
+        if not stat_cache.exists(dop["symlink"]["target"]):
             msg = "'" + dop["symlink"]["name"] + "' will not be created"
             msg += " because it points to '" + dop["symlink"]["target"]
             msg += "' which does not exist in your filesystem."
@@ -455,22 +494,26 @@ class CheckProfilesI(Interpreter):
     def __init__(self, installed: InstalledLog, parent_arg: str = None):
         super().__init__()
         self.parent_arg = parent_arg
-        self.profile_list = []
-        # profile_list conatains: (profile name, parent name, is installed)
+        self.profile_list = {}
+        # profile_list maps (profile name, is installed) to:
+        # (profile name, parent name, is installed)
         for key, profile in installed.items():
             if key[0] != "@":
-                self.profile_list.append(
-                    (profile["name"],
-                     profile["parent"] if "parent" in profile else None, True))
+                self.__add(profile["name"],
+                           profile["parent"] if "parent" in profile else None,
+                           True)
+
+    def __add(self, name: str, parent: Optional[str],
+              is_installed: bool) -> None:
+        # Only the first occurrence is ever looked up
+        self.profile_list.setdefault((name, is_installed),
+                                     (name, parent, is_installed))
 
     def get_known(self, name: str,
                   is_installed: bool) -> Optional[Tuple[str, str, bool]]:
         """Return if parent is already known as installed
         or a to-be-linked profile"""
-        for p_name, p_parent, p_installed in self.profile_list:
-            if name == p_name and p_installed == is_installed:
-                return (p_name, p_parent, p_installed)
-        return None
+        return self.profile_list.get((name, is_installed))
 
     def _op_add_p(self, dop: DiffOperation) -> None:
         known = self.get_known(dop["profile"], False)
@@ -486,9 +529,8 @@ class CheckProfilesI(Interpreter):
         if self.get_known(dop["profile"], True) is not None:
             raise FatalError("addP-operation found where" +
                              " update_p-operation was expected")
-        self.profile_list.append(
-            (dop["profile"], dop["parent"] if "parent" in dop else None, False)
-        )
+        self.__add(dop["profile"], dop["parent"] if "parent" in dop else None,
+                   False)
 
     def _op_update_p(self, dop: DiffOperation) -> None:
         if self.get_known(dop["profile"], False) is not None:
@@ -526,20 +568,22 @@ class CheckProfilesI(Interpreter):
                                  dop["parent"] + "', but parent is the same!")
 
 
-class ExecuteI(Interpreter):
-    """This interpreter actually executes the operations from the DiffLog.
-    It can create/delete links in the filesystem and modify the InstalledLog"""
-    def __init__(self, installed: InstalledLog, force: bool) -> None:
+class UpdateInstalledI(Interpreter):
+    """Applies the operations from the DiffLog to the InstalledLog without
+    touching the filesystem. This is used after the ExecuteI and to replay
+    the journal"""
+    def __init__(self, installed: InstalledLog,
+                 date: Optional[str] = None) -> None:
         super().__init__()
         self.installed = installed
-        self.installed["@version"] = constants.VERSION  # Update version number
-        self.force = force
+        # The date that is stored for added/updated profiles
+        self.date = get_date_time_now() if date is None else date
 
     def _op_add_p(self, dop: DiffOperation) -> None:
         new_profile = {}
         new_profile["name"] = dop["profile"]
         new_profile["links"] = []
-        new_profile["installed"] = new_profile["updated"] = get_date_time_now()
+        new_profile["installed"] = new_profile["updated"] = self.date
         if dop["parent"] is not None:
             new_profile["parent"] = dop["parent"]
         self.installed[new_profile["name"]] = new_profile
@@ -553,68 +597,203 @@ class ExecuteI(Interpreter):
                 self.installed[dop["profile"]]["parent"] = dop["parent"]
             elif "parent" in self.installed[dop["profile"]]:
                 del self.installed[dop["profile"]]["parent"]
-        self.installed[dop["profile"]]["updated"] = get_date_time_now()
+        self.installed[dop["profile"]]["updated"] = self.date
 
     def _op_add_l(self, dop: DiffOperation) -> None:
-        self.__create_symlink(dop["symlink"]["name"],
-                              dop["symlink"]["target"],
-                              dop["symlink"]["uid"],
-                              dop["symlink"]["gid"],
-                              dop["symlink"]["permission"])
         self.installed[dop["profile"]]["links"].append(dop["symlink"])
 
     def _op_remove_l(self, dop: DiffOperation) -> None:
-        os.unlink(dop["symlink_name"])
-        for link in self.installed[dop["profile"]]["links"]:
+        links = self.installed[dop["profile"]]["links"]
+        for i, link in enumerate(links):
             if link["name"] == dop["symlink_name"]:
-                self.installed[dop["profile"]]["links"].remove(link)
+                del links[i]
+                break
 
     def _op_update_l(self, dop: DiffOperation) -> None:
-        os.unlink(dop["symlink1"]["name"])
-        self.__create_symlink(dop["symlink2"]["name"],
-                              dop["symlink2"]["target"],
-                              dop["symlink2"]["uid"],
-                              dop["symlink2"]["gid"],
-                              dop["symlink2"]["permission"])
         self.installed[dop["profile"]]["links"].remove(dop["symlink1"])
         self.installed[dop["profile"]]["links"].append(dop["symlink2"])
 
-    def __create_symlink(self, name: Path, target: Path,
-                         uid: int, gid: int, permission: int) -> None:
-        """Create a symlink in the filesystem"""
-        if not os.path.isdir(os.path.dirname(name)):
-            self._makedirs(name)
+    def _op_fingerprint(self, dop: DiffOperation) -> None:
+        # Only recorded in journals, never part of a DiffLog
+        if dop["fingerprint"] is None:
+            self.installed.pop("@fingerprint", None)
+        else:
+            self.installed["@fingerprint"] = dop["fingerprint"]
+
+
+class ExecuteI(Interpreter):
+    """This interpreter actually executes the operations from the DiffLog.
+    It creates/deletes links in the filesystem, the installed-file is
+    updated by the next interpreter. Operations that need root permission
+    can be passed on to a RootHelper"""
+    def __init__(self, force: bool,
+                 helper: Optional[RootHelper] = None) -> None:
+        super().__init__()
+        self.force = force
+        self.helper = helper
+        # Syscalls are issued relative to the directories of the links
+        self.directories = Directories()
+
+    def _op_add_l(self, dop: DiffOperation) -> None:
+        self._execute(dop, self.directories)
+
+    def _op_remove_l(self, dop: DiffOperation) -> None:
+        self._execute(dop, self.directories)
+
+    def _op_update_l(self, dop: DiffOperation) -> None:
+        self._execute(dop, self.directories)
+
+    def _op_fin(self, dop: DiffOperation) -> None:
+        self.directories.close()
+
+    def _execute(self, dop: DiffOperation, directories: Directories) -> None:
+        """Executes the filesystem part of a link operation"""
+        if dop["operation"] == "add_l":
+            names = [dop["symlink"]["name"]]
+        elif dop["operation"] == "remove_l":
+            names = [dop["symlink_name"]]
+        else:
+            names = [dop["symlink1"]["name"], dop["symlink2"]["name"]]
+        stat_cache = get_stat_cache()
+        # The links are modified in any case
+        for name in names:
+            stat_cache.invalidate(name)
         try:
-            # Remove existing symlink
-            if self.force and os.path.lexists(name):
-                os.unlink(name)
-            # Create new symlink
-            os.symlink(target, name)
-            # Set owner and permission
-            os.lchown(name, uid, gid)
-            if permission != 644:
-                os.chmod(name, int(str(permission), 8))
+            if self.helper is not None and id(dop) in self.helper.operations:
+                created = self.helper.execute(dop, self.force)
+            else:
+                created = execute_operation(dop, directories, self.force)
         except OSError as err:
             raise UnkownError(err, "An unkown error occured when trying to" +
-                              " create the link '" + name + "'.")
+                              " " + OPERATION_VERBS[dop["operation"]] +
+                              " the link '" + names[-1] + "'.")
+        for directory in created:
+            stat_cache.invalidate(directory)
+
+
+class ParallelExecuteI(ExecuteI):
+    """Executes the filesystem part of the operations from the DiffLog
+    concurrently. Operations are partitioned into groups that don't share
+    any directory, and the operations of a group are executed in order.
+    Afterwards the DiffLog only contains the operations that were executed,
+    so they can be applied to the installed-file in order by another pass"""
+    def __init__(self, force: bool, jobs: int,
+                 helper: Optional[RootHelper] = None) -> None:
+        super().__init__(force, helper)
+        self.jobs = jobs
+        # The first error that occured (in order of the DiffLog)
+        self.error = None
+        # Union-find of directories that are used by the same group
+        self.parents = {}
+        self.directories = {}
+        self.operations = []
 
-    @staticmethod
-    def _makedirs(filename: Path) -> None:
-        """Custom makedirs that keeps fixes the owner of the directory"""
-        # First find the deepest directory of the path that exists
-        dirname = os.path.dirname(filename)
-        while not os.path.isdir(dirname):
-            dirname = os.path.dirname(dirname)
-        # And remember its owner
-        uid, gid = os.stat(dirname).st_uid, os.stat(dirname).st_gid
-        top_dir = dirname
-        # Then create directories
-        dirname = os.path.dirname(filename)
-        os.makedirs(dirname)
-        # And change owner of all created directories to the remembered owner
-        while dirname != top_dir:
-            os.chown(dirname, uid, gid)
-            dirname = os.path.dirname(dirname)
+    def _op_add_l(self, dop: DiffOperation) -> None:
+        self.__add(dop, dop["symlink"]["name"])
+
+    def _op_remove_l(self, dop: DiffOperation) -> None:
+        self.__add(dop, dop["symlink_name"])
+
+    def _op_update_l(self, dop: DiffOperation) -> None:
+        self.__add(dop, dop["symlink1"]["name"], dop["symlink2"]["name"])
+
+    def __add(self, dop: DiffOperation, *names: Path) -> None:
+        """Adds an operation to the group of the directories it uses. The
+        link itself is also added, in case it is the directory of another
+        operation"""
+        directories = [self.__find(path) for name in names
+                       for path in (self.__group_directory(name), name)]
+        for directory in directories[1:]:
+            self.parents[directory] = directories[0]
+        self.operations.append((dop, directories[0]))
+
+    def __group_directory(self, name: Path) -> Path:
+        """Returns the directory of a link or if it doesn't exist, the
+        topmost directory that will be created for it. So directories are
+        always created by the same group"""
+        dirname = os.path.dirname(name)
+        if dirname not in self.directories:
+            directory = dirname
+            while not get_stat_cache().isdir(os.path.dirname(directory)):
+                directory = os.path.dirname(directory)
+            self.directories[dirname] = directory
+        return self.directories[dirname]
+
+    def __find(self, directory: Path) -> Path:
+        """Returns the directory that represents the group of a directory"""
+        root = self.parents.setdefault(directory, directory)
+        while root != self.parents[root]:
+            root = self.parents[root]
+        # Compress the path, so the next lookup is faster
+        while directory != root:
+            self.parents[directory], directory = root, self.parents[directory]
+        return root
+
+    def _op_fin(self, dop: DiffOperation) -> None:
+        groups = {}
+        for index, (operation, directory) in enumerate(self.operations):
+            groups.setdefault(self.__find(directory), []).append(
+                (index, operation)
+            )
+        with ThreadPoolExecutor(self.jobs) as executor:
+            results = list(executor.map(self.__execute, groups.values()))
+        # Every group returns the operations that it couldn't execute
+        unexecuted = set()
+        failures = []
+        for operations, failure in results:
+            unexecuted.update(id(operation) for operation in operations)
+            if failure is not None:
+                failures.append(failure)
+        if failures:
+            self.error = min(failures, key=lambda failure: failure[0])[1]
+        # Profiles are only removed if all of their links were removed
+        incomplete = {operation["profile"] for operation in self.data
+                      if id(operation) in unexecuted}
+        executed = [operation for operation in self.data
+                    if id(operation) not in unexecuted and
+                    not (operation["operation"] == "remove_p" and
+                         operation["profile"] in incomplete)]
+        self.data.clear()
+        self.data.extend(executed)
+
+    def __execute(self, group: List[Tuple[int, DiffOperation]]
+                  ) -> Tuple[List[DiffOperation],
+                             Optional[Tuple[int, Exception]]]:
+        """Executes the operations of a group in order. Stops at the first
+        error and returns the operations that weren't executed and the
+        error"""
+        # Every group uses its own directories, they are not shared
+        directories = Directories()
+        try:
+            for i, (index, dop) in enumerate(group):
+                try:
+                    self._execute(dop, directories)
+                except Exception as err:
+                    return ([operation for _, operation in group[i:]],
+                            (index, err))
+        finally:
+            directories.close()
+        return [], None
+
+
+class RecordI(Interpreter):
+    """Records every operation that was executed in the journal or the
+    database of the installed-file. Needs to run directly after the ExecuteI"""
+    def __init__(self, recorder: Union[Journal, InstalledDatabase],
+                 date: str) -> None:
+        super().__init__()
+        self.recorder = recorder
+        self.date = date
+        # All DiffOperations are recorded the same way
+        self._op_add_p = self._op_remove_p = self._op_update_p = self.__record
+        self._op_add_l = self._op_remove_l = self._op_update_l = self.__record
+
+    def _op_start(self, dop: DiffOperation) -> None:
+        # Fail before the first operation is executed
+        self.recorder.open()
+
+    def __record(self, dop: DiffOperation) -> None:
+        self.recorder.append(self.date, dop)
 
 
 class RootNeededI(Interpreter):
@@ -622,6 +801,8 @@ class RootNeededI(Interpreter):
     def __init__(self):
         super().__init__()
         self.root_needed = False
+        # The ids of all DiffOperations that need root permission
+        self.privileged = set()
         self.logged = []
 
     def _access(self, path: Path) -> bool:
@@ -632,7 +813,7 @@ class RootNeededI(Interpreter):
         if not path or path == "/":
             return False
         dirname = os.path.dirname(path)
-        if os.access(dirname, os.W_OK):
+        if get_stat_cache().access(dirname, os.W_OK):
             return True
         return self._access(dirname)
 
@@ -640,15 +821,15 @@ class RootNeededI(Interpreter):
         name = dop["symlink"]["name"]
         uid, gid = get_dir_owner(name)
         if dop["symlink"]["uid"] != uid or dop["symlink"]["gid"] != gid:
-            self._root_needed("change owner of", name)
+            self._root_needed(dop, "change owner of", name)
         elif not self._access(name):
-            self._root_needed("create links in", os.path.dirname(name))
+            self._root_needed(dop, "create links in", os.path.dirname(name))
 
     def _op_remove_l(self, dop: DiffOperation) -> None:
+        dirname = os.path.dirname(dop["symlink_name"])
         try:
-            if not os.access(os.path.dirname(dop["symlink_name"]), os.W_OK):
-                self._root_needed("remove links from",
-                                  os.path.dirname(dop["symlink_name"]))
+            if not get_stat_cache().access(dirname, os.W_OK):
+                self._root_needed(dop, "remove links from", dirname)
         except FileNotFoundError:
             raise FatalError(dop["symlink_name"] + " can't be checked " +
                              "for owner rights because it does not exist.")
@@ -659,18 +840,22 @@ class RootNeededI(Interpreter):
                 dop["symlink1"]["gid"] != dop["symlink2"]["gid"]:
             if dop["symlink2"]["uid"] != get_uid() or \
                     dop["symlink2"]["gid"] != get_gid():
-                self._root_needed("change the owner of", name)
+                self._root_needed(dop, "change the owner of", name)
         if dop["symlink1"]["name"] != dop["symlink2"]["name"]:
             if not self._access(dop["symlink2"]["name"]):
-                self._root_needed("create links in", os.path.dirname(name))
+                self._root_needed(dop, "create links in",
+                                  os.path.dirname(name))
             if not self._access(dop["symlink1"]["name"]):
-                self._root_needed("remove links from", os.path.dirname(name))
+                self._root_needed(dop, "remove links from",
+                                  os.path.dirname(name))
         if dop["symlink1"]["target"] != dop["symlink2"]["target"]:
             if not self._access(dop["symlink2"]["name"]):
-                self._root_needed("change target of", name)
+                self._root_needed(dop, "change target of", name)
 
-    def _root_needed(self, operation: str, filename: Path) -> None:
+    def _root_needed(self, dop: DiffOperation, operation: str,
+                     filename: Path) -> None:
         self.root_needed = True
+        self.privileged.add(id(dop))
         if (operation, filename) not in self.logged:
             log_warning("You will need to give me root permission to " +
                         operation + " '" + filename + "'.")
@@ -679,8 +864,19 @@ class RootNeededI(Interpreter):
 
 class GainRootI(RootNeededI):
     """If root permission is needed to perform the operations,
-    this interpreter restarts the process with sudo"""
+    this interpreter restarts the process with sudo. The restarted
+    process gets the checked DiffLog handed over, so it doesn't need to
+    generate the profiles again if its inputs didn't change"""
+    def __init__(self, fingerprint: Callable[[], str]):
+        super().__init__()
+        self.fingerprint = fingerprint
+
     def _op_fin(self, dop: DiffOperation) -> None:
         if self.root_needed:
-            args = [sys.executable] + sys.argv
-            os.execvp('sudo', args)
+            # Hand over our environment, so the restarted process doesn't
+            # need to login as the user again to look up variables
+            snapshot = save_user_env_snapshot()
+            plan = save_plan(self.data, self.fingerprint())
+            args = ["sudo", sys.executable, sys.argv[0],
+                    USER_ENV_SNAPSHOT, snapshot, PLAN, plan] + sys.argv[1:]
+            os.execvp("sudo", args)
@@ -0,0 +1,183 @@
+"""This module implements the journal of the installed-file"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import json
+import logging
+import os
+import tempfile
+from typing import Iterator
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+from dotmanager.errors import PreconditionError
+from dotmanager.types import DiffOperation
+from dotmanager.types import InstalledLog
+from dotmanager.types import Path
+from dotmanager.utils import get_gid
+from dotmanager.utils import get_uid
+from dotmanager.utils import log_warning
+
+
+logger = logging.getLogger("root")
+
+
+class Journal:
+    """The journal of an installed-file. Every executed operation is appended
+    to it, so the installed-file only needs to be rewritten once the journal
+    got bigger than the installed-file itself. The first line of the journal
+    stores the generation of the installed-file that it belongs to"""
+    def __init__(self, installed_file: Path, generation: int) -> None:
+        self.installed_file = installed_file
+        self.path = installed_file + ".journal"
+        self.generation = generation
+        self.file = None
+
+    def exists(self) -> bool:
+        """Returns if there is a journal for the installed-file"""
+        return os.path.isfile(self.path)
+
+    def read(self) -> Iterator[Tuple[str, DiffOperation]]:
+        """Returns all recorded operations and the date they were executed"""
+        try:
+            file = open(self.path)
+        except FileNotFoundError:
+            return
+        with file:
+            if self.__read_generation(file) != self.generation:
+                # The installed-file was rewritten before the old journal
+                # could be removed, so it contains all changes already
+                logger.debug("Ignoring the outdated journal '%s'", self.path)
+                return
+            for line in file:
+                if not line.endswith("\n"):
+                    # The last execution was aborted while writing the record,
+                    # so this operation wasn't executed completely
+                    log_warning("Ignoring the incomplete last record of '" +
+                                self.path + "'.")
+                    return
+                try:
+                    date, dop = json.loads(line)
+                except ValueError:
+                    raise PreconditionError("The journal '" + self.path +
+                                            "' is corrupted.")
+                yield date, dop
+
+    @staticmethod
+    def __read_generation(file: TextIO) -> Optional[int]:
+        """Reads the generation from the first line of the journal"""
+        try:
+            return json.loads(file.readline())["generation"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def append(self, date: str, dop: DiffOperation) -> None:
+        """Appends an executed operation to the journal"""
+        if self.file is None:
+            self.open()
+        # The file is line buffered, so every record is written immediately
+        self.file.write(json.dumps([date, dop]) + "\n")
+
+    def open(self) -> None:
+        """Opens the journal for appending. A new journal is started if there
+        is none for the current generation of the installed-file"""
+        if self.file is not None:
+            return
+        try:
+            with open(self.path) as file:
+                current = self.__read_generation(file) == self.generation
+        except FileNotFoundError:
+            current = False
+        if current:
+            self.__truncate_incomplete()
+            self.file = open(self.path, "a", buffering=1)
+        else:
+            self.file = open(self.path, "w", buffering=1)
+            self.file.write(json.dumps({"generation": self.generation}) + "\n")
+            os.chown(self.path, get_uid(), get_gid())
+
+    def __truncate_incomplete(self) -> None:
+        """Removes an incomplete last record, so that appended records
+        don't get mixed up with it"""
+        with open(self.path, "rb+") as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                file.seek(0)
+                file.truncate(file.read().rfind(b"\n") + 1)
+
+    def close(self) -> None:
+        """Makes sure that all records were written to the disk"""
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+    def needs_compaction(self) -> bool:
+        """Returns if the journal got bigger than the installed-file"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return False
+        try:
+            return size > os.path.getsize(self.installed_file)
+        except FileNotFoundError:
+            return True
+
+
+def write_installed(installed_file: Path, installed: InstalledLog) -> None:
+    """Replaces the installed-file and removes its journal, because all of
+    the recorded changes are contained in the new installed-file"""
+    # The new generation makes sure that the journal isn't replayed again
+    # if we fail to remove it
+    installed["@generation"] = installed.get("@generation", 0) + 1
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(installed_file),
+                               prefix=os.path.basename(installed_file) + ".")
+    try:
+        with open(fd, "w") as file:
+            file.write(json.dumps(installed, indent=4))
+            file.flush()
+            os.fsync(file.fileno())
+        os.chown(tmp, get_uid(), get_gid())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, installed_file)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    if os.path.isfile(installed_file + ".journal"):
+        os.remove(installed_file + ".journal")
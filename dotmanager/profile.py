@@ -37,21 +37,32 @@
 ###############################################################################
 
 
-import builtins
 import os
 import re
 import shutil
 from abc import abstractmethod
+from contextlib import contextmanager
 from typing import Any
 from typing import Callable
+from typing import Dict
+from typing import Iterator
 from typing import List
 from typing import NoReturn
-from typing import Tuple
+from typing import Optional
 from typing import Union
 from dotmanager import constants
+from dotmanager.dotfileindex import TagMap
+from dotmanager.dotfileindex import get_dotfile_index
 from dotmanager.dynamicfile import *
 from dotmanager.errors import CustomError
 from dotmanager.errors import GenerationError
+from dotmanager.profilecache import record_profile
+from dotmanager.profilecache import recorded
+from dotmanager.profilecache import warn
+from dotmanager.profilepool import generate_parallel
+from dotmanager.profilepool import get_shared
+from dotmanager.profilepool import is_parallel
+from dotmanager.statcache import get_stat_cache
 from dotmanager.types import Options
 from dotmanager.types import Path
 from dotmanager.types import Pattern
@@ -62,18 +73,84 @@ from dotmanager.utils import expanduser
 from dotmanager.utils import find_target
 from dotmanager.utils import get_dir_owner
 from dotmanager.utils import import_profile_class
-from dotmanager.utils import log_warning
 from dotmanager.utils import normpath
-from dotmanager.utils import walk_dotfiles
 
 # The custom builtins that the profiles will implement
 CUSTOM_BUILTINS = ["links", "link", "cd", "opt", "extlink", "has_tag", "merge",
                    "default", "subprof", "tags", "rmtags", "decrypt"]
 
+# Everything that profiles look up is recorded, so that a cached
+# ProfileResult is only reused as long as all lookups give the same results
+expandvars = recorded(expandvars)
+expanduser = recorded(expanduser)
+find_target = recorded(find_target)
+get_dir_owner = recorded(get_dir_owner)
+
+
+@recorded
+def find_pattern(target_pattern: Pattern) -> Dict[str, TagMap]:
+    """Returns all dotfiles matching a pattern by their base name and tag"""
+    return get_dotfile_index().find_pattern(target_pattern)
+
+
+@recorded
+def path_exists(path: Path) -> bool:
+    """Returns if a path exists"""
+    return get_stat_cache().exists(path)
+
+
+@recorded
+def lookup_uid(user: str) -> Optional[int]:
+    """Returns the id of a user"""
+    return shutil._get_uid(user)
+
+
+@recorded
+def lookup_gid(group: str) -> Optional[int]:
+    """Returns the id of a group"""
+    return shutil._get_gid(group)
+
+
+@contextmanager
+def generating(profile: "Profile") -> Iterator[None]:
+    """Maps the custom builtins to the methods of a profile within the
+    context, so profiles don't need to use "self" everytime. They are set
+    in the modules that define the methods of the profile class, and the
+    previous mappings are restored afterwards, so subprofiles can be
+    generated within the context"""
+    namespaces = {}
+    for cls in type(profile).__mro__:
+        if issubclass(cls, Profile) and cls is not Profile:
+            for attribute in vars(cls).values():
+                namespace = getattr(attribute, "__globals__", None)
+                if namespace is not None:
+                    namespaces[id(namespace)] = namespace
+    old_mappings = []
+    for namespace in namespaces.values():
+        old_mappings.append((namespace, {name: namespace[name]
+                                         for name in CUSTOM_BUILTINS
+                                         if name in namespace}))
+        for name in CUSTOM_BUILTINS:
+            namespace[name] = getattr(profile, name)
+    try:
+        yield
+    finally:
+        for namespace, old in old_mappings:
+            for name in CUSTOM_BUILTINS:
+                if name in old:
+                    namespace[name] = old[name]
+                else:
+                    del namespace[name]
+
 
 class Profile:
     """This class provides the "API" for creating links.
     It is also responsible for running a profile"""
+    # Set this to True in profiles that depend on nothing else than their
+    # options, the dotfiles, environment variables or the info module.
+    # Only then their ProfileResult can be reused from the cache
+    cacheable = False
+
     def __init__(self, options: Options = None,
                  directory: Path = None,
                  parent: "Profile" = None):
@@ -85,7 +162,6 @@ class Profile:
         self.__execution_counter = 0
         self.options = options
         self.directory = directory
-        self.__old_builtins = {}
         self.parent = parent
         self.result = {
             "name": self.name,
@@ -104,38 +180,31 @@ class Profile:
 
     def get(self) -> ProfileResult:
         """Creates a list of all links for this profile and all
-        subprofiles by calling generate()
+        subprofiles by calling generate(). Dynamic files are still
+        generated in the background, use resolve_dynamic_files() to
+        get their paths.
         DON'T use this from within a profile, only from outside!!"""
         if self.__execution_counter > 0:
             self.__raise_generation_error("A profile can be only generated " +
                                           "one time to prevent side-effects!")
         self.__execution_counter += 1
-        self.__set_builtins()
-        try:
-            self.generate()
-        except Exception as err:
-            if isinstance(err, CustomError):
-                raise
-            else:
-                msg = "An unkown error occured in your generate() function: "
-                self.__raise_generation_error(msg + type(err).__name__ +
-                                              ": " + str(err))
-        self.__reset_builtins()
+        # The modules that define this profile are recorded for the cache
+        record_profile([cls.__name__ for cls in type(self).__mro__
+                        if issubclass(cls, Profile) and cls is not Profile],
+                       self.cacheable)
+        with generating(self):
+            try:
+                self.generate()
+            except Exception as err:
+                if isinstance(err, CustomError):
+                    raise
+                else:
+                    msg = "An unkown error occured in your generate() "
+                    self.__raise_generation_error(msg + "function: " +
+                                                  type(err).__name__ +
+                                                  ": " + str(err))
         return self.result
 
-    def __set_builtins(self) -> None:
-        """Maps functions from self to builtins, so profiles don't
-        need to use "self" everytime"""
-        for item in CUSTOM_BUILTINS:
-            if item in builtins.__dict__:
-                self.__old_builtins[item] = builtins.__dict__[item]
-            builtins.__dict__[item] = self.__getattribute__(item)
-
-    def __reset_builtins(self) -> None:
-        """Restores old Builtin mappings"""
-        for key, val in self.__old_builtins.items():
-            builtins.__dict__[key] = val
-
     @abstractmethod
     def generate(self) -> None:
         """Used by profiles for actual link configuration"""
@@ -184,7 +253,7 @@ class Profile:
         read_opt = self.__make_read_opt(kwargs)
         for target in targets:
             if isinstance(target, DynamicFile):
-                found_target = target.getpath()
+                found_target = target
                 if "name" not in kwargs:
                     kwargs["name"] = target.name
             else:
@@ -204,10 +273,10 @@ class Profile:
         read_opt = self.__make_read_opt(kwargs)
         path = expanduser(expandvars(path))
         if not os.path.isabs(path):
-            log_warning("'path' should be specified as an absolut path" +
-                        " for extlink(). Relative paths are not forbidden" +
-                        " but can cause undesired side-effects.")
-        if not read_opt("optional") or os.path.exists(path):
+            warn("'path' should be specified as an absolut path for" +
+                 " extlink(). Relative paths are not forbidden but can" +
+                 " cause undesired side-effects.")
+        if not read_opt("optional") or path_exists(path):
             self.__create_link_descriptor(os.path.abspath(path), **kwargs)
 
     def links(self, target_pattern: Pattern,
@@ -216,43 +285,30 @@ class Profile:
         to ommit the 'replace_pattern' and use the target_pattern instead"""
         read_opt = self.__make_read_opt(kwargs)
         target_list = []
-        target_dir = {}
 
         # Use target_pattern as replace_pattern
         if read_opt("replace") != "" and read_opt("replace_pattern") == "":
             kwargs["replace_pattern"] = target_pattern
 
-        # Find all files that match target_pattern and index
-        # them by there name without tag
-        for root, name in walk_dotfiles():
-            tag, base = (None, os.path.basename(name))
-            if "%" in base:
-                tag, base = base.split("%", 1)
-            if re.fullmatch(target_pattern, base) is not None:
-                if base not in target_dir:
-                    target_dir[base] = []
-                target_dir[base].append((tag, os.path.join(root, name)))
-
-        def choose_file(base: str, tags: Tuple[str, Path]) -> None:
+        # Find all files that match target_pattern. The index
+        # already groups them by there name without tag
+        target_dir = find_pattern(target_pattern)
+
+        def choose_file(base: str, tags: TagMap) -> None:
             # Go through set tags and take the first file that matches a tag
             for tmp_tag in read_opt("tags"):
-                for item in tags:
-                    if item[0] == tmp_tag:
-                        target_list.append(item[1])
-                        return
+                if tmp_tag in tags:
+                    target_list.append(tags[tmp_tag][0])
+                    return
             # Look for files without tags
-            no_tag = None
-            for item in tags:
-                if item[0] is None:
-                    if no_tag is None:
-                        no_tag = item
-                    else:
-                        msg = "There are two targets found with the same name:"
-                        msg += " '" + base + "'\n  " + no_tag[1]
-                        msg += "\n  " + item[1]
-                        self.__raise_generation_error(msg)
-            if no_tag is not None:
-                target_list.append(no_tag[1])
+            no_tag = tags.get(None, [])
+            if len(no_tag) > 1:
+                msg = "There are two targets found with the same name:"
+                msg += " '" + base + "'\n  " + no_tag[0]
+                msg += "\n  " + no_tag[1]
+                self.__raise_generation_error(msg)
+            if no_tag:
+                target_list.append(no_tag[0])
         # Then choose wisely which files will be linked
         for base, tags in target_dir.items():
             choose_file(base, tags)
@@ -266,12 +322,12 @@ class Profile:
             for target in target_list:
                 if encrypted:
                     file_name = os.path.basename(target)
-                    target = self.decrypt(file_name).getpath()
+                    target = self.decrypt(file_name)
                     kwargs["name"] = file_name
                 self.__create_link_descriptor(target, **kwargs)
 
 
-    def __create_link_descriptor(self, target: Path,
+    def __create_link_descriptor(self, target: Union[Path, DynamicFile],
                                  directory: RelPath = "",
                                  **kwargs: Options) -> None:
         """Creates a link entry for current options and a given target.
@@ -279,14 +335,22 @@ class Profile:
         temporarily only for a link"""
         read_opt = self.__make_read_opt(kwargs)
 
+        def target_path() -> Path:
+            # Dynamic files are only waited for if the name of the link
+            # depends on their path. Otherwise the path is resolved after
+            # all profiles were generated
+            if isinstance(target, DynamicFile):
+                return target.getpath()
+            return target
+
         # Now generate the correct name for the symlink
         replace = read_opt("replace")
         if replace:  # When using regex pattern, name property is ignored
             if read_opt("name") != "":
-                log_warning("'name'-property is useless if 'replace' is used")
+                warn("'name'-property is useless if 'replace' is used")
             replace_pattern = read_opt("replace_pattern")
             if replace_pattern:
-                base = os.path.basename(target)
+                base = os.path.basename(target_path())
                 if "%" in base:
                     base = base.split("%", 1)[1]
                 name = re.sub(replace_pattern, replace, base)
@@ -319,7 +383,7 @@ class Profile:
             # If base is empty it means that "name" was never set by the user,
             # so we fallback to use the target name (but without the tag)
             base, ext = os.path.splitext(
-                os.path.basename(target.split("%", 1)[-1])
+                os.path.basename(target_path().split("%", 1)[-1])
             )
         name = os.path.join(os.path.dirname(name), read_opt("prefix") +
                             base + read_opt("suffix") + ext)
@@ -335,13 +399,13 @@ class Profile:
                 msg = "The owner needs to be specified in the format"
                 self.__raise_generation_error(msg + 'user:group')
             try:
-                uid = shutil._get_uid(user)
+                uid = lookup_uid(user)
             except LookupError:
                 msg = "You want to set the owner of '" + name + "' to '" + user
                 msg += "', but there is no such user on this system."
                 self.__raise_generation_error(msg)
             try:
-                gid = shutil._get_gid(group)
+                gid = lookup_gid(group)
             except LookupError:
                 msg = "You want to set the owner of '" + name + "' to '"
                 msg += group + "', but there is no such group on this system."
@@ -402,19 +466,48 @@ class Profile:
                                               key)
 
     def subprof(self, *profilenames: List[str], **kwargs: Options) -> None:
-        """Executes another profile by name"""
+        """Executes other profiles by name. Multiple profiles are
+        generated in parallel if profileJobs is set"""
         def will_create_cycle(subp: str, profile: Profile = self) -> bool:
             return (profile.parent is not None and
                     (profile.parent.name == subp or
                      will_create_cycle(subp, profile.parent)))
+        # All profiles before the first one that fails the checks are
+        # generated, before the error is raised
+        checked = []
+        error = None
         for subprofile in profilenames:
             if subprofile == self.name:
-                self.__raise_generation_error("Recursive profiles are " +
-                                              "forbidden")
+                error = "Recursive profiles are forbidden"
+                break
+            if will_create_cycle(subprofile):
+                error = "Detected a cycle in your subprofiles!"
+                break
+            checked.append(subprofile)
+        generated = None
+        if is_parallel(len(checked)):
+            parents = []
+            profile = self
+            while profile is not None:
+                parents.append(profile.name)
+                profile = profile.parent
+            jobs = []
+            for subprofile in checked:
+                suboptions = {**self.options, **kwargs}
+                jobs.append((subprofile, suboptions, self.directory, parents,
+                             get_shared(suboptions)))
+            generated = generate_parallel(jobs)
+        for subprofile in checked:
+            if generated is not None:
+                result, _, changed = next(generated)
+                result["parent"] = self
+                if changed:
+                    # The subprofile changed the tags or other options
+                    # that it shares with the next subprofiles, so they
+                    # are generated again with the changed options
+                    generated.close()
+                    generated = None
             else:
-                if will_create_cycle(subprofile):
-                    self.__raise_generation_error("Detected a cycle in" +
-                                                  " your subprofiles!")
                 # All checks passed and the profile was imported, we can go on
                 # merge this profile's options with this function's options
                 suboptions = {**self.options, **kwargs}
@@ -424,4 +517,24 @@ class Profile:
                 profile = ProfileClass(suboptions, self.directory, self)
                 # Generate profile and add it to this profile's
                 # generation result
-                self.result["profiles"].append(profile.get())
+                result = profile.get()
+            self.result["profiles"].append(result)
+        if error is not None:
+            self.__raise_generation_error(error)
+
+
+def resolve_dynamic_files(result: ProfileResult) -> None:
+    """Replaces the dynamic files that are linked in a ProfileResult and
+    all of its subprofiles by their paths. Waits until they are generated"""
+    for link in result["links"]:
+        if isinstance(link["target"], DynamicFile):
+            try:
+                link["target"] = link["target"].getpath()
+            except CustomError:
+                raise
+            except Exception as err:
+                msg = "An unkown error occured when generating '"
+                msg += link["target"].name + "': " + type(err).__name__
+                raise GenerationError(result["name"], msg + ": " + str(err))
+    for subprofile in result["profiles"]:
+        resolve_dynamic_files(subprofile)
@@ -0,0 +1,393 @@
+"""This module caches the ProfileResults of root profiles, so that profiles
+only need to be generated if something they depend on changed"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import functools
+import hashlib
+import importlib
+import json
+import os
+import sys
+from contextlib import contextmanager
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from dotmanager import constants
+from dotmanager.dynamicfile import DynamicFile
+from dotmanager.dynamicfile import EncryptedFile
+from dotmanager.dynamicfile import SplittedFile
+from dotmanager.dynamicfile import get_stat
+from dotmanager.profileindex import get_profile_index
+from dotmanager.types import Options
+from dotmanager.types import Path
+from dotmanager.types import ProfileResult
+from dotmanager.utils import import_profile_class
+from dotmanager.utils import load_cache
+from dotmanager.utils import log_warning
+from dotmanager.utils import save_cache
+
+
+# The number of ProfileResults that are kept in the cache. The least
+# recently used ones are dropped first
+MAX_RESULTS = 32
+
+
+class Recording:
+    """Records everything a root profile and its subprofiles looked up
+    while they were generated. A lookup is stored once as a list of the
+    name of the function, its arguments and its result. Quiet recordings
+    don't log warnings, they are logged when the recording is replayed"""
+    def __init__(self, quiet: bool = False) -> None:
+        # JSON of function and arguments -> lookup
+        self.lookups = {}
+        self.warnings = []
+        # False if the result depends on something that can't be recorded
+        self.cacheable = True
+        self.quiet = quiet
+
+    def record(self, function: Callable, *args: Any) -> Any:
+        """Calls a function and records the call"""
+        result = function(*args)
+        name = function.__module__ + "." + function.__name__
+        # The arguments are copied, because profiles can still modify them
+        key = json.dumps([name, args])
+        if key not in self.lookups:
+            self.lookups[key] = [name, json.loads(key)[1], normalize(result)]
+        return result
+
+    def add(self, lookups: List[List[Any]], warnings: List[str]) -> None:
+        """Adds lookups and warnings of another recording"""
+        for lookup in lookups:
+            self.lookups.setdefault(json.dumps(lookup[:2]), lookup)
+        self.warnings.extend(warnings)
+
+
+# The recording of the root profile that is generated at the moment
+_recording = None
+# All functions whose calls can be recorded by their name
+_functions = {}
+
+
+def recorded(function: Callable) -> Callable:
+    """Decorates a function, so that its calls are recorded while a root
+    profile is generated. A cached ProfileResult is only reused if all
+    recorded calls still return the same. So arguments and results need
+    to be serializable as JSON"""
+    _functions[function.__module__ + "." + function.__name__] = function
+
+    @functools.wraps(function)
+    def wrapper(*args: Any) -> Any:
+        if _recording is None:
+            return function(*args)
+        return _recording.record(function, *args)
+    return wrapper
+
+
+@contextmanager
+def record(recording: Recording) -> Iterator[None]:
+    """Records all calls of recorded functions within the context. If
+    recordings are nested, the outer one gets everything of the inner one"""
+    global _recording
+    outer = _recording
+    _recording = recording
+    try:
+        yield
+    finally:
+        _recording = outer
+        if outer is not None:
+            outer.add(list(recording.lookups.values()), recording.warnings)
+            outer.cacheable = outer.cacheable and recording.cacheable
+
+
+def record_profile(class_names: List[str], cacheable: bool) -> None:
+    """Records the modules of a profile class and its base classes. If
+    the profile opted out, the root profile can't be cached"""
+    if _recording is None:
+        return
+    if not cacheable:
+        _recording.cacheable = False
+    for class_name in class_names:
+        if profile_module(class_name) is None:
+            # The class isn't defined by a class statement
+            _recording.cacheable = False
+
+
+def record_dynamic_files(dynamic_files: List[DynamicFile]) -> None:
+    """Records the sources of resolved dynamic files and if they still
+    exist. Custom dynamic files could depend on anything, so they can't
+    be cached"""
+    if _recording is None:
+        return
+    for dynamic_file in dynamic_files:
+        if type(dynamic_file) not in (EncryptedFile, SplittedFile):
+            _recording.cacheable = False
+        for source in dynamic_file.sources:
+            source_stat(source)
+        is_file(dynamic_file.getpath())
+
+
+def replay(lookups: List[List[Any]], warnings: List[str],
+           cacheable: bool = True) -> None:
+    """Adds everything that was recorded somewhere else to the current
+    recording and logs its warnings again"""
+    if _recording is not None:
+        _recording.add(lookups, warnings)
+        _recording.cacheable = _recording.cacheable and cacheable
+    for message in warnings:
+        log_warning(message)
+
+
+def record_imported_modules() -> None:
+    """Records the modules that were imported by profile modules"""
+    profile_files = os.path.join(constants.PROFILE_FILES, "")
+    for module in list(sys.modules.values()):
+        file = getattr(module, "__file__", None)
+        if file and file.startswith(profile_files):
+            module_hash(file)
+
+
+def warn(message: str) -> None:
+    """Logs a warning of a profile. It is logged again whenever the
+    cached ProfileResult is reused"""
+    if _recording is not None:
+        _recording.warnings.append(message)
+        if _recording.quiet:
+            return
+    log_warning(message)
+
+
+@recorded
+def profile_module(class_name: str) -> Optional[List[str]]:
+    """Returns the module that defines a profile class and its hash"""
+    index = get_profile_index()
+    file = index.find_module(class_name)
+    if file is None:
+        return None
+    return [file, index.stats[file]["hash"]]
+
+
+@recorded
+def module_hash(file: Path) -> Optional[str]:
+    """Returns the hash of a module in the profile directory"""
+    stats = get_profile_index().stats.get(file)
+    return None if stats is None else stats["hash"]
+
+
+@recorded
+def source_stat(file: Path) -> Optional[List[int]]:
+    """Returns the stat of a source of a dynamic file"""
+    try:
+        return get_stat(file)
+    except OSError:
+        return None
+
+
+@recorded
+def is_file(path: Path) -> bool:
+    """Returns if a generated file still exists"""
+    return os.path.isfile(path)
+
+
+class ProfileCache:
+    """Caches the ProfileResults of root profiles on disk. A ProfileResult
+    is reused if the profile is generated with the same options and
+    directory and everything that was recorded while it was generated is
+    unchanged. Then neither the module of the profile is imported nor its
+    generate() called"""
+    def __init__(self) -> None:
+        cache = load_cache("profileresults")
+        # fingerprint -> {"lookups", "warnings", "result"}
+        self.results = {} if cache is None else cache["results"]
+        # Generated ProfileResults can only be stored after all of their
+        # dynamic files were generated
+        self.pending = []
+        self.hits = 0
+
+    def get(self, profilename: str, options: Optional[Options] = None,
+            directory: Optional[Path] = None) -> ProfileResult:
+        """Returns the ProfileResult of a root profile. It is only generated
+        if there is no valid ProfileResult in the cache"""
+        fingerprint = get_fingerprint(profilename, options, directory)
+        entry = self.lookup(fingerprint)
+        if entry is not None:
+            return self.reuse(entry)
+        return self.generate(fingerprint, profilename, options, directory)
+
+    def lookup(self, fingerprint: str) -> Optional[Dict]:
+        """Returns the cached entry of a fingerprint, if it is still valid"""
+        entry = self.results.pop(fingerprint, None)
+        if entry is not None and is_valid(entry["lookups"]):
+            self.results[fingerprint] = entry
+            return entry
+        return None
+
+    def reuse(self, entry: Dict) -> ProfileResult:
+        """Returns the ProfileResult of a valid entry and replays what
+        was recorded when it was generated"""
+        self.hits += 1
+        replay(entry["lookups"], entry["warnings"])
+        return entry["result"]
+
+    def generate(self, fingerprint: str, profilename: str,
+                 options: Optional[Options] = None,
+                 directory: Optional[Path] = None) -> ProfileResult:
+        """Generates a root profile and remembers its ProfileResult"""
+        recording = Recording()
+        with record(recording):
+            result = import_profile_class(profilename)(options,
+                                                       directory).get()
+            record_imported_modules()
+        self.add(fingerprint, recording, result)
+        return result
+
+    def add(self, fingerprint: str, recording: Recording,
+            result: ProfileResult) -> None:
+        """Remembers a generated ProfileResult, so it can be stored
+        after its dynamic files were generated"""
+        if recording.cacheable:
+            self.pending.append((fingerprint, recording, result,
+                                 list(find_dynamic_files(result))))
+
+    def save(self) -> None:
+        """Stores all ProfileResults that were generated in this run. Needs
+        to be called after all dynamic files were resolved"""
+        if not self.pending:
+            return
+        for fingerprint, recording, result, dynamic_files in self.pending:
+            dynamic = Recording()
+            with record(dynamic):
+                record_dynamic_files(dynamic_files)
+            recording.add(list(dynamic.lookups.values()), dynamic.warnings)
+            lookups = list(recording.lookups.values())
+            if not dynamic.cacheable or not is_trusted(lookups):
+                continue
+            self.results[fingerprint] = {
+                "lookups": lookups,
+                "warnings": recording.warnings,
+                "result": serialize(result)
+            }
+        self.pending.clear()
+        while len(self.results) > MAX_RESULTS:
+            del self.results[next(iter(self.results))]
+        save_cache("profileresults", {"results": self.results})
+
+
+def get_fingerprint(profilename: str, options: Optional[Options],
+                    directory: Optional[Path]) -> str:
+    """Returns the fingerprint of the arguments a root profile is
+    generated with"""
+    if options is None:
+        options = constants.DEFAULTS
+    arguments = [profilename, options, directory or constants.DIR_DEFAULT,
+                 constants.DEFAULTS, constants.DIR_DEFAULT]
+    arguments = json.dumps(arguments, sort_keys=True)
+    return hashlib.sha256(arguments.encode()).hexdigest()
+
+
+def is_valid(lookups: List[List[Any]]) -> bool:
+    """Checks if all recorded lookups still return the same"""
+    for name, args, result in lookups:
+        try:
+            function = _functions.get(name)
+            if function is None:
+                # The function is registered when its module is imported
+                importlib.import_module(name.rsplit(".", 1)[0])
+                function = _functions[name]
+            if normalize(function(*args)) != result:
+                return False
+        except Exception:
+            return False
+    return True
+
+
+def is_trusted(lookups: List[List[Any]]) -> bool:
+    """Returns False if a source of a dynamic file was modified so recently
+    that its stat can't be trusted"""
+    return not any(name == "dotmanager.profilecache.source_stat" and
+                   stat is None for name, _, stat in lookups)
+
+
+def normalize(value: Any) -> Any:
+    """Converts a value like it would be stored as JSON"""
+    if value is None or isinstance(value, (str, int, float)):
+        # Most lookups return paths or owners, so they aren't encoded
+        return value
+    if isinstance(value, tuple) and all(isinstance(item, int)
+                                        for item in value):
+        return list(value)
+    return json.loads(json.dumps(value))
+
+
+def find_dynamic_files(result: ProfileResult) -> Iterator[DynamicFile]:
+    """Yields all dynamic files that are linked by a ProfileResult and all
+    of its subprofiles"""
+    for link in result["links"]:
+        if isinstance(link["target"], DynamicFile):
+            yield link["target"]
+    for subprofile in result["profiles"]:
+        yield from find_dynamic_files(subprofile)
+
+
+def serialize(result: ProfileResult) -> ProfileResult:
+    """Returns a copy of a ProfileResult that can be stored as JSON. The
+    parent profile is replaced by its name"""
+    return {
+        **result,
+        "parent": None if result["parent"] is None else result["parent"].name,
+        "links": normalize(result["links"]),
+        "profiles": [serialize(subprofile)
+                     for subprofile in result["profiles"]]
+    }
+
+
+# The cache is loaded once per run
+###############################################################################
+
+_cache = None
+
+
+def get_profile_cache() -> ProfileCache:
+    """Returns the ProfileCache. It will be loaded on the first call"""
+    global _cache
+    if _cache is None:
+        _cache = ProfileCache()
+    return _cache
@@ -0,0 +1,226 @@
+"""Provides a registry of all profile classes. It discovers the profiles of
+all modules without executing them and imports a module at most once"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import ast
+import hashlib
+import importlib.util
+import os
+from types import ModuleType
+from typing import Dict
+from typing import List
+from typing import Optional
+from dotmanager import constants
+from dotmanager import utils
+from dotmanager.errors import GenerationError
+from dotmanager.errors import PreconditionError
+from dotmanager.types import Path
+
+
+class ProfileIndex:
+    """Looks up profile classes by their name. To find the module that
+    defines a profile, every module is parsed (but not executed) and
+    the classes it defines are cached on disk by the hash of the module.
+    So a lookup only imports the module that actually contains the
+    profile, and every module is imported at most once"""
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        # file -> imported module
+        self.modules = {}
+        # file -> class name -> names of the base classes
+        self.classes = {}
+        # file -> {"stat": [mtime, size], "hash": sha1}
+        self.stats = {}
+        self.__changed = False
+        self.__scan()
+
+    def __scan(self) -> None:
+        """Finds all profile modules and the classes they define. Modules
+        that didn't change since the last run are not parsed again"""
+        cache = utils.load_cache("profiles")
+        if cache is None or cache["directory"] != self.directory:
+            cached_modules = {}
+        else:
+            cached_modules = cache["modules"]
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                # Ignore everything that isn't a python module
+                if not file.endswith(".py"):
+                    continue
+                file = os.path.join(root, file)
+                try:
+                    self.__scan_module(file, cached_modules.get(file))
+                except OSError:
+                    continue
+        if cached_modules.keys() != self.classes.keys():
+            self.__changed = True
+        self.save()
+
+    def __scan_module(self, file: Path, cached: Optional[Dict]) -> None:
+        """Parses a module to find the classes it defines, unless the
+        cached classes are still valid"""
+        stat = os.stat(file)
+        stat = [stat.st_mtime_ns, stat.st_size]
+        if cached is not None and cached["stat"] == stat:
+            self.stats[file] = {"stat": stat, "hash": cached["hash"]}
+            self.classes[file] = cached["classes"]
+            return
+        with open(file, "rb") as module_file:
+            source = module_file.read()
+        sha1 = hashlib.sha1(source).hexdigest()
+        self.stats[file] = {"stat": stat, "hash": sha1}
+        self.__changed = True
+        if cached is not None and cached["hash"] == sha1:
+            # The module was only touched
+            self.classes[file] = cached["classes"]
+            return
+        try:
+            tree = ast.parse(source, file)
+        except (SyntaxError, ValueError):
+            # Modules that can't be parsed will be imported as fallback,
+            # so the user gets the real error if they define the profile
+            tree = ast.Module(body=[])
+        self.classes[file] = defined_classes(tree)
+
+    def find_module(self, class_name: str) -> Optional[Path]:
+        """Returns the first module that defines a class with the given
+        name by a class statement, without importing any module"""
+        for file, classes in self.classes.items():
+            if class_name in classes:
+                return file
+        return None
+
+    def get_class(self, class_name: str) -> type:
+        """Returns the profile class with the given name. If multiple
+        modules define it, the first module found is used"""
+        for file, classes in self.classes.items():
+            if class_name in classes:
+                module = self.import_module(file, class_name)
+                if class_name in module.__dict__:
+                    return module.__dict__[class_name]
+        # The class wasn't defined by a class statement, so we
+        # need to import all modules to search for it
+        for file in self.classes:
+            module = self.import_module(file, class_name)
+            if class_name in module.__dict__:
+                return module.__dict__[class_name]
+        raise PreconditionError("The profile '" + class_name +
+                                "' could not be found in any module. " +
+                                "Aborting.")
+
+    def get_profiles(self) -> Dict[str, Path]:
+        """Returns the names of all profiles and the modules that define
+        them, without importing any module. A class is a profile if one
+        of its base classes is Profile or another profile"""
+        bases = {}
+        for file, classes in self.classes.items():
+            for name, class_bases in classes.items():
+                bases.setdefault(name, (file, class_bases))
+        profiles = {}
+        found = True
+        while found:
+            found = False
+            for name, (file, class_bases) in bases.items():
+                if name in profiles:
+                    continue
+                if any(base == "Profile" or base in profiles
+                       for base in class_bases):
+                    profiles[name] = file
+                    found = True
+        return profiles
+
+    def import_module(self, file: Path,
+                      class_name: Optional[str] = None) -> ModuleType:
+        """Imports a profile module once"""
+        if file not in self.modules:
+            try:
+                # Import module
+                spec = importlib.util.spec_from_file_location("__name__",
+                                                              file)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            except Exception as err:
+                raise GenerationError(class_name or file, "The module '" +
+                                      file + "' contains an error and " +
+                                      "therefor can't be imported. The " +
+                                      "error was:\n   " + str(err))
+            self.modules[file] = module
+        return self.modules[file]
+
+    def save(self) -> None:
+        """Writes the classes of all modules to the cache"""
+        if not self.__changed:
+            return
+        modules = {}
+        for file, classes in self.classes.items():
+            modules[file] = {**self.stats[file], "classes": classes}
+        utils.save_cache("profiles", {"directory": self.directory,
+                                      "modules": modules})
+        self.__changed = False
+
+
+def defined_classes(tree: ast.Module) -> Dict[str, List[str]]:
+    """Returns the names of all classes defined at the top level of a
+    module and the names of their base classes"""
+    classes = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            bases = []
+            for base in node.bases:
+                if isinstance(base, ast.Name):
+                    bases.append(base.id)
+                elif isinstance(base, ast.Attribute):
+                    bases.append(base.attr)
+            classes.setdefault(node.name, bases)
+    return classes
+
+
+# The index is built once per run and shared by all lookups
+###############################################################################
+
+_index = None
+
+
+def get_profile_index() -> ProfileIndex:
+    """Returns the index of the profile directory. It will be
+    built on the first call"""
+    global _index
+    if _index is None or _index.directory != constants.PROFILE_FILES:
+        _index = ProfileIndex(constants.PROFILE_FILES)
+    return _index
@@ -0,0 +1,293 @@
+"""This module generates independent profiles in parallel by a pool of
+processes and merges their results like they were generated serially"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import multiprocessing
+import pickle
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from contextlib import contextmanager
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from dotmanager import constants
+from dotmanager.dotfileindex import get_dotfile_index
+from dotmanager.dynamicfile import get_file_stats
+from dotmanager.dynamicfile import get_manifest
+from dotmanager.profilecache import Recording
+from dotmanager.profilecache import find_dynamic_files
+from dotmanager.profilecache import get_fingerprint
+from dotmanager.profilecache import get_profile_cache
+from dotmanager.profilecache import record
+from dotmanager.profilecache import record_imported_modules
+from dotmanager.profilecache import replay
+from dotmanager.profileindex import get_profile_index
+from dotmanager.types import Options
+from dotmanager.types import Path
+from dotmanager.types import ProfileResult
+from dotmanager.utils import import_profile_class
+
+
+# A profile that is generated by the pool: Its name, options, directory,
+# the names of its parents, starting with its direct parent, and the lists
+# and dicts that it shares with other profiles
+Job = Tuple[str, Optional[Options], Optional[Path], List[str], List[Any]]
+
+
+class ParentProfile(NamedTuple):
+    """Stands in for the parents of a profile that is generated by a
+    worker. Subprofiles only need their names to detect cycles"""
+    name: str
+    parent: Optional["ParentProfile"]
+
+
+# The pool while profiles are generated in parallel. The workers are
+# forked before it is set, so they generate their subprofiles serially
+_pool = None
+
+
+@contextmanager
+def parallel_generation() -> Iterator[None]:
+    """Starts PROFILE_JOBS workers that generate independent profiles
+    within the context. They are forked, so this needs to be entered
+    before any profile is generated"""
+    global _pool
+    if constants.PROFILE_JOBS < 2 or _pool is not None:
+        yield
+        return
+    # The indices are loaded only once for all workers
+    get_profile_index()
+    get_dotfile_index()
+    pool = ProcessPoolExecutor(constants.PROFILE_JOBS,
+                               multiprocessing.get_context("fork"))
+    # The workers are forked with the first job
+    pool.submit(int).result()
+    _pool = pool
+    try:
+        yield
+    finally:
+        _pool.shutdown()
+        _pool = None
+
+
+def is_parallel(count: int) -> bool:
+    """Returns if that many profiles will be generated in parallel"""
+    return _pool is not None and count > 1
+
+
+def get_shared(options: Options) -> List[Any]:
+    """Returns the lists and dicts of options. Profiles share them with
+    the profile whose options they got, like subprofiles share the tags
+    of their parent"""
+    return [value for value in options.values()
+            if isinstance(value, (list, dict))]
+
+
+def generate_parallel(jobs: List[Job]
+                      ) -> Iterator[Tuple[ProfileResult, Recording, bool]]:
+    """Generates profiles by the pool and yields their results, recordings
+    and if they changed something that they share with other profiles.
+    Everything else the workers did is merged in the same order, so
+    warnings and errors are the same as if the profiles were generated one
+    after another. The profiles after a profile that changed something
+    were generated with the old options, so the caller needs to generate
+    them again instead of taking their results"""
+    outcomes = []
+    shared = []
+    for profilename, options, directory, parents, objects in jobs:
+        objects = objects + [constants.DEFAULTS]
+        objects += get_shared(constants.DEFAULTS)
+        # Jobs are pickled right away, because the pool would send them
+        # later, when the shared lists and dicts could have been changed.
+        # The defaults are sent too, as the options can share lists with them
+        job = pickle.dumps((profilename, options, directory, parents,
+                            objects, constants.DEFAULTS))
+        outcomes.append(_pool.submit(generate_job, job))
+        shared.append(objects)
+    return merge_outcomes(outcomes, shared)
+
+
+def merge_outcomes(outcomes: List[Future], shared: List[List[Any]]
+                   ) -> Iterator[Tuple[ProfileResult, Recording, bool]]:
+    """Merges the outcomes of jobs in order. After an error the jobs that
+    didn't start yet are cancelled"""
+    try:
+        for outcome, objects in zip(outcomes, shared):
+            *outcome_parts, changed_objects = outcome.result()
+            changed = apply_changes(objects, changed_objects)
+            yield (*merge_outcome(*outcome_parts), changed)
+    finally:
+        for outcome in outcomes:
+            outcome.cancel()
+
+
+def apply_changes(objects: List[Any], changed_objects: List[Any]) -> bool:
+    """Changes shared lists and dicts in place like a worker changed them.
+    Returns if anything was changed"""
+    changed = False
+    for obj, changed_obj in zip(objects, changed_objects):
+        if obj != changed_obj:
+            changed = True
+            if isinstance(obj, list):
+                obj[:] = changed_obj
+            else:
+                obj.clear()
+                obj.update(changed_obj)
+    return changed
+
+
+def generate_job(job: bytes) -> Tuple:
+    """Generates a profile in a worker. Returns its result or the error
+    that occured, what was recorded, which dynamic files the worker
+    generated and the shared lists and dicts after the profile changed
+    them"""
+    (profilename, options, directory, parents,
+     shared, constants.DEFAULTS) = pickle.loads(job)
+    manifest = dict(get_manifest().files)
+    file_stats = dict(get_file_stats().files)
+    # Warnings are logged by the main process
+    recording = Recording(quiet=True)
+    result = error = None
+    with record(recording):
+        try:
+            parent = None
+            for name in reversed(parents):
+                parent = ParentProfile(name, parent)
+            result = import_profile_class(profilename)(options, directory,
+                                                       parent).get()
+            record_imported_modules()
+            # Dynamic files are sent after they were generated
+            wait([dynamic_file.job for dynamic_file
+                  in find_dynamic_files(result) if dynamic_file.job])
+            replace_parents(result)
+        except Exception as err:
+            error = err
+    return (result, error, recording,
+            get_changes(get_manifest().files, manifest),
+            get_changes(get_file_stats().files, file_stats), shared)
+
+
+def stand_in(profile: Any) -> Optional[ParentProfile]:
+    """Returns a stand-in for a parent profile and its parents"""
+    if profile is None:
+        return None
+    return ParentProfile(profile.name, stand_in(profile.parent))
+
+
+def replace_parents(result: ProfileResult) -> None:
+    """Replaces the parent profiles in a ProfileResult and all of its
+    subprofiles by stand-ins, so it can be sent to the main process"""
+    result["parent"] = stand_in(result["parent"])
+    for subprofile in result["profiles"]:
+        replace_parents(subprofile)
+
+
+def merge_outcome(result: Optional[ProfileResult],
+                  error: Optional[Exception], recording: Recording,
+                  manifest: Dict[Path, Any], file_stats: Dict[Path, Any]
+                  ) -> Tuple[ProfileResult, Recording]:
+    """Merges what a worker did into the main process and raises the
+    error of the worker, if there was one"""
+    get_manifest().merge(manifest)
+    get_file_stats().merge(file_stats)
+    replay(list(recording.lookups.values()), recording.warnings,
+           recording.cacheable)
+    if error is not None:
+        raise error
+    return result, recording
+
+
+def get_changes(files: Dict[Path, Any],
+                before: Dict[Path, Any]) -> Dict[Path, Any]:
+    """Returns all entries of a cache that changed"""
+    return {file: entry for file, entry in files.items()
+            if before.get(file) != entry}
+
+
+def generate_roots(profilenames: List[str], options: Optional[Options] = None,
+                   directory: Optional[Path] = None) -> List[ProfileResult]:
+    """Generates root profiles or takes their ProfileResults from the
+    profile cache. The profiles are generated in parallel, if there is
+    more than one to generate"""
+    cache = get_profile_cache() if constants.PROFILE_CACHE else None
+
+    def generate_root(profilename: str) -> ProfileResult:
+        if cache is not None:
+            return cache.get(profilename, options, directory)
+        return import_profile_class(profilename)(options, directory).get()
+
+    if not is_parallel(len(profilenames)):
+        return [generate_root(profilename) for profilename in profilenames]
+    entries = []
+    for profilename in profilenames:
+        fingerprint = entry = None
+        if cache is not None:
+            fingerprint = get_fingerprint(profilename, options, directory)
+            entry = cache.lookup(fingerprint)
+        entries.append((profilename, fingerprint, entry))
+    # Root profiles share the options they got
+    shared = [] if options is None else [options] + get_shared(options)
+    jobs = [(profilename, options, directory, [], shared)
+            for profilename, _, entry in entries if entry is None]
+    # A single profile is generated by the main process instead,
+    # so that its subprofiles can be generated in parallel
+    generated = generate_parallel(jobs) if is_parallel(len(jobs)) else None
+    results = []
+    for profilename, fingerprint, entry in entries:
+        if generated is None:
+            # Cache entries are looked up again, because the profiles
+            # before could have changed the options
+            results.append(generate_root(profilename))
+        elif entry is not None:
+            results.append(cache.reuse(entry))
+        else:
+            result, recording, changed = next(generated)
+            if cache is not None:
+                cache.add(fingerprint, recording, result)
+            results.append(result)
+            if changed:
+                # The profiles after it need to be generated again
+                generated.close()
+                generated = None
+    return results
@@ -0,0 +1,140 @@
+"""This module provides a helper that executes the operations that need root
+permission in a separate process started with sudo"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import json
+import subprocess
+import sys
+import threading
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from dotmanager.dirfd import Directories
+from dotmanager.dirfd import execute_operation
+from dotmanager.types import DiffOperation
+from dotmanager.types import Path
+
+
+class RootHelper:
+    """Starts the helper with sudo and lets it execute the filesystem part
+    of the operations that need root permission. Every operation is sent
+    as a line of JSON and answered by the helper with a line of JSON, so
+    the privileged process never runs any code of the profiles"""
+    def __init__(self, operations: Set[int]) -> None:
+        # The ids of the DiffOperations that need root permission
+        self.operations = operations
+        self.process = None
+        # Operations can be sent from several threads
+        self.lock = threading.Lock()
+
+    def start(self) -> bool:
+        """Starts the helper and waits until it is ready, so the password
+        is asked before any operation is executed. Returns if the helper
+        is ready"""
+        self.process = subprocess.Popen(
+            ["sudo", sys.executable, "-m", "dotmanager.roothelper"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            universal_newlines=True
+        )
+        if self.__receive() is None:
+            self.close()
+            return False
+        return True
+
+    def execute(self, dop: DiffOperation, force: bool) -> List[Path]:
+        """Lets the helper execute the filesystem part of a link operation.
+        Returns all directories that were created. Errors are raised as
+        OSError like they occured in this process"""
+        with self.lock:
+            self.process.stdin.write(json.dumps({"dop": dop, "force": force}))
+            self.process.stdin.write("\n")
+            self.process.stdin.flush()
+            response = self.__receive()
+        if response is None:
+            raise ConnectionError("The root helper exited unexpectedly")
+        if "error" in response:
+            raise OSError(*response["error"])
+        return response["created"]
+
+    def __receive(self) -> Optional[Dict[str, Any]]:
+        """Reads the next response. Returns None if the helper exited"""
+        line = self.process.stdout.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self) -> None:
+        """Stops the helper after it executed all operations"""
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+
+def main() -> None:
+    """Executes operations as they are received on stdin until it is
+    closed. The helper only creates and removes links, everything else is
+    done by the unprivileged process"""
+    directories = Directories()
+    respond({"ready": True})
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            created = execute_operation(request["dop"], directories,
+                                        request["force"])
+            response = {"created": created}
+        except OSError as err:
+            response = {"error": [err.errno, err.strerror, err.filename,
+                                  None, err.filename2]}
+        respond(response)
+    directories.close()
+
+
+def respond(response: Dict[str, Any]) -> None:
+    """Sends a response to the unprivileged process"""
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
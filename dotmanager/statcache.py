@@ -0,0 +1,123 @@
+"""This module provides a cache for the stats of paths during a run"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import os
+from stat import S_ISDIR
+from typing import Dict
+from typing import Optional
+from dotmanager.types import Path
+
+
+class StatCache:
+    """Caches the results of stat, lstat and access, because the same paths
+    are checked by the profiles and several interpreters. Everything that
+    modifies the filesystem needs to invalidate the paths that it changed"""
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.__stats = {}
+        self.__lstats = {}
+        self.__access = {}
+
+    def __lookup(self, cache: Dict, path: Path,
+                 follow_symlinks: bool) -> Optional[os.stat_result]:
+        """Returns the cached stat of a path or None if it doesn't exist"""
+        try:
+            result = cache[path]
+            self.hits += 1
+            return result
+        except KeyError:
+            self.misses += 1
+        try:
+            result = os.stat(path, follow_symlinks=follow_symlinks)
+        except (OSError, ValueError):
+            result = None
+        cache[path] = result
+        return result
+
+    def stat(self, path: Path) -> Optional[os.stat_result]:
+        """Returns the stat of a path or None if it doesn't exist"""
+        return self.__lookup(self.__stats, path, True)
+
+    def lstat(self, path: Path) -> Optional[os.stat_result]:
+        """Returns the stat of a path without following symlinks or
+        None if it doesn't exist"""
+        return self.__lookup(self.__lstats, path, False)
+
+    def isdir(self, path: Path) -> bool:
+        """Same as os.path.isdir()"""
+        stat = self.stat(path)
+        return stat is not None and S_ISDIR(stat.st_mode)
+
+    def exists(self, path: Path) -> bool:
+        """Same as os.path.exists()"""
+        return self.stat(path) is not None
+
+    def lexists(self, path: Path) -> bool:
+        """Same as os.path.lexists()"""
+        return self.lstat(path) is not None
+
+    def access(self, path: Path, mode: int) -> bool:
+        """Same as os.access()"""
+        modes = self.__access.setdefault(path, {})
+        try:
+            result = modes[mode]
+            self.hits += 1
+            return result
+        except KeyError:
+            self.misses += 1
+        modes[mode] = result = os.access(path, mode)
+        return result
+
+    def invalidate(self, path: Path) -> None:
+        """Forgets everything about a path, because it was modified"""
+        self.__stats.pop(path, None)
+        self.__lstats.pop(path, None)
+        self.__access.pop(path, None)
+
+
+_stat_cache = None
+
+
+def get_stat_cache() -> StatCache:
+    """Returns the stat cache of this run"""
+    global _stat_cache
+    if _stat_cache is None:
+        _stat_cache = StatCache()
+    return _stat_cache
@@ -39,20 +39,27 @@ Eg. Retrieving a environment variable or fixing file permisions"""
 
 
 import datetime
-import importlib.util
+import json
 import logging
 import os
 import pwd
 import re
 import subprocess
+import tempfile
+from stat import S_ISREG
+from typing import Any
+from typing import Callable
+from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Tuple
 from dotmanager import constants
+from dotmanager import dotfileindex
+from dotmanager import profileindex
+from dotmanager.statcache import get_stat_cache
+from dotmanager.types import DiffLogData
 from dotmanager.types import Path
 from dotmanager.types import RelPath
-from dotmanager.errors import FatalError
-from dotmanager.errors import GenerationError
 from dotmanager.errors import PreconditionError
 
 
@@ -61,75 +68,34 @@ from dotmanager.errors import PreconditionError
 
 def find_target(target: str, tags: List[str]) -> Optional[Path]:
     """Find the correct target version in the repository to link to"""
-    targets = []
-    # Collect all files that have the same filename as the target
-    for root, name in walk_dotfiles():
-        # We need to look if filename matches a tag
-        for tag in tags:
-            if name == tag + "%" + target:
-                targets.append(os.path.join(root, name))
-    if not targets:
-        # Seems like nothing was found, but we searched only files
-        # with tags so far. Trying without tags as fallback
-        return find_exact_target(target)
-    # Return found target. Because we found files with tags, we use
-    # the file that matches the earliest defined tag
-    for tag in tags:
-        for tmp_target in targets:
-            if os.path.basename(tmp_target).startswith(tag):
-                return tmp_target
-    raise FatalError("No target was found even though there seems to " +
-                     "exist one. That's strange...")
+    return dotfileindex.get_dotfile_index().find_target(target, tags)
 
 
 def find_exact_target(target: str) -> Optional[Path]:
     """Find the exact target in the repository to link to"""
-    targets = []
-    # Collect all files that have the same filename as the target
-    for root, name in walk_dotfiles():
-        if name == target:
-            targets.append(os.path.join(root, name))
-    # Whithout tags there shall be only one file that matches the target
-    if len(targets) > 1:
-        msg = "There are multiple targets that match: '" + target + "'"
-        for tmp_target in targets:
-            msg += "\n  " + tmp_target
-        raise ValueError(msg)
-    elif not targets:
-        # Ooh, nothing found
-        return None
-    # Return found target
-    return targets[0]
+    return dotfileindex.get_dotfile_index().find_exact_target(target)
 
 
 def walk_dotfiles() -> List[Tuple[Path, str]]:
     """Returns a list of all dotfiles as tuple of directory and filename"""
-    # load ignore list
-    ignorelist_path = os.path.join(constants.TARGET_FILES, ".dotignore")
-    if os.path.exists(ignorelist_path):
-        with open(ignorelist_path, "r") as file:
-            ignorelist = file.readlines()
-        ignorelist = [entry.strip() for entry in ignorelist]
-    else:
-        ignorelist = []
-    # walk through dotfile directory
-    result = []
-    for root, _, files in os.walk(constants.TARGET_FILES):
-        for name in files:
-            # check if file should be ignored
-            on_ignorelist = False
-            for entry in ignorelist:
-                if re.search(entry, os.path.join(root, name)):
-                    on_ignorelist = True
-            # if not add it to result
-            if not on_ignorelist:
-                result.append((root, name))
-    return result
+    return list(dotfileindex.get_dotfile_index().files)
 
 
 # Utils for permissions and user
 ###############################################################################
 
+# The hidden argument that tells a process that was restarted with sudo
+# where to find the snapshot of the environment of the real user
+USER_ENV_SNAPSHOT = "--user-env-snapshot"
+# The hidden argument that tells a process that was restarted with sudo
+# where to find the DiffLog that was already solved and checked
+PLAN = "--plan"
+# The files that were handed over by these arguments
+_handovers = {}
+# The environment of the real user, if executed as root
+_user_environ = None
+
+
 def get_uid() -> None:
     """Get real users id"""
     sudo_uid = os.environ.get('SUDO_UID')
@@ -149,10 +115,12 @@ def get_gid() -> None:
 def get_dir_owner(filename: Path) -> Tuple[int, int]:
     """Gets the owner of the directory of filename.
     Works even for directories that doesn't exist"""
+    stat_cache = get_stat_cache()
     dirname = os.path.dirname(filename)
-    while not os.path.isdir(dirname):
+    while not stat_cache.isdir(dirname):
         dirname = os.path.dirname(dirname)
-    return os.stat(dirname).st_uid, os.stat(dirname).st_gid
+    stat = stat_cache.stat(dirname)
+    return stat.st_uid, stat.st_gid
 
 
 def has_root_priveleges() -> None:
@@ -168,33 +136,112 @@ def get_current_username() -> None:
 def get_user_env_var(varname: str, fallback: str = None) -> str:
     """Lookup an environment variable. If executed as root, the
     envirionment variable of the real user is return"""
-    if has_root_priveleges():
+    try:
+        return get_user_environ()[varname]
+    except KeyError:
+        if fallback is not None:
+            return fallback
+        msg = "There is no environment varibable set"
+        if has_root_priveleges():
+            msg += " for user '" + get_current_username() + "'"
+        raise PreconditionError(msg + " with the name: '" + varname + "'")
+
+
+def get_user_environ() -> Dict[str, str]:
+    """Returns the environment of the real user. If executed as root, it
+    is loaded only once per process. Preferably from the snapshot that
+    was handed over by the process that restarted us with sudo"""
+    global _user_environ
+    # A normal user can access its own variables
+    if not has_root_priveleges():
+        return os.environ
+    if _user_environ is None:
+        _user_environ = load_user_env_snapshot()
+    if _user_environ is None:
         # Looks like we have to load the environment vars by ourself
-        user_environ = {}
+        _user_environ = {}
         # Login into other user and read env
         proc = subprocess.run(
             ["sudo", "-Hiu", get_current_username(), "env"],
             stdout=subprocess.PIPE
         )
-        for line in proc.stdout.splitlines():
-            key, val = line.decode().split("=", 1)
-            user_environ[key] = val
-        # User environ is loaded, so we can lookup
-        try:
-            return user_environ[varname]
-        except KeyError:
-            msg = "There is no environment varibable set for user '"
-            msg += get_current_username() + "' with the name: '"
-            msg += varname + "'"
-            raise PreconditionError(msg)
-    # A normal user can access its own variables
+        for line in proc.stdout.decode().splitlines():
+            if "=" in line:
+                key, val = line.split("=", 1)
+                _user_environ[key] = val
+    return _user_environ
+
+
+def set_handovers(user_env_snapshot: Optional[Path],
+                  plan: Optional[Path]) -> None:
+    """Sets the files that were handed over by the hidden arguments. They
+    are passed as arguments, so sudo only needs to allow the interpreter"""
+    _handovers[USER_ENV_SNAPSHOT] = user_env_snapshot
+    _handovers[PLAN] = plan
+
+
+def save_user_env_snapshot() -> Path:
+    """Writes the environment of the real user to a private file, so it
+    can be handed over to a process that is restarted with sudo"""
+    return _save_handover("userenv.", dict(get_user_environ()))
+
+
+def load_user_env_snapshot() -> Optional[Dict[str, str]]:
+    """Loads and removes the environment snapshot that was handed over
+    by the unprivileged process"""
+    return _load_handover(USER_ENV_SNAPSHOT)
+
+
+def save_plan(data: DiffLogData, fingerprint: str) -> Path:
+    """Writes the DiffLogData that was already solved and checked to a
+    private file, so it can be handed over to a process that is
+    restarted with sudo together with the fingerprint of its inputs"""
+    return _save_handover("plan.", {"fingerprint": fingerprint,
+                                    "difflog": data})
+
+
+def load_plan(fingerprint: Callable[[], str]) -> Optional[DiffLogData]:
+    """Loads and removes the DiffLogData that was handed over by the
+    unprivileged process. It is only accepted if it was solved from
+    the same inputs, otherwise it needs to be solved again"""
+    if not has_root_priveleges():
+        return None
+    plan = _load_handover(PLAN)
+    if plan is None:
+        return None
+    if plan.get("fingerprint") != fingerprint():
+        logger.debug("The inputs changed since the plan was handed " +
+                     "over. Solving the DiffLog again.")
+        return None
+    return plan["difflog"]
+
+
+def _save_handover(prefix: str, content: Any) -> Path:
+    """Writes content to a private file in the cache directory"""
+    os.makedirs(constants.CACHE_DIRECTORY, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=".json",
+                                dir=constants.CACHE_DIRECTORY)
+    with os.fdopen(fd, "w") as file:
+        json.dump(content, file)
+    return path
+
+
+def _load_handover(argument: str) -> Optional[Any]:
+    """Loads and removes the file that was handed over by a hidden
+    argument. Only files owned by the real user are accepted"""
+    path = _handovers.pop(argument, None)
+    if not path:
+        return None
     try:
-        return os.environ[varname]
-    except KeyError:
-        if fallback is not None:
-            return fallback
-        raise PreconditionError("There is no environment varibable set " +
-                                "with the name: '" + varname + "'")
+        stat = os.lstat(path)
+        if not S_ISREG(stat.st_mode) or stat.st_uid != get_uid():
+            return None
+        with open(path, "r") as file:
+            content = json.load(file)
+        os.unlink(path)
+    except (OSError, ValueError):
+        return None
+    return content
 
 
 def expandvars(path: RelPath) -> RelPath:
@@ -245,30 +292,41 @@ def normpath(path: RelPath) -> Path:
 # Dynamic imports
 ###############################################################################
 
-def import_profile_class(class_name: str) -> None:
+def import_profile_class(class_name: str) -> type:
     """This function imports a profile class only by it's name"""
-    # Go through all files in the profile directory
-    for root, _, files in os.walk(constants.PROFILE_FILES):
-        for file in files:
-            file = os.path.join(root, file)
-            # Ignore everything that isn't a python module
-            if file[-2:] != "py":
-                break
-            try:
-                # Import module
-                spec = importlib.util.spec_from_file_location("__name__", file)
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-            except Exception as err:
-                raise GenerationError(class_name, "The module '" + file +
-                                      "' contains an error and therefor " +
-                                      "can't be imported. The error was:" +
-                                      "\n   " + str(err))
-            # Return the class if it is in this module
-            if class_name in module.__dict__:
-                return module.__dict__[class_name]
-    raise PreconditionError("The profile '" + class_name +
-                            "' could not be found in any module. Aborting.")
+    return profileindex.get_profile_index().get_class(class_name)
+
+
+# Caches
+###############################################################################
+
+def load_cache(name: str) -> Optional[Any]:
+    """Loads a cache from the cache directory. Returns None if the
+    cache doesn't exist, is corrupted or was written by another version"""
+    path = os.path.join(constants.CACHE_DIRECTORY, name + ".json")
+    try:
+        with open(path, "r") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(cache, dict) or
+            cache.get("@version") != constants.VERSION):
+        return None
+    return cache
+
+
+def save_cache(name: str, cache: Dict[str, Any]) -> None:
+    """Writes a cache atomically to the cache directory. Caches are
+    only an optimization, so failing to write them is not an error"""
+    path = os.path.join(constants.CACHE_DIRECTORY, name + ".json")
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w") as file:
+            json.dump({**cache, "@version": constants.VERSION}, file)
+        os.chown(tmp_path, get_uid(), get_gid())
+        os.replace(tmp_path, path)
+    except OSError as err:
+        logger.debug("Could not write cache '" + path + "': " + str(err))
 
 
 # Misc
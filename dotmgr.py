@@ -36,7 +36,9 @@ Run this directly from the CLI or import DotManager for debugging"""
 
 import argparse
 import csv
+import glob
 import grp
+import hashlib
 import json
 import logging
 import os
@@ -44,7 +46,9 @@ import pwd
 import shutil
 import sys
 import traceback
+from typing import Dict
 from typing import List
+from typing import Optional
 from dotmanager import constants
 from dotmanager.interpreters import CheckDynamicFilesI
 from dotmanager.interpreters import CheckLinkBlacklistI
@@ -55,9 +59,12 @@ from dotmanager.interpreters import CheckProfilesI
 from dotmanager.interpreters import DUIStrategyI
 from dotmanager.interpreters import ExecuteI
 from dotmanager.interpreters import GainRootI
+from dotmanager.interpreters import ParallelExecuteI
 from dotmanager.interpreters import PlainPrintI
 from dotmanager.interpreters import PrintI
+from dotmanager.interpreters import RecordI
 from dotmanager.interpreters import RootNeededI
+from dotmanager.interpreters import UpdateInstalledI
 from dotmanager.errors import CustomError
 from dotmanager.errors import FatalError
 from dotmanager.errors import PreconditionError
@@ -65,12 +72,34 @@ from dotmanager.errors import UnkownError
 from dotmanager.errors import UserError
 from dotmanager.differencesolver import DiffSolver
 from dotmanager.differencelog import DiffLog
+from dotmanager.dynamicfile import find_garbage
+from dotmanager.dynamicfile import get_file_stats
+from dotmanager.dynamicfile import get_manifest
+from dotmanager.dynamicfile import save_caches
+from dotmanager.fingerprint import create_fingerprint
+from dotmanager.fingerprint import hash_inputs
+from dotmanager.fingerprint import is_unchanged
+from dotmanager.fingerprint import untouched_difflog
+from dotmanager.installeddb import InstalledDatabase
+from dotmanager.journal import Journal
+from dotmanager.journal import write_installed
+from dotmanager.profilecache import Recording
+from dotmanager.profilecache import record
+from dotmanager.profileindex import get_profile_index
+from dotmanager.roothelper import RootHelper
+from dotmanager.statcache import get_stat_cache
+from dotmanager.types import InstalledLog
 from dotmanager.types import InstalledProfile
-from dotmanager.utils import has_root_priveleges
+from dotmanager.types import Path
+from dotmanager.utils import get_date_time_now
 from dotmanager.utils import get_uid
-from dotmanager.utils import get_gid
+from dotmanager.utils import has_root_priveleges
+from dotmanager.utils import load_plan
 from dotmanager.utils import log_success
 from dotmanager.utils import log_warning
+from dotmanager.utils import set_handovers
+from dotmanager.utils import PLAN
+from dotmanager.utils import USER_ENV_SNAPSHOT
 
 
 class DotManager:
@@ -80,6 +109,10 @@ class DotManager:
     def __init__(self):
         # Fields
         self.installed = {"@version": constants.VERSION}
+        self.journal = None
+        self.database = None
+        # If the installed-file needs to be written back
+        self.dirty = False
         self.args = None
         # Change current working directory to the directory of this module
         self.owd = os.getcwd()
@@ -88,19 +121,98 @@ class DotManager:
     def load_installed(self) -> None:
         """Reads Installed-File and parses it's InstallationLog
         into self.installed"""
-        try:
-            self.installed = json.load(open(constants.INSTALLED_FILE))
-        except FileNotFoundError:
+        self.convert_installed()
+        if not os.path.isfile(constants.INSTALLED_FILE):
             logger.debug("No installed profiles found.")
+        if constants.INSTALLED_BACKEND == "sqlite":
+            self.database = InstalledDatabase(constants.INSTALLED_FILE)
+            if self.args.show and self.args.profiles:
+                # Only the profiles that are shown need to be queried
+                self.installed = self.database.read(self.args.profiles)
+            else:
+                self.installed = self.database.read()
+        else:
+            self.installed = self.read_installed(constants.INSTALLED_FILE)
+            self.journal = Journal(constants.INSTALLED_FILE,
+                                   self.installed.get("@generation", 0))
         # Check installed-file version
-        if (int(self.installed["@version"].split("_")[1]) !=
-                int(constants.VERSION.split("_")[1])):
+        schema = int(self.installed["@version"].split("_")[1])
+        if schema in constants.COMPATIBLE_SCHEMAS:
+            # The new version is stored with the next change
+            logger.debug("Upgrading installed-file schema " + str(schema))
+            self.installed["@version"] = constants.VERSION
+        elif schema != int(constants.VERSION.split("_")[1]):
             msg = "There was a change of the installed-file schema "
             msg += "with the last update. Please revert to version "
             msg += self.installed["@version"] + " and uninstall "
             msg += "all of your profiles before using this version."
             raise PreconditionError(msg)
 
+    @staticmethod
+    def convert_installed() -> None:
+        """Converts the installed-file if it was written by another
+        installedBackend than the configured one"""
+        base = os.path.splitext(constants.INSTALLED_FILE)[0]
+        if constants.INSTALLED_BACKEND == "sqlite":
+            other_file = base + ".json"
+        else:
+            other_file = base + ".sqlite"
+        if (os.path.isfile(constants.INSTALLED_FILE) or
+                not os.path.isfile(other_file)):
+            return
+        installed = DotManager.read_installed(other_file)
+        if constants.INSTALLED_BACKEND == "sqlite":
+            database = InstalledDatabase(constants.INSTALLED_FILE)
+            database.write(installed)
+            database.close()
+        else:
+            write_installed(constants.INSTALLED_FILE, installed)
+        os.remove(other_file)
+        if os.path.isfile(other_file + ".journal"):
+            os.remove(other_file + ".journal")
+        logger.info("Converted '" + other_file + "' to '" +
+                    constants.INSTALLED_FILE + "'.")
+
+    @staticmethod
+    def read_installed(installed_file: Path) -> InstalledLog:
+        """Reads an installed-file of any installedBackend. The operations
+        that were recorded in the journal of a JSON installed-file since it
+        was written are replayed"""
+        if installed_file.endswith(".sqlite"):
+            database = InstalledDatabase(installed_file)
+            installed = database.read()
+            database.close()
+            return installed
+        try:
+            with open(installed_file) as file:
+                installed = json.load(file)
+        except FileNotFoundError:
+            installed = {"@version": constants.VERSION}
+        journal = Journal(installed_file, installed.get("@generation", 0))
+        updater = UpdateInstalledI(installed)
+        for date, dop in journal.read():
+            updater.date = date
+            updater.call_operation(dop)
+        return installed
+
+    def save_installed(self) -> None:
+        """Writes the installed profiles back to the installed-file. In
+        journal mode this is only done if the journal got too big. The
+        database only needs to commit the applied operations"""
+        if self.database is not None:
+            self.database.close()
+            return
+        if self.journal is None:
+            # The installed-file wasn't even loaded
+            return
+        self.journal.close()
+        if constants.JOURNAL:
+            if not self.journal.needs_compaction():
+                return
+        elif not self.dirty and not self.journal.exists():
+            return
+        write_installed(constants.INSTALLED_FILE, self.installed)
+
     def parse_arguments(self, arguments: List[str] = None) -> None:
         """Creates an ArgumentParser and parses sys.args into self.args"""
         if arguments is None:
@@ -120,6 +232,11 @@ class DotManager:
         parser.add_argument("-f", "--force",
                             help="overwrite existing files with links",
                             action="store_true")
+        parser.add_argument("-j", "--jobs",
+                            help="create and remove up to JOBS links at " +
+                            "the same time",
+                            type=int,
+                            default=1)
         parser.add_argument("--log",
                             help="specify a file to log to")
         parser.add_argument("-m", "--makedirs",
@@ -165,6 +282,13 @@ class DotManager:
         modes.add_argument("--debuginfo",
                            help="displays internal values",
                            action="store_true")
+        modes.add_argument("--gc",
+                           help="remove dynamic files that are not linked " +
+                           "by any installed-file",
+                           action="store_true")
+        modes.add_argument("--list-profiles",
+                           help="list all profiles in the profile directory",
+                           action="store_true")
         modes.add_argument("-u", "--uninstall",
                            help="uninstall (sub)profiles",
                            action="store_true")
@@ -179,11 +303,18 @@ class DotManager:
                             help="list of root profiles",
                             nargs="*")
 
+        # Files handed over to the process that was restarted with sudo
+        parser.add_argument(USER_ENV_SNAPSHOT, help=argparse.SUPPRESS)
+        parser.add_argument(PLAN, help=argparse.SUPPRESS)
+
         # Read arguments
         try:
             self.args = parser.parse_args(arguments)
         except argparse.ArgumentError as err:
             raise UserError(err.message)
+        # The handed over files aren't inputs of the run
+        set_handovers(vars(self.args).pop("user_env_snapshot"),
+                      vars(self.args).pop("plan"))
         if self.args.opt_dict and "tags" in self.args.opt_dict:
             reader = csv.reader([self.args.opt_dict["tags"]])
             self.args.opt_dict["tags"] = next(reader)
@@ -217,13 +348,21 @@ class DotManager:
             self.args.makedirs = constants.MAKEDIRS
 
         # Check if arguments are bad
-        if (not (self.args.show or self.args.version or self.args.debuginfo)
+        if (not (self.args.show or self.args.version or self.args.debuginfo
+                 or self.args.list_profiles or self.args.gc)
                 and not self.args.profiles):
             raise UserError("No Profile specified!!")
-        if ((self.args.dryrun or self.args.force or self.args.plain or
-             self.args.dui) and not
+        if ((self.args.force or self.args.plain or self.args.dui) and not
                 (self.args.install or self.args.uninstall)):
-            raise UserError("-d/-f/-p/--dui needs to be used with -i or -u")
+            raise UserError("-f/-p/--dui needs to be used with -i or -u")
+        if self.args.jobs != 1 and not (self.args.install or
+                                        self.args.uninstall):
+            raise UserError("--jobs needs to be used with -i or -u")
+        if self.args.jobs < 1:
+            raise UserError("--jobs needs to be at least 1")
+        if self.args.dryrun and not (self.args.install or
+                                     self.args.uninstall or self.args.gc):
+            raise UserError("-d needs to be used with -i, -u or --gc")
         if self.args.parent and not self.args.install:
             raise UserError("--parent needs to be used with -i")
 
@@ -236,19 +375,96 @@ class DotManager:
                   constants.VERSION)
         elif self.args.debuginfo:
             self.print_debuginfo()
+        elif self.args.list_profiles:
+            self.print_profiles()
+        elif self.args.gc:
+            self.collect_garbage()
         else:
-            dfs = DiffSolver(self.installed, self.args)
-            dfl = dfs.solve(self.args.install)
-            if self.args.dui:
-                dfl.run_interpreter(DUIStrategyI())
-            if self.args.dryrun:
-                self.dryrun(dfl)
-            elif self.args.plain:
-                dfl.run_interpreter(PlainPrintI())
-            elif self.args.print:
-                dfl.run_interpreter(PrintI())
+            plan = load_plan(self.fingerprint)
+            if plan is not None:
+                # We were restarted with sudo and the unprivileged process
+                # already solved and checked the DiffLog for us
+                self.execute(DiffLog(plan))
+            elif (constants.SKIP_UNCHANGED and self.args.install and
+                  not self.args.dryrun and not self.args.plain and
+                  not self.args.print):
+                self.install()
             else:
-                self.run(dfl)
+                dfs = DiffSolver(self.installed, self.args)
+                dfl = dfs.solve(self.args.install)
+                if self.args.dui:
+                    dfl.run_interpreter(DUIStrategyI())
+                if self.args.dryrun:
+                    self.dryrun(dfl)
+                elif self.args.plain:
+                    dfl.run_interpreter(PlainPrintI())
+                elif self.args.print:
+                    dfl.run_interpreter(PrintI())
+                else:
+                    self.run(dfl)
+                    if "@fingerprint" in self.installed:
+                        # It would be outdated after this run
+                        self.save_fingerprint(None)
+            stat_cache = get_stat_cache()
+            logger.debug("Stat cache: %d hits, %d misses",
+                         stat_cache.hits, stat_cache.misses)
+
+    def install(self) -> None:
+        """Installs the profiles. If the fingerprint of the last installation
+        still matches, nothing would change, so the profiles aren't even
+        generated. Otherwise a new fingerprint is stored afterwards"""
+        inputs = hash_inputs(self.args)
+        fingerprint = self.installed.get("@fingerprint")
+        if is_unchanged(fingerprint, inputs, self.installed):
+            logger.debug("Nothing changed since the last installation.")
+            for message in fingerprint["warnings"]:
+                log_warning(message)
+            untouched_difflog(fingerprint,
+                              self.installed).run_interpreter(PrintI())
+            return
+        recording = Recording()
+        dfs = DiffSolver(self.installed, self.args)
+        with record(recording):
+            dfl = dfs.solve(True)
+        if self.args.dui:
+            dfl.run_interpreter(DUIStrategyI())
+        self.run(dfl)
+        # The operations were only applied to the database
+        installed = self.installed if self.database is None \
+            else self.database.read()
+        self.save_fingerprint(create_fingerprint(inputs, installed,
+                                                 recording, dfs.solved))
+
+    def save_fingerprint(self, fingerprint: Optional[Dict]) -> None:
+        """Stores the fingerprint of the installation that was just
+        executed in the installed-file"""
+        if fingerprint is None:
+            self.installed.pop("@fingerprint", None)
+        else:
+            self.installed["@fingerprint"] = fingerprint
+        dop = {"operation": "fingerprint", "fingerprint": fingerprint}
+        if self.database is not None:
+            self.database.append(get_date_time_now(), dop)
+        elif constants.JOURNAL:
+            self.journal.append(get_date_time_now(), dop)
+
+    def fingerprint(self) -> str:
+        """Returns a fingerprint of all inputs the DiffLog is solved from.
+        It is handed over together with the DiffLog, when we restart with
+        sudo, so the restarted process can tell if the DiffLog is still
+        valid"""
+        inputs = {
+            "version": constants.VERSION,
+            "uid": get_uid(),
+            "args": vars(self.args),
+            "settings": [constants.INSTALLED_FILE, constants.PROFILE_FILES,
+                         constants.TARGET_FILES, constants.DIR_DEFAULT,
+                         constants.DEFAULTS],
+            "installed": self.installed,
+            "profiles": get_profile_index().stats
+        }
+        inputs = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(inputs.encode()).hexdigest()
 
     def print_debuginfo(self) -> None:
         """Print out all constants"""
@@ -260,11 +476,20 @@ class DotManager:
         print(constants.BOLD + "Settings: " + constants.ENDC)
         print("   COLOR: " + str(constants.COLOR))
         print("   DECRYPT_PWD: " + str(constants.DECRYPT_PWD))
+        print("   DECRYPT_JOBS: " + str(constants.DECRYPT_JOBS))
+        print("   JOURNAL: " + str(constants.JOURNAL))
+        print("   INSTALLED_BACKEND: " + constants.INSTALLED_BACKEND)
+        print("   PRIVILEGE_SEPARATION: " +
+              str(constants.PRIVILEGE_SEPARATION))
+        print("   PROFILE_CACHE: " + str(constants.PROFILE_CACHE))
+        print("   PROFILE_JOBS: " + str(constants.PROFILE_JOBS))
+        print("   SKIP_UNCHANGED: " + str(constants.SKIP_UNCHANGED))
         print("   BACKUP_EXTENSION: " + constants.BACKUP_EXTENSION)
         print("   PROFILE_FILES: " + constants.PROFILE_FILES)
         print("   TARGET_FILES: " + constants.TARGET_FILES)
         print("   INSTALLED_FILE: " + constants.INSTALLED_FILE)
         print("   INSTALLED_FILE_BACKUP: " + constants.INSTALLED_FILE_BACKUP)
+        print("   CACHE_DIRECTORY: " + constants.CACHE_DIRECTORY)
         print(constants.BOLD + "Defaults: " + constants.ENDC)
         print("   DIR_DEFAULT: " + constants.DIR_DEFAULT)
         print("   DEFAULTS['name']: " + str(constants.DEFAULTS["name"]))
@@ -281,6 +506,52 @@ class DotManager:
               str(constants.DEFAULTS["replace_pattern"]))
         print("   DEFAULTS['suffix']: " + str(constants.DEFAULTS["suffix"]))
 
+    def print_profiles(self) -> None:
+        """Prints all profiles that are defined in the profile directory
+        without importing any of them"""
+        profiles = get_profile_index().get_profiles()
+        for name, file in sorted(profiles.items()):
+            print(constants.BOLD + name + constants.ENDC + "  (" +
+                  os.path.relpath(file, constants.PROFILE_FILES) + ")")
+
+    def collect_garbage(self) -> None:
+        """Removes all dynamic files that are not linked by any of the
+        installed-files anymore"""
+        used_files = set()
+        installed_dir = os.path.dirname(constants.INSTALLED_FILE)
+        installed_files = glob.glob(os.path.join(installed_dir, "*.json"))
+        installed_files += glob.glob(os.path.join(installed_dir, "*.sqlite"))
+        for installed_file in installed_files:
+            installed = self.read_installed(installed_file)
+            for key, profile in installed.items():
+                if key[0] != "@":
+                    for link in profile["links"]:
+                        used_files.add(link["target"])
+        size = 0
+        count = 0
+        for file in find_garbage(used_files):
+            file_size = os.lstat(file).st_size
+            if self.args.dryrun:
+                print(file)
+            else:
+                try:
+                    os.remove(file)
+                except OSError as err:
+                    log_warning("Could not remove '" + file + "': " +
+                                str(err))
+                    continue
+            size += file_size
+            count += 1
+        if self.args.dryrun:
+            print(f"{count} files ({size} bytes) would be removed.")
+        else:
+            # Decrypted files that were removed need to be decrypted again
+            get_manifest().prune()
+            # And the stats of removed files don't need to be kept
+            get_file_stats().prune()
+            save_caches()
+            print(f"Removed {count} files ({size} bytes).")
+
     def print_installed_profiles(self) -> None:
         """Shows only the profiles specified.
         If none are specified shows all."""
@@ -300,32 +571,80 @@ class DotManager:
         """This runs Checks then executes DiffOperations while
         pretty printing the DiffLog"""
         # Run integration tests on difflog
-        difflog.run_interpreter(
-            CheckProfilesI(self.installed, self.args.parent)
-        )
         tests = [
+            CheckProfilesI(self.installed, self.args.parent),
             CheckLinksI(self.installed),
             CheckLinkDirsI(self.args.makedirs),
-            CheckLinkExistsI(self.args.force),
-            CheckDynamicFilesI(False)
+            CheckLinkExistsI(self.args.force)
         ]
-        difflog.run_interpreter(*tests)
         # Gain root if needed
-        if not has_root_priveleges():
-            difflog.run_interpreter(GainRootI())
-        # Check blacklist not until now, because the user would need confirm it
-        # twice if the programm is restarted with sudo
-        difflog.run_interpreter(CheckLinkBlacklistI(self.args.superforce))
+        root_needed = None
+        if has_root_priveleges():
+            gain_root = []
+        elif constants.PRIVILEGE_SEPARATION:
+            # Only the operations that need root permission will be
+            # executed by a helper that is started with sudo
+            root_needed = RootNeededI()
+            gain_root = [root_needed]
+        else:
+            gain_root = [GainRootI(self.fingerprint)]
+        difflog.run_pipeline(tests, gain_root)
+        if root_needed is not None and root_needed.root_needed:
+            self.execute(difflog, RootHelper(root_needed.privileged))
+        else:
+            self.execute(difflog)
+
+    def execute(self, difflog: DiffLog,
+                helper: Optional[RootHelper] = None) -> None:
+        """Executes the DiffOperations of a checked DiffLog while
+        pretty printing them. The RootHelper executes the operations
+        that need root permission"""
+        # Check blacklist and dynamic files not until now, because the user
+        # would need to confirm them twice if the programm is restarted
+        # with sudo
+        interactions = [
+            CheckLinkBlacklistI(self.args.superforce),
+            CheckDynamicFilesI(False)
+        ]
+        difflog.run_interpreter(*interactions)
+        if helper is not None and not helper.start():
+            raise PreconditionError("Could not gain root permission.")
         # Now the critical part starts
+        self.dirty = True
+        date = get_date_time_now()
         try:
-            # Create Backup in case something wents wrong,
-            # so the user can fix the mess we caused
-            if os.path.isfile(constants.INSTALLED_FILE):
+            if self.args.jobs > 1:
+                # Execute all operations concurrently first. Afterwards the
+                # difflog only contains the executed operations, that are
+                # applied to the installed-file in order
+                parallel = ParallelExecuteI(self.args.force, self.args.jobs,
+                                            helper)
+                difflog.run_interpreter(parallel)
+                execute = []
+            else:
+                parallel = None
+                execute = [ExecuteI(self.args.force, helper)]
+            if self.database is not None:
+                # All operations are applied directly to the database in a
+                # single transaction, self.installed is left as it was
+                execute.append(RecordI(self.database, date))
+            else:
+                self.installed["@version"] = constants.VERSION
+                execute.append(UpdateInstalledI(self.installed, date))
+                if constants.JOURNAL:
+                    # The journal records exactly which operations were
+                    # executed
+                    execute.append(RecordI(self.journal, date))
+            if ((self.database is not None or not constants.JOURNAL) and
+                    os.path.isfile(constants.INSTALLED_FILE)):
+                # Create Backup in case something wents wrong,
+                # so the user can fix the mess we caused
                 shutil.copyfile(constants.INSTALLED_FILE,
                                 constants.INSTALLED_FILE_BACKUP)
             # Execute all operations of the difflog and print them
-            difflog.run_interpreter(ExecuteI(self.installed, self.args.force),
-                                    PrintI())
+            difflog.run_interpreter(*execute, PrintI())
+            if parallel is not None and parallel.error is not None:
+                raise parallel.error
             # Remove Backup
             if os.path.isfile(constants.INSTALLED_FILE_BACKUP):
                 os.remove(constants.INSTALLED_FILE_BACKUP)
@@ -333,10 +652,19 @@ class DotManager:
             raise
         except Exception as err:
             msg = "An unkown error occured during linking/unlinking. Some "
-            msg += "links or your installed-file may be corrupted! Check the "
-            msg += "backup of your installed-file to resolve all possible "
-            msg += "issues before you proceed to use this tool!"
+            if self.database is None and constants.JOURNAL:
+                msg += "links may be corrupted! All executed operations were "
+                msg += "recorded in the journal of your installed-file, but "
+                msg += "check the link that failed before you proceed to use "
+                msg += "this tool!"
+            else:
+                msg += "links or your installed-file may be corrupted! Check "
+                msg += "the backup of your installed-file to resolve all "
+                msg += "possible issues before you proceed to use this tool!"
             raise UnkownError(err, msg) from err
+        finally:
+            if helper is not None:
+                helper.close()
         logger.debug("Finished succesfully.")
 
     def print_installed(self, profile: InstalledProfile) -> None:
@@ -364,19 +692,15 @@ class DotManager:
         """Runs Checks and pretty prints the DiffLog"""
         log_warning("This is just a dry-run! Nothing of this " +
                     "is actually happening.")
-        difflog.run_interpreter(
-            CheckProfilesI(self.installed, self.args.parent)
-        )
         tests = [
+            CheckProfilesI(self.installed, self.args.parent),
             CheckLinksI(self.installed),
             CheckLinkBlacklistI(self.args.superforce),
             CheckLinkDirsI(self.args.makedirs),
             CheckLinkExistsI(self.args.force),
             CheckDynamicFilesI(True)
         ]
-        difflog.run_interpreter(*tests)
-        difflog.run_interpreter(RootNeededI())
-        difflog.run_interpreter(PrintI())
+        difflog.run_pipeline(tests, [RootNeededI()], [PrintI()])
 
 
 class StoreDictKeyPair(argparse.Action):
@@ -449,10 +773,7 @@ if __name__ == "__main__":
     finally:
         # Write installed back to json file
         try:
-            with open(constants.INSTALLED_FILE, "w") as file:
-                file.write(json.dumps(dotm.installed, indent=4))
-                file.flush()
-            os.chown(constants.INSTALLED_FILE, get_uid(), get_gid())
+            dotm.save_installed()
         except Exception as err:
             unkw = UnkownError(err, "An unkown error occured when trying to " +
                                "write all changes back to the installed-file")
@@ -0,0 +1,233 @@
+"""Tests for the DiffSolver"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import copy
+import random
+import unittest
+from types import SimpleNamespace
+from typing import List
+from unittest import mock
+from dotmanager import differencesolver
+from dotmanager.differencelog import DiffLog
+from dotmanager.errors import FatalError
+from dotmanager.types import DiffLogData
+from dotmanager.types import InstalledLog
+from dotmanager.types import LinkDescriptor
+from dotmanager.types import ProfileResult
+
+
+DATE = "2018-01-01 00:00:00"
+
+
+def new_link(name: str, target: str, uid: int = 1000) -> LinkDescriptor:
+    """Returns a link like it is generated by a profile"""
+    return {"name": name, "target": target, "uid": uid, "gid": 1000,
+            "permission": 644}
+
+
+def new_result(name: str, links: List[LinkDescriptor],
+               profiles: List[ProfileResult] = None) -> ProfileResult:
+    """Returns a ProfileResult of a root profile"""
+    return {"name": name, "parent": None, "links": links,
+            "profiles": profiles or []}
+
+
+def reference_difflog(profile_name: str, installed_links: List[LinkDescriptor],
+                      new_links: List[LinkDescriptor]) -> DiffLogData:
+    """Resolves the links of a profile like the DiffSolver did before it
+    looked links up in dictionaries, by scanning the lists of links"""
+    def similar(link1: LinkDescriptor, link2: LinkDescriptor) -> bool:
+        return (link1["name"] == link2["name"] or
+                link1["target"] == link2["target"])
+
+    difflog = DiffLog()
+    installed_links = copy.deepcopy(installed_links)
+    new_links = copy.deepcopy(new_links)
+    count = 0
+    for installed_link in installed_links[:]:
+        for new_link in new_links[:]:
+            if installed_link == new_link:
+                installed_links.remove(installed_link)
+                new_links.remove(new_link)
+                count += 1
+                break
+    if count > 0:
+        difflog.add_info(profile_name, str(count) + " links will be left " +
+                         "untouched, no changes here...")
+    for installed_link in installed_links[:]:
+        if not any(similar(installed_link, new_link)
+                   for new_link in new_links):
+            difflog.remove_link(installed_link["name"], profile_name)
+            installed_links.remove(installed_link)
+    for new_link in new_links[:]:
+        for installed_link in installed_links[:]:
+            if similar(installed_link, new_link):
+                difflog.update_link(installed_link, new_link, profile_name)
+                installed_links.remove(installed_link)
+                break
+        else:
+            difflog.add_link(new_link, profile_name)
+    if installed_links:
+        # Installed links that were only similar to updated ones
+        raise FatalError("Couldn't resolve differences")
+    return difflog.data
+
+
+class DiffSolverTest(unittest.TestCase):
+    """Comparing installed profiles with generated ones"""
+    def setUp(self) -> None:
+        for target, value in [
+                ("dotmanager.differencelog.get_date_time_now", lambda: DATE),
+                ("dotmanager.differencesolver.save_caches", lambda: None)]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def solve(installed: InstalledLog, results: List[ProfileResult],
+              parent: str = None) -> DiffLogData:
+        """Returns the DiffLog that installs the results"""
+        args = SimpleNamespace(profiles=[result["name"]
+                                         for result in results],
+                               opt_dict=None, directory=None, parent=parent)
+        solver = differencesolver.DiffSolver(installed, args)
+        with mock.patch.object(differencesolver, "generate_roots",
+                               lambda profilenames, **kwargs: results):
+            return solver.solve(True).data
+
+    def test_add_profile(self) -> None:
+        link = new_link("/home/a", "/dotfiles/a")
+        self.assertEqual(self.solve({}, [new_result("P", [link])]), [
+            {"operation": "add_p", "profile": "P", "parent": None},
+            {"operation": "add_l", "profile": "P",
+             "symlink": {**link, "date": DATE}}
+        ])
+
+    def test_unchanged_profile(self) -> None:
+        link = new_link("/home/a", "/dotfiles/a")
+        installed = {"P": {"name": "P", "links": [{**link, "date": DATE}]}}
+        self.assertEqual(self.solve(installed, [new_result("P", [link])]), [
+            {"operation": "info", "profile": "P",
+             "message": "1 links will be left untouched, no changes here..."}
+        ])
+
+    def test_remove_and_update_links(self) -> None:
+        installed_links = [new_link("/home/a", "/dotfiles/a"),
+                           new_link("/home/b", "/dotfiles/b"),
+                           new_link("/home/c", "/dotfiles/c")]
+        new_links = [new_link("/home/a", "/dotfiles/a2"),
+                     new_link("/home/c", "/dotfiles/c", uid=0),
+                     new_link("/home/d", "/dotfiles/d")]
+        installed = {"P": {"name": "P", "links": installed_links}}
+        self.assertEqual(self.solve(installed, [new_result("P", new_links)]),
+                         [{"operation": "remove_l", "profile": "P",
+                           "symlink_name": "/home/b"},
+                          {"operation": "update_l", "profile": "P",
+                           "symlink1": installed_links[0],
+                           "symlink2": {**new_links[0], "date": DATE}},
+                          {"operation": "update_l", "profile": "P",
+                           "symlink1": installed_links[2],
+                           "symlink2": {**new_links[1], "date": DATE}},
+                          {"operation": "add_l", "profile": "P",
+                           "symlink": {**new_links[2], "date": DATE}},
+                          {"operation": "update_p", "profile": "P"}])
+
+    def test_remove_subprofile(self) -> None:
+        installed = {
+            "P": {"name": "P", "links": []},
+            "S": {"name": "S", "parent": "P",
+                  "links": [new_link("/home/s", "/dotfiles/s")]}
+        }
+        self.assertEqual(self.solve(installed, [new_result("P", [])]), [
+            {"operation": "remove_l", "profile": "S",
+             "symlink_name": "/home/s"},
+            {"operation": "remove_p", "profile": "S"}
+        ])
+
+    def test_move_subprofile(self) -> None:
+        link = new_link("/home/s", "/dotfiles/s")
+        installed = {
+            "P": {"name": "P", "links": []},
+            "Q": {"name": "Q", "links": []},
+            "S": {"name": "S", "parent": "P", "links": [link]}
+        }
+        subprofile = {"name": "S", "parent": None, "links": [link],
+                      "profiles": []}
+        results = [new_result("P", []), new_result("Q", [], [subprofile])]
+        self.assertEqual(self.solve(installed, results), [
+            {"operation": "info", "profile": "S",
+             "message": "1 links will be left untouched, no changes here..."},
+            {"operation": "update_p", "profile": "S", "parent": "Q"}
+        ])
+
+    def test_install_as_subprofile(self) -> None:
+        installed = {"Q": {"name": "Q", "links": []}}
+        self.assertEqual(self.solve(installed, [new_result("P", [])], "Q"), [
+            {"operation": "add_p", "profile": "P", "parent": "Q"}
+        ])
+
+    def test_links_like_the_reference(self) -> None:
+        # Few names and targets, so that many links are similar or equal
+        rand = random.Random(0)
+
+        def random_link() -> LinkDescriptor:
+            return new_link("/home/" + str(rand.randrange(5)),
+                            "/dotfiles/" + str(rand.randrange(5)),
+                            rand.randrange(2))
+
+        for _ in range(2000):
+            installed_links = [random_link()
+                               for _ in range(rand.randrange(7))]
+            new_links = [random_link() for _ in range(rand.randrange(7))]
+            installed = {"P": {"name": "P", "links": installed_links}}
+            results = [new_result("P", new_links)]
+            try:
+                expected = reference_difflog("P", installed_links, new_links)
+            except FatalError:
+                with self.assertRaises(FatalError):
+                    self.solve(installed, results)
+                continue
+            if any(operation["operation"] != "info"
+                   for operation in expected):
+                expected.append({"operation": "update_p", "profile": "P"})
+            self.assertEqual(self.solve(installed, results), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
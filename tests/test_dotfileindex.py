@@ -0,0 +1,216 @@
+"""Tests for the .dotignore matching and pruning of the dotfile index"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
+from dotmanager import constants
+from dotmanager.dotfileindex import DotIgnore
+from dotmanager.dotfileindex import DotfileIndex
+from dotmanager.dotfileindex import compile_any
+from dotmanager.dotfileindex import gitignore_to_regex
+from dotmanager.errors import PreconditionError
+
+
+class GitignoreToRegexTest(unittest.TestCase):
+    """Translating gitignore patterns into regular expressions"""
+    def matches(self, pattern: str, path: str) -> bool:
+        return re.search(gitignore_to_regex(pattern), path) is not None
+
+    def test_unanchored_pattern_matches_in_any_depth(self) -> None:
+        self.assertTrue(self.matches("*.swp", "a.swp"))
+        self.assertTrue(self.matches("*.swp", "sub/deep/a.swp"))
+        self.assertFalse(self.matches("*.swp", "a.swp.bak"))
+
+    def test_pattern_with_slash_is_anchored(self) -> None:
+        self.assertTrue(self.matches("sub/file", "sub/file"))
+        self.assertTrue(self.matches("/file", "file"))
+        self.assertFalse(self.matches("sub/file", "other/sub/file"))
+        self.assertFalse(self.matches("/file", "sub/file"))
+
+    def test_wildcards_dont_match_slashes(self) -> None:
+        self.assertTrue(self.matches("a/*/c", "a/b/c"))
+        self.assertFalse(self.matches("a/*/c", "a/b/b/c"))
+        self.assertTrue(self.matches("a/?/c", "a/b/c"))
+        self.assertFalse(self.matches("a/?/c", "a//c"))
+
+    def test_double_asterisk(self) -> None:
+        self.assertTrue(self.matches("**/build", "build"))
+        self.assertTrue(self.matches("**/build", "a/b/build"))
+        self.assertTrue(self.matches("a/**/c", "a/c"))
+        self.assertTrue(self.matches("a/**/c", "a/b/b/c"))
+        self.assertTrue(self.matches("a/**", "a/b/c"))
+
+    def test_character_classes(self) -> None:
+        self.assertTrue(self.matches("file[0-9]", "file1"))
+        self.assertFalse(self.matches("file[0-9]", "filex"))
+        self.assertTrue(self.matches("file[!0-9]", "filex"))
+        self.assertFalse(self.matches("file[!0-9]", "file1"))
+        # An unclosed bracket is taken literally
+        self.assertTrue(self.matches("file[", "file["))
+
+    def test_special_characters_are_escaped(self) -> None:
+        self.assertTrue(self.matches("a+b.txt", "a+b.txt"))
+        self.assertFalse(self.matches("a+b.txt", "aab.txt"))
+        self.assertFalse(self.matches("a.txt", "abtxt"))
+        self.assertTrue(self.matches(r"\*", "*"))
+        self.assertFalse(self.matches(r"\*", "a"))
+
+
+class CompileAnyTest(unittest.TestCase):
+    """Combining regular expressions into a single matcher"""
+    def test_no_regexes(self) -> None:
+        self.assertIsNone(compile_any([]))
+
+    def test_any_regex_is_searched(self) -> None:
+        matches = compile_any(["^a", "b$", r"\.git/"])
+        self.assertTrue(matches("abc"))
+        self.assertTrue(matches("xyb"))
+        self.assertTrue(matches("/home/.git/objects"))
+        self.assertFalse(matches("xyz"))
+
+    def test_alternatives_stay_separate(self) -> None:
+        matches = compile_any(["^a|b$", "^c"])
+        self.assertTrue(matches("xb"))
+        self.assertTrue(matches("cx"))
+        self.assertFalse(matches("xc"))
+
+    def test_regexes_that_cant_be_combined(self) -> None:
+        # Global flags are only allowed at the start of a regex
+        matches = compile_any(["^a", "(?i)^B"])
+        self.assertTrue(matches("abc"))
+        self.assertTrue(matches("bcd"))
+        self.assertFalse(matches("cde"))
+
+    def test_invalid_regex(self) -> None:
+        with self.assertRaises(PreconditionError):
+            compile_any(["(unclosed"])
+
+
+class DotIgnoreTest(unittest.TestCase):
+    """Matching and pruning of the entries of a .dotignore"""
+    directory = "/dotfiles"
+
+    def test_regex_entries(self) -> None:
+        ignore = DotIgnore(self.directory, [r"\.git/", r"\.swp$", ""])
+        self.assertTrue(ignore.ignores_file("/dotfiles/.git/config"))
+        self.assertTrue(ignore.ignores_file("/dotfiles/sub/a.swp"))
+        self.assertFalse(ignore.ignores_file("/dotfiles/bashrc"))
+
+    def test_regex_entries_prune_directories(self) -> None:
+        ignore = DotIgnore(self.directory, [r"\.git/", r"\.swp$"])
+        self.assertTrue(ignore.ignores_dir("/dotfiles/.git"))
+        self.assertFalse(ignore.ignores_dir("/dotfiles/sub"))
+        # A regex that asserts the end of the path can't prune
+        ignore = DotIgnore(self.directory, [r"/cache$"])
+        self.assertTrue(ignore.ignores_file("/dotfiles/cache"))
+        self.assertFalse(ignore.ignores_dir("/dotfiles/cache"))
+
+    def test_gitignore_entries(self) -> None:
+        ignore = DotIgnore(self.directory, ["syntax: gitignore", "*.bak",
+                                            "build/", "# comment",
+                                            "syntax: regex", "^/tmp"])
+        self.assertTrue(ignore.ignores_file("/dotfiles/sub/a.bak"))
+        self.assertTrue(ignore.ignores_dir("/dotfiles/sub/build"))
+        self.assertTrue(ignore.ignores_dir("/dotfiles/x.bak"))
+        self.assertFalse(ignore.ignores_file("/dotfiles/build"))
+        self.assertFalse(ignore.ignores_file("/dotfiles/# comment"))
+        self.assertTrue(ignore.ignores_file("/tmp/file"))
+
+    def test_negated_patterns_are_skipped(self) -> None:
+        with mock.patch("dotmanager.utils.log_warning") as log_warning:
+            ignore = DotIgnore(self.directory, ["syntax: gitignore",
+                                                "!keep"])
+        log_warning.assert_called_once()
+        self.assertFalse(ignore.ignores_file("/dotfiles/keep"))
+
+    def test_unknown_syntax(self) -> None:
+        with self.assertRaises(PreconditionError):
+            DotIgnore(self.directory, ["syntax: glob"])
+
+
+class DotfileIndexTest(unittest.TestCase):
+    """Building the index with a .dotignore"""
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        cache_dir = os.path.join(self.tmp.name, "cache")
+        os.mkdir(cache_dir)
+        patcher = mock.patch.object(constants, "CACHE_DIRECTORY", cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = os.path.join(self.tmp.name, "files")
+        for path in ["bashrc", "work%bashrc", "sub/vimrc", "sub/a.bak",
+                     ".git/objects/ab", "build/out", "sub/build/out"]:
+            self.write(path)
+
+    def write(self, path: str, content: str = "") -> None:
+        path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(content)
+
+    def test_ignored_files_and_directories(self) -> None:
+        self.write(".dotignore", "\\.git/\nsyntax: gitignore\n*.bak\n" +
+                   "build/\n")
+        index = DotfileIndex(self.directory)
+        names = sorted(os.path.relpath(os.path.join(root, name),
+                                       self.directory)
+                       for root, name in index.files)
+        self.assertEqual(names, [".dotignore", "bashrc", "sub/vimrc",
+                                 "work%bashrc"])
+        self.assertEqual(set(index.targets["bashrc"]), {None, "work"})
+
+    def test_ignored_directories_are_pruned(self) -> None:
+        self.write(".dotignore", "\\.git/\nsyntax: gitignore\nbuild/\n")
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            DotfileIndex(self.directory)
+        listed = sorted(os.path.relpath(call[0][0], self.directory)
+                        for call in scandir.call_args_list)
+        self.assertEqual(listed, [".", "sub"])
+
+    def test_without_dotignore(self) -> None:
+        index = DotfileIndex(self.directory)
+        self.assertEqual(len(index.files), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
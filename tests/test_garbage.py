@@ -0,0 +1,135 @@
+"""Tests for removing dynamic files that are not used anymore"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest import mock
+from dotmanager import constants
+from dotmanager.dynamicfile import find_garbage
+from dotmgr import DotManager
+
+
+class GarbageTest(unittest.TestCase):
+    """Finding and removing unused dynamic files"""
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        # Dynamic files are stored relative to the working directory
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp.name)
+        self.used = self.write("data/decrypted/used#abc")
+        self.used_backup = self.write("data/decrypted/used#abc.bak")
+        self.unused = self.write("data/decrypted/old#def", "x" * 10)
+        self.unused_backup = self.write("data/decrypted/old#def.bak")
+        self.merged = self.write("data/merged/old#123", "x" * 5)
+        # Files without a checksum weren't generated by Dotmanager
+        self.write("data/merged/README")
+        os.mkdir(os.path.join(self.tmp.name, "data/merged/dir#456"))
+
+    def write(self, path: str, content: str = "") -> str:
+        path = os.path.join(self.tmp.name, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def test_find_garbage(self) -> None:
+        self.assertEqual(find_garbage({self.used}),
+                         [self.unused, self.unused_backup, self.merged])
+
+    def test_find_garbage_without_directories(self) -> None:
+        empty = os.path.join(self.tmp.name, "empty")
+        os.mkdir(empty)
+        os.chdir(empty)
+        self.assertEqual(find_garbage(set()), [])
+
+    def collect_garbage(self, dryrun: bool) -> str:
+        """Runs the garbage collection with the used file installed and
+        returns its output"""
+        installed_file = self.write("data/installed/default.json",
+                                    json.dumps({
+                                        "@version": constants.VERSION,
+                                        "Main": {"name": "Main", "links": [
+                                            {"target": self.used}
+                                        ]}
+                                    }))
+        with mock.patch("os.chdir"):
+            dotm = DotManager()
+        dotm.args = SimpleNamespace(dryrun=dryrun)
+        output = io.StringIO()
+        with mock.patch.object(constants, "INSTALLED_FILE",
+                               installed_file), \
+                mock.patch("dotmgr.get_manifest") as get_manifest, \
+                mock.patch("dotmgr.get_file_stats") as get_file_stats, \
+                mock.patch("dotmgr.save_caches") as save_caches, \
+                redirect_stdout(output):
+            dotm.collect_garbage()
+        self.assertEqual(get_manifest().prune.called, not dryrun)
+        self.assertEqual(get_file_stats().prune.called, not dryrun)
+        self.assertEqual(save_caches.called, not dryrun)
+        return output.getvalue()
+
+    def test_dryrun(self) -> None:
+        output = self.collect_garbage(True)
+        self.assertEqual(output.splitlines(), [
+            self.unused, self.unused_backup, self.merged,
+            "3 files (15 bytes) would be removed."
+        ])
+        for file in (self.unused, self.unused_backup, self.merged):
+            self.assertTrue(os.path.exists(file))
+
+    def test_removal(self) -> None:
+        dryrun = self.collect_garbage(True).splitlines()
+        output = self.collect_garbage(False)
+        self.assertEqual(output, "Removed 3 files (15 bytes).\n")
+        for file in dryrun[:-1]:
+            self.assertFalse(os.path.exists(file))
+        for file in (self.used, self.used_backup):
+            self.assertTrue(os.path.exists(file))
+        self.assertEqual(self.collect_garbage(True),
+                         "0 files (0 bytes) would be removed.\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
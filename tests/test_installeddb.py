@@ -0,0 +1,192 @@
+"""Tests for the SQLite backend of the installed-file"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import copy
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from dotmanager import constants
+from dotmanager.installeddb import InstalledDatabase
+from dotmanager.interpreters import UpdateInstalledI
+from dotmanager.journal import Journal
+from dotmanager.types import InstalledLog
+from dotmanager.types import LinkDescriptor
+from dotmgr import DotManager
+
+
+DATE = "2018-01-01 00:00:00"
+LATER = "2018-01-02 00:00:00"
+
+
+def new_link(name: str, target: str) -> LinkDescriptor:
+    """Returns an installed link"""
+    return {"name": name, "target": target, "uid": 1000, "gid": 1000,
+            "permission": 644, "date": DATE}
+
+
+def new_installed() -> InstalledLog:
+    """Returns an installed-file with a root profile and a subprofile"""
+    return {
+        "@version": constants.VERSION,
+        "@fingerprint": {"args": "abc", "profiles": {"Main": "def"}},
+        "Main": {"name": "Main", "installed": DATE, "updated": DATE,
+                 "links": [new_link("/home/a", "/dotfiles/a"),
+                           new_link("/home/b", "/dotfiles/b")]},
+        "Sub": {"name": "Sub", "parent": "Main", "installed": DATE,
+                "updated": LATER, "links": [new_link("/home/c",
+                                                     "/dotfiles/c")]},
+        "Empty": {"name": "Empty", "installed": DATE, "updated": DATE,
+                  "links": []}
+    }
+
+
+class InstalledDatabaseTest(unittest.TestCase):
+    """Reading, writing and updating the database"""
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "installed.sqlite")
+
+    def test_write_and_read(self) -> None:
+        database = InstalledDatabase(self.path)
+        database.write(new_installed())
+        database.close()
+        database = InstalledDatabase(self.path)
+        self.assertEqual(database.read(), new_installed())
+        database.close()
+
+    def test_read_some_profiles(self) -> None:
+        database = InstalledDatabase(self.path)
+        database.write(new_installed())
+        installed = database.read(["Sub", "Empty", "Missing"])
+        database.close()
+        expected = new_installed()
+        del expected["Main"]
+        self.assertEqual(installed, expected)
+
+    def test_operations_like_the_json_file(self) -> None:
+        operations = [
+            {"operation": "add_p", "profile": "New", "parent": None},
+            {"operation": "add_l", "profile": "New",
+             "symlink": new_link("/home/n", "/dotfiles/n")},
+            {"operation": "update_l", "profile": "Main",
+             "symlink1": new_link("/home/a", "/dotfiles/a"),
+             "symlink2": new_link("/home/a", "/dotfiles/a2")},
+            {"operation": "remove_l", "profile": "Sub",
+             "symlink_name": "/home/c"},
+            {"operation": "remove_p", "profile": "Sub"},
+            {"operation": "update_p", "profile": "Empty", "parent": "New"},
+            {"operation": "update_p", "profile": "Main"},
+            {"operation": "fingerprint", "fingerprint": None}
+        ]
+        installed = new_installed()
+        updater = UpdateInstalledI(installed, LATER)
+        database = InstalledDatabase(self.path)
+        database.write(new_installed())
+        database.open()
+        for dop in operations:
+            updater.call_operation(copy.deepcopy(dop))
+            database.append(LATER, copy.deepcopy(dop))
+        database.close()
+        database = InstalledDatabase(self.path)
+        self.assertEqual(database.read(), installed)
+        database.close()
+
+
+class ConvertInstalledTest(unittest.TestCase):
+    """Converting the installed-file when installedBackend changed"""
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.base = os.path.join(self.tmp.name, "installed")
+
+    def convert(self, backend: str) -> None:
+        """Converts the installed-file to another backend"""
+        # The logger of dotmgr is only set up when it's executed
+        with mock.patch.object(constants, "INSTALLED_BACKEND", backend), \
+                mock.patch.object(constants, "INSTALLED_FILE",
+                                  self.base + "." + backend), \
+                mock.patch("dotmgr.logger", create=True):
+            DotManager.convert_installed()
+
+    def test_round_trip(self) -> None:
+        with open(self.base + ".json", "w") as file:
+            json.dump(new_installed(), file)
+        self.convert("sqlite")
+        self.assertFalse(os.path.exists(self.base + ".json"))
+        self.assertEqual(DotManager.read_installed(self.base + ".sqlite"),
+                         new_installed())
+        self.convert("json")
+        self.assertFalse(os.path.exists(self.base + ".sqlite"))
+        with open(self.base + ".json") as file:
+            installed = json.load(file)
+        # Every written JSON installed-file starts a new journal generation
+        self.assertEqual(installed.pop("@generation"), 1)
+        self.assertEqual(installed, new_installed())
+
+    def test_journal_is_converted(self) -> None:
+        installed = new_installed()
+        installed["@generation"] = 1
+        with open(self.base + ".json", "w") as file:
+            json.dump(installed, file)
+        journal = Journal(self.base + ".json", 1)
+        journal.append(LATER, {"operation": "add_p", "profile": "New",
+                               "parent": "Main"})
+        journal.close()
+        self.convert("sqlite")
+        self.assertFalse(os.path.exists(self.base + ".json.journal"))
+        installed = DotManager.read_installed(self.base + ".sqlite")
+        self.assertEqual(installed["New"], {"name": "New", "parent": "Main",
+                                            "installed": LATER,
+                                            "updated": LATER, "links": []})
+
+    def test_existing_file_is_kept(self) -> None:
+        for extension in (".json", ".sqlite"):
+            with open(self.base + extension, "w") as file:
+                file.write("{}")
+        self.convert("json")
+        self.assertTrue(os.path.exists(self.base + ".sqlite"))
+        with open(self.base + ".json") as file:
+            self.assertEqual(file.read(), "{}")
+
+
+if __name__ == "__main__":
+    unittest.main()
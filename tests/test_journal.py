@@ -0,0 +1,194 @@
+"""Tests for the journal of the installed-file"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from dotmanager import constants
+from dotmanager.errors import PreconditionError
+from dotmanager.journal import Journal
+from dotmanager.journal import write_installed
+from dotmanager.types import InstalledLog
+from dotmgr import DotManager
+
+
+DATE = "2018-01-01 00:00:00"
+ADD_PROFILE = {"operation": "add_p", "profile": "New", "parent": None}
+ADD_LINK = {"operation": "add_l", "profile": "New",
+            "symlink": {"name": "/home/a", "target": "/dotfiles/a",
+                        "uid": 1000, "gid": 1000, "permission": 644,
+                        "date": DATE}}
+NEW_PROFILE = {"name": "New", "installed": DATE, "updated": DATE,
+               "links": [ADD_LINK["symlink"]]}
+
+
+class JournalTest(unittest.TestCase):
+    """Replaying and compacting the journal of a JSON installed-file"""
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "installed.json")
+        write_installed(self.path, {"@version": constants.VERSION})
+
+    def append(self, *dops: dict, generation: int = 1) -> None:
+        """Records operations in the journal"""
+        journal = Journal(self.path, generation)
+        for dop in dops:
+            journal.append(DATE, dop)
+        journal.close()
+
+    def read(self) -> InstalledLog:
+        """Reads the installed-file and replays its journal"""
+        return DotManager.read_installed(self.path)
+
+    def test_replay(self) -> None:
+        self.append(ADD_PROFILE, ADD_LINK)
+        self.assertEqual(self.read(), {"@version": constants.VERSION,
+                                       "@generation": 1,
+                                       "New": NEW_PROFILE})
+
+    def test_appending_continues_the_journal(self) -> None:
+        self.append(ADD_PROFILE)
+        self.append(ADD_LINK)
+        self.assertEqual(self.read()["New"], NEW_PROFILE)
+
+    def test_outdated_journal_is_ignored(self) -> None:
+        self.append(ADD_PROFILE, ADD_LINK)
+        # The installed-file was rewritten, but the journal wasn't removed
+        with open(self.path) as file:
+            installed = json.load(file)
+        installed["@generation"] = 2
+        with open(self.path, "w") as file:
+            json.dump(installed, file)
+        self.assertNotIn("New", self.read())
+        # A new journal replaces the outdated one
+        self.append(ADD_PROFILE, generation=2)
+        self.assertEqual(len(list(Journal(self.path, 2).read())), 1)
+
+    def test_incomplete_record(self) -> None:
+        self.append(ADD_PROFILE, ADD_LINK)
+        with open(self.path + ".journal", "rb+") as file:
+            file.truncate(os.path.getsize(self.path + ".journal") - 10)
+        with mock.patch("dotmanager.journal.log_warning") as log_warning:
+            installed = self.read()
+        log_warning.assert_called_once()
+        self.assertEqual(installed["New"]["links"], [])
+        # The incomplete record is removed before new ones are appended
+        self.append(ADD_LINK)
+        self.assertEqual(self.read()["New"], NEW_PROFILE)
+
+    def test_corrupted_journal(self) -> None:
+        self.append(ADD_PROFILE)
+        with open(self.path + ".journal", "a") as file:
+            file.write("not json\n")
+        with self.assertRaises(PreconditionError):
+            self.read()
+
+    def test_compaction(self) -> None:
+        journal = Journal(self.path, 1)
+        self.assertFalse(journal.needs_compaction())
+        self.append(*[ADD_PROFILE, ADD_LINK] * 3)
+        self.assertTrue(journal.needs_compaction())
+        installed = self.read()
+        write_installed(self.path, installed)
+        self.assertFalse(journal.exists())
+        self.assertEqual(self.read(), {**installed, "@generation": 2})
+
+
+class SaveInstalledTest(unittest.TestCase):
+    """When the installed-file is written back"""
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "installed.json")
+        # An installed-file that is bigger than a few records
+        main = {**NEW_PROFILE, "name": "Main",
+                "links": [ADD_LINK["symlink"]] * 5}
+        write_installed(self.path, {"@version": constants.VERSION,
+                                    "Main": main})
+        for target, value in [("INSTALLED_FILE", self.path),
+                              ("INSTALLED_BACKEND", "json"),
+                              ("JOURNAL", True)]:
+            patcher = mock.patch.object(constants, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with mock.patch("os.chdir"):
+            self.dotm = DotManager()
+        self.dotm.installed = DotManager.read_installed(self.path)
+        self.dotm.journal = Journal(self.path, 1)
+
+    def execute(self, *dops: dict) -> None:
+        """Records operations like they were executed"""
+        for dop in dops:
+            self.dotm.journal.append(DATE, dop)
+        self.dotm.installed = DotManager.read_installed(self.path)
+        self.dotm.dirty = True
+
+    def test_small_journal_is_kept(self) -> None:
+        self.execute(ADD_PROFILE)
+        self.dotm.save_installed()
+        self.assertTrue(self.dotm.journal.exists())
+        self.assertEqual(self.read_file()["@generation"], 1)
+        self.assertNotIn("New", self.read_file())
+
+    def test_big_journal_is_compacted(self) -> None:
+        self.execute(ADD_PROFILE, *[ADD_LINK] * 10)
+        self.dotm.save_installed()
+        self.assertFalse(self.dotm.journal.exists())
+        self.assertEqual(self.read_file()["@generation"], 2)
+        self.assertEqual(self.read_file()["New"]["links"],
+                         [ADD_LINK["symlink"]] * 10)
+
+    def test_without_journal_mode(self) -> None:
+        self.execute(ADD_PROFILE)
+        with mock.patch.object(constants, "JOURNAL", False):
+            self.dotm.save_installed()
+        self.assertFalse(self.dotm.journal.exists())
+        self.assertIn("New", self.read_file())
+
+    def read_file(self) -> InstalledLog:
+        """Reads the installed-file without its journal"""
+        with open(self.path) as file:
+            return json.load(file)
+
+
+if __name__ == "__main__":
+    unittest.main()
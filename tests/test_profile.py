@@ -0,0 +1,117 @@
+"""Tests for generating profiles and their subprofiles"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import unittest
+from unittest import mock
+from dotmanager import constants
+from dotmanager.errors import GenerationError
+from dotmanager.profile import Profile
+
+
+class Tagged(Profile):
+    def generate(self):
+        tags("tagged")
+        self.seen = has_tag("tagged")
+
+
+class Parent(Profile):
+    def generate(self):
+        tags("parent")
+        subprof("Tagged", "Child")
+        self.seen = has_tag("tagged")
+
+
+class Child(Profile):
+    def generate(self):
+        if has_tag("tagged") and has_tag("parent"):
+            tags("child")
+
+
+class Failing(Profile):
+    def generate(self):
+        raise ValueError("failed")
+
+
+PROFILES = {cls.__name__: cls for cls in (Tagged, Parent, Child, Failing)}
+
+
+class ProfileTest(unittest.TestCase):
+    """Generating profiles and their subprofiles"""
+    def setUp(self) -> None:
+        for target, value in [
+                ("dotmanager.profile.import_profile_class", PROFILES.get),
+                ("dotmanager.constants.DEFAULTS",
+                 {**constants.FALLBACK, "tags": []})]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_methods_are_bound_in_the_module(self) -> None:
+        profile = Tagged()
+        profile.get()
+        self.assertTrue(profile.seen)
+        self.assertNotIn("tags", globals())
+        self.assertNotIn("has_tag", globals())
+
+    def test_subprofiles_share_the_tags(self) -> None:
+        profile = Parent()
+        result = profile.get()
+        # The parent is called again after its subprofiles were generated
+        self.assertTrue(profile.seen)
+        self.assertEqual([subprofile["name"]
+                          for subprofile in result["profiles"]],
+                         ["Tagged", "Child"])
+        self.assertIs(result["profiles"][0]["parent"], profile)
+        # Root profiles share the tags with the defaults
+        self.assertEqual(constants.DEFAULTS["tags"],
+                         ["parent", "tagged", "child"])
+
+    def test_bindings_are_restored_after_an_error(self) -> None:
+        with self.assertRaises(GenerationError):
+            Failing().get()
+        self.assertNotIn("subprof", globals())
+
+    def test_options_are_shared(self) -> None:
+        options = {**constants.DEFAULTS, "tags": ["given"]}
+        Tagged(options).get()
+        self.assertEqual(options["tags"], ["given", "tagged"])
+
+
+if __name__ == "__main__":
+    unittest.main()
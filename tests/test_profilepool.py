@@ -0,0 +1,200 @@
+"""Tests for merging the outcomes of profiles generated in parallel"""
+
+###############################################################################
+#
+# Copyright 2018 Erik Schulz
+#
+# This file is part of Dotmanager.
+#
+# Dotmanger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Dotmanger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Dotmanger.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Diese Datei ist Teil von Dotmanger.
+#
+# Dotmanger ist Freie Software: Sie können es unter den Bedingungen
+# der GNU General Public License, wie von der Free Software Foundation,
+# Version 3 der Lizenz oder (nach Ihrer Wahl) jeder neueren
+# veröffentlichten Version, weiter verteilen und/oder modifizieren.
+#
+# Dotmanger wird in der Hoffnung, dass es nützlich sein wird, aber
+# OHNE JEDE GEWÄHRLEISTUNG, bereitgestellt; sogar ohne die implizite
+# Gewährleistung der MARKTFÄHIGKEIT oder EIGNUNG FÜR EINEN BESTIMMTEN ZWECK.
+# Siehe die GNU General Public License für weitere Details.
+#
+# Sie sollten eine Kopie der GNU General Public License zusammen mit diesem
+# Programm erhalten haben. Wenn nicht, siehe <https://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import unittest
+from concurrent.futures import Future
+from types import SimpleNamespace
+from typing import Any
+from unittest import mock
+from dotmanager import profilepool
+from dotmanager.errors import GenerationError
+from dotmanager.profilecache import Recording
+from dotmanager.profilecache import record
+from dotmanager.profilepool import ParentProfile
+
+
+def new_recording(lookups: list, warnings: list,
+                  cacheable: bool = True) -> Recording:
+    """Returns a recording like a worker sends it"""
+    recording = Recording(quiet=True)
+    for lookup in lookups:
+        recording.add([lookup], [])
+    recording.warnings = warnings
+    recording.cacheable = cacheable
+    return recording
+
+
+def new_outcome(name: str, error: Exception = None,
+                shared: list = None) -> Future:
+    """Returns a finished job of the pool"""
+    result = None if error else {"name": name, "parent": None, "links": [],
+                                 "profiles": []}
+    outcome = Future()
+    outcome.set_result((result, error,
+                        new_recording([["f", [name], name]],
+                                      ["warning of " + name]),
+                        {"/manifest/" + name: {}}, {"/stats/" + name: []},
+                        shared or []))
+    return outcome
+
+
+class MergeOutcomeTest(unittest.TestCase):
+    """Merging what a worker did into the main process"""
+    def setUp(self) -> None:
+        self.manifest = mock.Mock()
+        self.file_stats = mock.Mock()
+        self.log_warning = mock.Mock()
+        for target, value in [
+                ("dotmanager.profilepool.get_manifest",
+                 lambda: self.manifest),
+                ("dotmanager.profilepool.get_file_stats",
+                 lambda: self.file_stats),
+                ("dotmanager.profilecache.log_warning", self.log_warning)]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_merge_outcome(self) -> None:
+        result = {"name": "P"}
+        recording = new_recording([["f", [1], 2]], ["careful"], False)
+        outer = Recording()
+        with record(outer):
+            merged = profilepool.merge_outcome(result, None, recording,
+                                               {"/a": {}}, {"/b": [1]})
+        self.assertEqual(merged, (result, recording))
+        self.manifest.merge.assert_called_once_with({"/a": {}})
+        self.file_stats.merge.assert_called_once_with({"/b": [1]})
+        self.assertEqual(list(outer.lookups.values()), [["f", [1], 2]])
+        self.assertEqual(outer.warnings, ["careful"])
+        self.assertFalse(outer.cacheable)
+        self.log_warning.assert_called_once_with("careful")
+
+    def test_error_is_raised_after_merging(self) -> None:
+        error = GenerationError("P", "failed")
+        with self.assertRaises(GenerationError):
+            profilepool.merge_outcome(None, error, new_recording([], ["w"]),
+                                      {"/a": {}}, {})
+        self.manifest.merge.assert_called_once_with({"/a": {}})
+        self.log_warning.assert_called_once_with("w")
+
+    def test_outcomes_are_merged_in_order(self) -> None:
+        outcomes = [new_outcome(name) for name in ("A", "B", "C")]
+        merged = profilepool.merge_outcomes(outcomes, [[], [], []])
+        names = [result["name"] for result, _, _ in merged]
+        self.assertEqual(names, ["A", "B", "C"])
+        self.assertEqual([call[0][0] for call
+                          in self.log_warning.call_args_list],
+                         ["warning of A", "warning of B", "warning of C"])
+
+    def test_jobs_after_an_error_are_cancelled(self) -> None:
+        pending = Future()
+        outcomes = [new_outcome("A"),
+                    new_outcome("B", GenerationError("B", "failed")),
+                    pending]
+        merged = profilepool.merge_outcomes(outcomes, [[], [], []])
+        self.assertEqual(next(merged)[0]["name"], "A")
+        with self.assertRaises(GenerationError):
+            next(merged)
+        self.assertTrue(pending.cancelled())
+
+    def test_changed_shared_objects(self) -> None:
+        tags = ["a"]
+        defaults = {"tags": tags}
+        outcomes = [new_outcome("A", shared=[["a"], {"tags": ["a"]}]),
+                    new_outcome("B", shared=[["a", "b"],
+                                             {"tags": ["a", "b"]}])]
+        merged = profilepool.merge_outcomes(outcomes, [[tags, defaults]] * 2)
+        self.assertFalse(next(merged)[2])
+        self.assertTrue(next(merged)[2])
+        # The changes are applied to the objects of the main process
+        self.assertEqual(tags, ["a", "b"])
+        self.assertIs(defaults["tags"], tags)
+
+
+class SharedObjectsTest(unittest.TestCase):
+    """Lists and dicts that profiles share"""
+    def test_get_shared(self) -> None:
+        tags = []
+        extra = {}
+        options = {"tags": tags, "name": "", "extra": extra, "uid": 0}
+        shared = profilepool.get_shared(options)
+        self.assertEqual(len(shared), 2)
+        self.assertIs(shared[0], tags)
+        self.assertIs(shared[1], extra)
+
+    def test_apply_changes(self) -> None:
+        tags = ["a"]
+        extra = {"x": 1}
+        objects = [tags, extra]
+        self.assertFalse(profilepool.apply_changes(objects,
+                                                   [["a"], {"x": 1}]))
+        self.assertTrue(profilepool.apply_changes(objects,
+                                                  [[], {"y": 2}]))
+        self.assertIs(objects[0], tags)
+        self.assertEqual(tags, [])
+        self.assertEqual(extra, {"y": 2})
+
+
+class ReplaceParentsTest(unittest.TestCase):
+    """Sending results with parent profiles to the main process"""
+    @staticmethod
+    def profile(name: str, parent: Any) -> SimpleNamespace:
+        return SimpleNamespace(name=name, parent=parent)
+
+    def test_parents_are_replaced(self) -> None:
+        root = ParentProfile("Root", None)
+        middle = self.profile("Middle", root)
+        leaf_result = {"name": "Leaf", "parent": middle, "links": [],
+                       "profiles": []}
+        result = {"name": "Middle", "parent": root, "links": [],
+                  "profiles": [leaf_result]}
+        profilepool.replace_parents(result)
+        self.assertEqual(result["parent"], root)
+        self.assertEqual(leaf_result["parent"],
+                         ParentProfile("Middle", ParentProfile("Root", None)))
+
+    def test_root_profile(self) -> None:
+        result = {"name": "Root", "parent": None, "links": [],
+                  "profiles": []}
+        profilepool.replace_parents(result)
+        self.assertIsNone(result["parent"])
+
+
+if __name__ == "__main__":
+    unittest.main()